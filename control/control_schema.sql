@@ -35,3 +35,41 @@ CREATE TABLE IF NOT EXISTS process_logs (
 -- ===============================
 CREATE INDEX idx_process_name ON process_logs(process_name);
 CREATE INDEX idx_status ON process_logs(status);
+
+-- ===============================
+--  Hàng đợi URL cho crawl phân tán
+--  (extract/work_queue.py): coordinator
+--  enqueue, worker lease + heartbeat.
+-- ===============================
+CREATE TABLE IF NOT EXISTS crawl_queue (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+
+    run_key VARCHAR(64) NOT NULL,
+    -- Tên file raw của lần extract (raw_laptop_<ts>)
+
+    site VARCHAR(50) NOT NULL,
+    url VARCHAR(700) NOT NULL,
+
+    status VARCHAR(10) NOT NULL DEFAULT 'pending',
+    -- 'pending', 'leased', 'done', 'failed'
+
+    lease_owner VARCHAR(100) NULL,
+    lease_expires DOUBLE NULL,
+    -- epoch giây; lease quá hạn được trả về pending
+
+    attempts INT NOT NULL DEFAULT 0,
+    item_json MEDIUMTEXT NULL,
+    error TEXT NULL,
+    collected TINYINT NOT NULL DEFAULT 0,
+    updated_at DOUBLE NULL,
+
+    UNIQUE KEY uq_crawl_queue_run_url (run_key, url),
+    KEY idx_crawl_queue_status (status, lease_expires)
+);
+
+-- Run đang mở của coordinator (heartbeat epoch giây): worker
+-- không thoát vì rảnh khi coordinator còn discovery.
+CREATE TABLE IF NOT EXISTS crawl_queue_runs (
+    run_key VARCHAR(64) PRIMARY KEY,
+    heartbeat DOUBLE NOT NULL
+);
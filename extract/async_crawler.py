@@ -0,0 +1,123 @@
+"""Asyncio crawl engine (chọn bằng EXTRACT_ENGINE=async hoặc run_extract(engine="async")).
+
+- Các site trong SITES được crawl song song, không tuần tự như harvest_site.
+- Trang sản phẩm được tải với nhiều request đồng thời, giới hạn bởi semaphore
+  tổng và semaphore theo host.
+- HTML được đẩy sang process pool (EXTRACT_PARSE_PROCESSES) chạy parse_static,
+  kết quả trả về ngay khi xong từng trang.
+
+Tải trang bằng fetch_product_html trên thread pool I/O, cùng đường đi với engine
+thread: render_memo (bỏ GET tĩnh), token bucket + slot AIMD theo host, HTTP cache,
+stream, html_store, record/replay archive và ghi lỗi cho dead letter. Không dùng
+aiohttp (không có trong requ.txt và sẽ phải lặp lại toàn bộ phần trên).
+Item trả về giữ nguyên dạng dict của parse_product_page.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from tqdm import tqdm
+
+from extract import frontier
+from extract.crawler import plan_site_urls, note_failed_fetch, PARSE_PROCESSES
+from extract.extract_utils import configure_session
+from extract.page_parser import fetch_product_html, parse_static, finish_product
+from extract.rate_limiter import host_of
+
+ASYNC_MAX_INFLIGHT = int(os.environ.get("EXTRACT_ASYNC_MAX_INFLIGHT", "200"))
+ASYNC_PER_HOST = int(os.environ.get("EXTRACT_ASYNC_PER_HOST", "50"))
+
+
+class AsyncFetcher:
+    """Tải HTML trang sản phẩm với semaphore tổng + semaphore theo host."""
+
+    def __init__(self, max_inflight=ASYNC_MAX_INFLIGHT, per_host=ASYNC_PER_HOST):
+        self.max_inflight = max_inflight
+        self.per_host = per_host
+        self.inflight = asyncio.Semaphore(max_inflight)
+        self.host_sems = {}
+        self.io_pool = None
+
+    async def __aenter__(self):
+        configure_session(pool_size=self.per_host)
+        self.io_pool = ThreadPoolExecutor(max_workers=self.max_inflight, thread_name_prefix="async-io")
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.io_pool is not None:
+            self.io_pool.shutdown(wait=True)
+
+    def _host_sem(self, url):
+        host = host_of(url)
+        sem = self.host_sems.get(host)
+        if sem is None:
+            sem = self.host_sems[host] = asyncio.Semaphore(self.per_host)
+        return sem
+
+    async def fetch(self, url, source):
+        """(html, rendered) như fetch_product_html; html None nếu không tải được."""
+        async with self.inflight, self._host_sem(url):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.io_pool, fetch_product_html, url, source)
+
+
+async def _crawl_site(fetcher, parse_pool, site_key, on_item=None, on_done=None, skip_urls=None, on_failed=None):
+    loop = asyncio.get_running_loop()
+    urls = await loop.run_in_executor(None, plan_site_urls, site_key, skip_urls)
+
+    async def one(url):
+        # fetch_product_html đã lưu html_store (trang đầy đủ)
+        html, rendered = await fetcher.fetch(url, site_key)
+        if not html:
+            return url, None, False
+        state = await loop.run_in_executor(parse_pool, parse_static, url, html)
+        # finish_product có thể render / ghi render_memo → chạy trên thread, không chặn event loop
+        item = await loop.run_in_executor(None, finish_product, url, site_key, state, rendered)
+        return url, item, True
+
+    tasks = [asyncio.ensure_future(one(u)) for u in urls]
+    results = []
+    for fut in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc=f"Crawling {site_key} (async)"):
+        try:
+            url, item, fetched = await fut
+        except Exception as e:
+            logging.warning(f"Parse error: {e}")
+            continue
+        if fetched and frontier.FRONTIER_ENABLED:
+            frontier.record_fetch(url, item)
+        if item:
+            # Có on_item thì không giữ item trong RAM
+            if on_item:
+                on_item(item)
+            else:
+                results.append(item)
+        if not fetched:
+            note_failed_fetch(site_key, url, on_failed)
+        elif on_done:
+            on_done(url)
+    return results
+
+
+async def harvest_sites_async(site_keys, on_item=None, on_done=None, skip_urls=None, on_failed=None):
+    """Crawl đồng thời nhiều site; trả về {site_key: list item hoặc Exception}.
+
+    Tham số on_item / on_done / skip_urls / on_failed giống harvest_site."""
+    if PARSE_PROCESSES > 1:
+        parse_pool = ProcessPoolExecutor(max_workers=PARSE_PROCESSES)
+    else:
+        parse_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="parse")
+    async with AsyncFetcher() as fetcher:
+        with parse_pool:
+            out = await asyncio.gather(
+                *[_crawl_site(fetcher, parse_pool, k, on_item, on_done, skip_urls, on_failed) for k in site_keys],
+                return_exceptions=True,
+            )
+    return dict(zip(site_keys, out))
+
+
+def run_harvest_async(site_keys, on_item=None, on_done=None, skip_urls=None, on_failed=None):
+    """Điểm vào đồng bộ cho run_extract."""
+    return asyncio.run(harvest_sites_async(
+        list(site_keys), on_item=on_item, on_done=on_done, skip_urls=skip_urls, on_failed=on_failed
+    ))
@@ -0,0 +1,184 @@
+"""Giới hạn số request đồng thời theo host, tự điều chỉnh kiểu AIMD.
+
+Mỗi host có một AimdLimiter: worker gọi `slot(url)` quanh request. Sau mỗi cửa sổ
+EXTRACT_CONCURRENCY_WINDOW request:
+- p95 latency <= EXTRACT_CONCURRENCY_TARGET_P95 và tỉ lệ lỗi <= EXTRACT_CONCURRENCY_MAX_ERRORS
+  → tăng limit thêm 1 (additive increase);
+- p95 vượt ngưỡng → giảm nhẹ (x0.9);
+- 429 / 5xx / timeout → giảm một nửa ngay (multiplicative decrease), tối đa một lần
+  mỗi cooldown để một loạt lỗi không đẩy limit xuống đáy.
+Token bucket của rate_limiter vẫn áp dụng; limiter này chỉ quyết định số request
+đang bay. EXTRACT_CONCURRENCY_ADAPTIVE=0 để quay lại số worker cố định.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from extract.rate_limiter import host_of
+
+ADAPTIVE = os.environ.get("EXTRACT_CONCURRENCY_ADAPTIVE", "1").lower() not in ("0", "false", "no")
+DEFAULT_INITIAL = int(os.environ.get("EXTRACT_CONCURRENCY_INITIAL", "4"))
+DEFAULT_MIN = 1
+DEFAULT_MAX = int(os.environ.get("EXTRACT_CONCURRENCY_MAX", "32"))
+TARGET_P95 = float(os.environ.get("EXTRACT_CONCURRENCY_TARGET_P95", "3.0"))
+MAX_ERROR_RATE = float(os.environ.get("EXTRACT_CONCURRENCY_MAX_ERRORS", "0.05"))
+WINDOW = int(os.environ.get("EXTRACT_CONCURRENCY_WINDOW", "20"))
+DECREASE_COOLDOWN = 2.0
+
+
+def _p95(values):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+
+class AimdLimiter:
+    def __init__(self, host, initial=DEFAULT_INITIAL, min_limit=DEFAULT_MIN, max_limit=DEFAULT_MAX):
+        self.host = host
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = min(self.max_limit, max(self.min_limit, int(initial)))
+        self.inflight = 0
+        self.cond = threading.Condition()
+        self.window = []          # (latency, error) của cửa sổ hiện tại
+        self.recent = []          # WINDOW mẫu gần nhất, cho log
+        self.completed = 0
+        self.errors = 0
+        self.last_decrease = 0.0
+
+    def acquire(self):
+        with self.cond:
+            while self.inflight >= self.limit:
+                self.cond.wait()
+            self.inflight += 1
+
+    def release(self, latency, error=False):
+        """Trả slot; error=True cho 429/5xx/timeout/lỗi kết nối."""
+        with self.cond:
+            self.inflight -= 1
+            self.completed += 1
+            self.errors += int(error)
+            self.window.append((latency, error))
+            self.recent = (self.recent + [(latency, error)])[-WINDOW:]
+            now = time.monotonic()
+            if error and now - self.last_decrease >= DECREASE_COOLDOWN:
+                self._set_limit(self.limit // 2, now)
+                self.window = []
+            elif len(self.window) >= WINDOW:
+                p95 = _p95([lat for lat, _ in self.window])
+                err_rate = sum(e for _, e in self.window) / len(self.window)
+                if err_rate > MAX_ERROR_RATE:
+                    self._set_limit(self.limit // 2, now)
+                elif p95 > TARGET_P95:
+                    self._set_limit(int(self.limit * 0.9), now)
+                else:
+                    self._set_limit(self.limit + 1)
+                self.window = []
+            self.cond.notify_all()
+
+    def _set_limit(self, value, decreased_at=None):
+        value = min(self.max_limit, max(self.min_limit, value))
+        if decreased_at is not None and value < self.limit:
+            self.last_decrease = decreased_at
+        self.limit = value
+
+    def snapshot(self):
+        with self.cond:
+            lat = [x for x, _ in self.recent]
+            return {
+                "host": self.host,
+                "limit": self.limit,
+                "inflight": self.inflight,
+                "p95": _p95(lat),
+                "error_rate": (sum(e for _, e in self.recent) / len(self.recent)) if self.recent else 0.0,
+                "completed": self.completed,
+                "errors": self.errors,
+            }
+
+
+_limiters = {}
+_config = {}
+_lock = threading.Lock()
+
+
+def configure_host(host, initial=DEFAULT_INITIAL, min_limit=DEFAULT_MIN, max_limit=DEFAULT_MAX):
+    """Khai báo giới hạn đồng thời (ban đầu / min / max) cho một host, ví dụ từ SITES."""
+    host = host.lower()
+    with _lock:
+        _config[host] = (int(initial), int(min_limit), int(max_limit))
+        _limiters.pop(host, None)
+    logging.info(f"[CONCURRENCY] {host}: bắt đầu {initial}, min {min_limit}, max {max_limit}")
+
+
+def get_limiter(url):
+    host = host_of(url)
+    limiter = _limiters.get(host)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(host)
+            if limiter is None:
+                initial, lo, hi = _config.get(host, (DEFAULT_INITIAL, DEFAULT_MIN, DEFAULT_MAX))
+                limiter = _limiters[host] = AimdLimiter(host, initial, lo, hi)
+    return limiter
+
+
+@contextmanager
+def slot(url):
+    """Giữ một slot của host trong lúc gửi request; yield dict để caller đánh dấu lỗi.
+
+        with slot(url) as s:
+            r = session.get(...)
+            s["error"] = r.status_code in RETRY_STATUSES
+    """
+    state = {"error": False}
+    if not ADAPTIVE:
+        yield state
+        return
+    limiter = get_limiter(url)
+    limiter.acquire()
+    t0 = time.perf_counter()
+    try:
+        yield state
+    except BaseException:
+        state["error"] = True
+        raise
+    finally:
+        limiter.release(time.perf_counter() - t0, state["error"])
+
+
+def log_snapshot():
+    for limiter in list(_limiters.values()):
+        s = limiter.snapshot()
+        logging.info(
+            f"[CONCURRENCY] {s['host']}: limit {s['limit']}, đang chạy {s['inflight']}, "
+            f"p95 {s['p95']:.2f}s, lỗi {s['error_rate'] * 100:.0f}% ({s['completed']} request)"
+        )
+
+
+class Reporter:
+    """Thread ghi log_snapshot() mỗi `interval` giây trong khối with."""
+
+    def __init__(self, interval=15.0):
+        self.interval = interval
+        self.stop = threading.Event()
+        self.thread = None
+
+    def _run(self):
+        while not self.stop.wait(self.interval):
+            log_snapshot()
+
+    def __enter__(self):
+        if ADAPTIVE:
+            self.thread = threading.Thread(target=self._run, name="concurrency-log", daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.thread is not None:
+            self.stop.set()
+            self.thread.join()
+            log_snapshot()
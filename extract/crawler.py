@@ -1,31 +1,62 @@
 # crawler.py
+import hashlib
 import logging
 import os
+import queue
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from tqdm import tqdm
-from extract.extract_utils import http_get
-from extract.page_parser import parse_product_page
+from extract.extract_utils import http_get, configure_session, canonical_url, pop_failure
+from extract.page_parser import parse_product_html, fetch_product_html, parse_static, finish_product, wants_render
+from extract import concurrency, frontier
+from extract.matchers import KeywordMatcher
+from extract.rate_limiter import configure_host, host_of
+from extract.sitemap_utils import iter_sitemap
 
 # Optional Playwright-based renderer (faster for JS-heavy pages)
 try:
-    from extract.render_crawler import render_html
+    from extract.render_crawler import render_html, configure_render_profile, RENDER_POOL_SIZE
     USE_RENDERER = True
 except Exception:
     render_html = None
+    configure_render_profile = None
+    RENDER_POOL_SIZE = 1
     USE_RENDERER = False
 
 MAX_PER_SITE = 1000
-MAX_WORKERS = 12
+# Discovery lấy nhiều URL hơn budget để frontier có cái mà chọn (URL hay đổi giá trước)
+DISCOVERY_LIMIT = int(os.environ.get("EXTRACT_DISCOVERY_LIMIT", str(MAX_PER_SITE * 3)))
+# Số thread tải trang; khi bật AIMD (extract.concurrency) đây chỉ là trần, số request
+# thật sự đang chạy theo từng host do limiter quyết định
+MAX_WORKERS = concurrency.DEFAULT_MAX if concurrency.ADAPTIVE else 12
+CONCURRENCY_LOG_SECONDS = float(os.environ.get("EXTRACT_CONCURRENCY_LOG_SECONDS", "15"))
 PAGINATION_LIMIT = 60
+# Stage parse chạy trong N process riêng khi EXTRACT_PARSE_PROCESSES > 1 (mặc định 1:
+# parse ngay trong thread I/O như cũ, không fork pool trên máy nhiều core / container)
+PARSE_PROCESSES = int(os.environ.get("EXTRACT_PARSE_PROCESSES", "1"))
+PARSE_QUEUE_SIZE = int(os.environ.get("EXTRACT_PARSE_QUEUE_SIZE", "64"))
+
+# Biên dịch sẵn một lần, dùng cho mọi anchor / loc sitemap
+LINK_KEYWORDS = KeywordMatcher(["laptop", "macbook", "product", "collection"])
+SITEMAP_EXCLUDE = KeywordMatcher(["tin-tuc", "news", "khuyen-mai", "khuyenmai", "tag", "search", "tim-kiem"])
 
 SITES = {
     "thegioididong": {
         # Use the specific filtered page which contains all laptop products as requested
         # Default to the fragment page with pi=21 (matches user's working seed)
         "seed_categories": ["https://www.thegioididong.com/laptop#c=44&o=13&pi=21"],
-        "sitemap": "https://www.thegioididong.com/newsitemap/sitemap-product"
+        "sitemap": "https://www.thegioididong.com/newsitemap/sitemap-product",
+        # Token bucket theo host: số request/giây tối đa và số request được dồn liền nhau
+        "rate_limit": {"rate": 6.0, "burst": 3},
+        # Số request đồng thời (AIMD): bắt đầu / tối thiểu / tối đa
+        "concurrency": {"initial": 4, "min": 1, "max": 24},
+        # Render gọn: chặn ảnh/font/media/analytics, chờ DOM có selector thay vì networkidle
+        "render_profile": {
+            "listing_selector": ".listproduct",
+            "product_selector": ".box-price-present",
+            "selector_timeout": 8000,
+        },
     }
 }
 
@@ -35,32 +66,70 @@ if os.environ.get('EXTRACT_TGDD_SEED'):
     logging.info(f"Overriding thegioididong seed with EXTRACT_TGDD_SEED={override}")
     SITES['thegioididong']['seed_categories'] = [override]
 
-def harvest_site(site_key):
+def _site_hosts(cfg):
+    return {h for h in (host_of(u) for u in cfg.get("seed_categories", []) + [cfg.get("sitemap") or ""]) if h}
+
+def configure_rate_limits():
+    """Đăng ký rate/burst và giới hạn đồng thời của từng site cho các host xuất hiện trong seed/sitemap."""
+    for cfg in SITES.values():
+        rl = cfg.get("rate_limit")
+        cc = cfg.get("concurrency")
+        for h in _site_hosts(cfg):
+            if rl:
+                configure_host(h, rl.get("rate", 1.0), rl.get("burst", 1))
+            if cc:
+                concurrency.configure_host(
+                    h, cc.get("initial", concurrency.DEFAULT_INITIAL),
+                    cc.get("min", concurrency.DEFAULT_MIN), cc.get("max", concurrency.DEFAULT_MAX),
+                )
+
+configure_rate_limits()
+
+def configure_render_profiles():
+    """Đăng ký render_profile của từng site cho renderer (nếu có Playwright)."""
+    if configure_render_profile is None:
+        return
+    for site_key, cfg in SITES.items():
+        if cfg.get("render_profile") is not None:
+            configure_render_profile(site_key, cfg["render_profile"])
+
+configure_render_profiles()
+
+def sitemap_since():
+    """Mốc lastmod cho sitemap: chỉ bật khi EXTRACT_SITEMAP_INCREMENTAL=1 (dùng lần extract thành công gần nhất)."""
+    if os.environ.get('EXTRACT_SITEMAP_INCREMENTAL', '').lower() not in ('1', 'true', 'yes'):
+        return None
+    try:
+        from extract.log_store import get_last_success_time
+        return get_last_success_time()
+    except Exception as e:
+        logging.warning(f"Không đọc được lần extract thành công gần nhất: {e}")
+        return None
+
+def discover_product_urls(site_key, limit=None):
+    """Thu thập tối đa `limit` (mặc định MAX_PER_SITE) URL sản phẩm của một site từ sitemap + các trang danh mục."""
+    limit = limit or MAX_PER_SITE
     cfg = SITES[site_key]
     urls = set()
 
     # Crawl sitemap nếu có
     if cfg.get("sitemap"):
-        r = http_get(cfg["sitemap"])
-        if r:
-            soup = BeautifulSoup(r.text, "xml")
-            locs = [loc.get_text().strip() for loc in soup.find_all("loc")]
-            logging.info(f"[{site_key}] Sitemap contains {len(locs)} loc entries")
+        # Looser filter: accept locs under the site domain and avoid obvious non-product paths
+        since = sitemap_since()
+        if since:
+            logging.info(f"[{site_key}] Chỉ lấy URL sitemap có lastmod sau lần crawl thành công {since}")
+        seen_locs = 0
+        for u, _ in iter_sitemap(cfg["sitemap"], SITEMAP_EXCLUDE, since):
+            seen_locs += 1
             # sample some sitemap entries for debugging
-            for s in locs[:20]:
-                logging.info(f"[{site_key}] Sitemap sample: {s}")
-
-            # Looser filter: accept locs under the site domain and avoid obvious non-product paths
-            exclude_tokens = ["tin-tuc", "news", "khuyen-mai", "khuyenmai", "tag", "search", "tim-kiem", "khuyenmai"]
-            for u in locs:
-                lu = u.lower()
-                if "thegioididong.com" not in lu:
-                    continue
-                if any(ex in lu for ex in exclude_tokens):
-                    continue
-                urls.add(u.split("?")[0])
-                if len(urls) >= MAX_PER_SITE:
-                    break
+            if seen_locs <= 20:
+                logging.info(f"[{site_key}] Sitemap sample: {u}")
+            if "thegioididong.com" not in u.lower():
+                continue
+            urls.add(canonical_url(u.split("?")[0]))
+            if len(urls) >= limit:
+                break
+        logging.info(f"[{site_key}] Sitemap: đọc {seen_locs} loc entries, giữ {len(urls)} URL")
 
     # Crawl seed categories (with pagination for some sites)
     for seed in cfg["seed_categories"]:
@@ -78,66 +147,221 @@ def harvest_site(site_key):
                     pages.append(f"{seed}#c=44&o=13&pi={pnum}")
                 logging.info(f"[{site_key}] Generated {len(pages)} category page URLs (including fragments)")
 
+        # Chuẩn hoá URL trước khi fetch: fragment không được gửi lên server nên
+        # "seed#c=44&o=13&pi=N" là cùng một request với seed → chỉ giữ bản đầu tiên
+        unique_pages, seen_pages = [], set()
+        for p in pages:
+            c = canonical_url(p)
+            if c not in seen_pages:
+                seen_pages.add(c)
+                unique_pages.append(p)
+        if len(unique_pages) < len(pages):
+            logging.info(f"[{site_key}] Bỏ {len(pages) - len(unique_pages)} URL danh mục trùng sau khi chuẩn hoá")
+        pages = unique_pages
+
+        listing_seen = set()
+        page_hashes = set()
         for idx, page_url in enumerate(pages):
             logging.info(f"[{site_key}] Fetching category page {idx+1}/{len(pages)}: {page_url}")
+            page_html = None
             # If Playwright renderer is available, use it for TGDD to get client-rendered product lists
             if USE_RENDERER and site_key == "thegioididong":
                 try:
-                    html = render_html(page_url)
-                    if not html:
+                    page_html = render_html(page_url, site=site_key, kind="listing")
+                    if not page_html:
                         logging.debug(f"Renderer returned no HTML for {page_url}, falling back to http_get")
-                        r = http_get(page_url)
-                        if not r:
-                            logging.info(f"[{site_key}] Failed to fetch page (renderer+http) {page_url}")
-                            continue
-                        soup = BeautifulSoup(r.text, "lxml")
-                    else:
-                        soup = BeautifulSoup(html, "lxml")
                 except Exception as e:
                     logging.warning(f"Renderer error for {page_url}: {e}")
-                    # fallback to http_get
-                    r = http_get(page_url)
-                    if not r:
-                        logging.info(f"[{site_key}] Failed to fetch page (renderer error + http) {page_url}")
-                        continue
-                    soup = BeautifulSoup(r.text, "lxml")
-            else:
+            if not page_html:
                 r = http_get(page_url)
                 if not r:
                     logging.info(f"[{site_key}] Failed to fetch page (http) {page_url}")
                     continue
-                soup = BeautifulSoup(r.text, "lxml")
+                page_html = r.text
+            soup = BeautifulSoup(page_html, "lxml")
             anchors = soup.find_all("a", href=True)
             logging.info(f"[{site_key}] Page {idx+1} anchors found: {len(anchors)}")
-            added_on_page = 0
+            candidates = []
             for a in anchors:
-                full = urljoin(page_url, a["href"]).split("?")[0]
-                if any(k in full.lower() for k in ["laptop", "macbook", "product", "collection"]):
-                    if full not in urls:
-                        urls.add(full)
-                        added_on_page += 1
-                if len(urls) >= MAX_PER_SITE:
+                full = canonical_url(urljoin(page_url, a["href"]).split("?")[0])
+                if LINK_KEYWORDS.search(full):
+                    candidates.append(full)
+
+            # Trang có cùng danh sách sản phẩm với một trang trước → đã hết trang thật
+            page_hash = hashlib.md5("\n".join(sorted(set(candidates))).encode("utf-8")).hexdigest()
+            if page_hash in page_hashes:
+                logging.info(f"[{site_key}] Trang {idx+1} trùng nội dung trang trước → dừng phân trang")
+                break
+            page_hashes.add(page_hash)
+
+            added_on_page = 0
+            new_on_listing = 0
+            for full in candidates:
+                if full not in listing_seen:
+                    listing_seen.add(full)
+                    new_on_listing += 1
+                if full not in urls:
+                    urls.add(full)
+                    added_on_page += 1
+                if len(urls) >= limit:
                     break
             logging.info(f"[{site_key}] Added {added_on_page} candidate URLs from page {idx+1}")
-            if len(urls) >= MAX_PER_SITE:
+            if len(urls) >= limit:
                 break
-        if len(urls) >= MAX_PER_SITE:
+            if new_on_listing == 0:
+                logging.info(f"[{site_key}] Trang {idx+1} không có URL sản phẩm mới → dừng phân trang")
+                break
+        if len(urls) >= limit:
             break
 
-    urls = list(urls)[:MAX_PER_SITE]
+    urls = list(urls)[:limit]
     logging.info(f"[{site_key}] Found {len(urls)} URLs")
     # Log a short sample to help debugging discovery quality
     sample = urls[:20]
     for u in sample:
         logging.info(f"[{site_key}] Sample URL: {u}")
+    return urls
+
+def skip_done_urls(site_key, urls, skip_urls):
+    """Bỏ URL đã xử lý ở lần chạy / lần thử trước (checkpoint của RawWriter)."""
+    if not skip_urls:
+        return urls
+    remaining = [u for u in urls if u not in skip_urls]
+    if len(remaining) < len(urls):
+        logging.info(f"[{site_key}] Bỏ qua {len(urls) - len(remaining)} URL đã có trong checkpoint")
+    return remaining
+
+def plan_site_urls(site_key, skip_urls=None):
+    """URL cần tải lần này: discovery → frontier chọn tối đa MAX_PER_SITE → bỏ URL đã xong.
+
+    URL đã xong (skip_urls) được frontier tính vào MAX_PER_SITE, nên khi --resume / queue lập
+    kế hoạch lại thì tổng số URL của site vẫn không vượt MAX_PER_SITE.
+    """
+    if frontier.FRONTIER_ENABLED:
+        urls = frontier.schedule(
+            site_key, discover_product_urls(site_key, DISCOVERY_LIMIT), MAX_PER_SITE, done=skip_urls
+        )
+    else:
+        urls = discover_product_urls(site_key)
+    return skip_done_urls(site_key, urls, skip_urls)
+
+def _emit(results, url, item, on_item, on_done):
+    """Kết quả của một URL đã tải được HTML và parse xong (item None = trang bị lọc).
+
+    Chỉ gọi cho trang tải được: URL lỗi tải (hết retry, 403/404...) đi qua
+    note_failed_fetch, không ghi frontier (last_fetched/last_hash) và không checkpoint.
+    """
+    if frontier.FRONTIER_ENABLED:
+        frontier.record_fetch(url, item)
+    # Có on_item thì item được ghi ra ngay, không giữ trong RAM
+    if item:
+        if on_item: on_item(item)
+        else: results.append(item)
+    if on_done: on_done(url)
+
+def note_failed_fetch(site_key, url, on_failed):
+    """True nếu URL vừa hết lượt retry ở http_get → báo on_failed (dead letter), không checkpoint."""
+    reason = pop_failure(url)
+    if reason and on_failed:
+        on_failed(url, site_key, reason)
+    return bool(reason)
+
+def harvest_site(site_key, on_item=None, on_done=None, skip_urls=None, on_failed=None):
+    """Crawl một site. Trả về list item, hoặc list rỗng nếu truyền on_item
+    (item được đưa cho on_item ngay khi xong). on_done(url) được gọi cho mỗi URL
+    đã xử lý xong; on_failed(url, site_key, reason) cho URL hết lượt retry;
+    skip_urls: URL bỏ qua (resume)."""
+    # Log limit / p95 / tỉ lệ lỗi theo host định kỳ trong suốt quá trình crawl
+    configure_session(pool_size=MAX_WORKERS)
+    with concurrency.Reporter(CONCURRENCY_LOG_SECONDS):
+        urls = plan_site_urls(site_key, skip_urls)
+        return harvest_urls(site_key, urls, on_item, on_done, on_failed)
+
+def _fetch_and_parse(url, site_key):
+    """(đã tải được HTML?, item): item None vì trang bị loại vẫn là "đã xử lý",
+    còn không tải được (lỗi mạng, 403/404...) thì không checkpoint."""
+    html, rendered = fetch_product_html(url, site_key)
+    if html is None:
+        return False, None
+    return True, parse_product_html(url, site_key, html, rendered=rendered)
+
+def harvest_urls(site_key, urls, on_item=None, on_done=None, on_failed=None):
+    """Crawl danh sách URL sản phẩm cho sẵn (không discovery), vd khi chạy lại dead letter."""
+    # Pool keep-alive theo host đủ cho toàn bộ worker (đặt lúc crawl, không phải lúc import)
+    configure_session(pool_size=MAX_WORKERS)
+    if PARSE_PROCESSES > 1:
+        return harvest_urls_pipelined(site_key, urls, on_item, on_done, on_failed)
 
     results = []
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-        futures = {ex.submit(parse_product_page, u, site_key): u for u in urls}
+        futures = {ex.submit(_fetch_and_parse, u, site_key): u for u in urls}
         for fut in tqdm(as_completed(futures), total=len(futures), desc=f"Crawling {site_key}"):
+            url = futures[fut]
+            try:
+                fetched, item = fut.result()
+                if not fetched:
+                    note_failed_fetch(site_key, url, on_failed)
+                    continue
+                _emit(results, url, item, on_item, on_done)
+            except Exception as e:
+                logging.warning(f"Parse error: {e}")
+
+    return results
+
+def _fetch_stage(url, site_key, q):
+    try:
+        html, rendered = fetch_product_html(url, site_key)
+    except Exception as e:
+        logging.warning(f"Fetch error {url}: {e}")
+        html, rendered = None, False
+    # put() chặn khi hàng đợi đầy → worker I/O tự chậm lại theo tốc độ parse
+    q.put((url, html, rendered))
+
+def harvest_urls_pipelined(site_key, urls, on_item=None, on_done=None, on_failed=None):
+    """Pipeline 2 stage: MAX_WORKERS thread chỉ tải HTML → hàng đợi giới hạn
+    (PARSE_QUEUE_SIZE) → ProcessPoolExecutor (PARSE_PROCESSES) chạy parse_static.
+
+    Trang cần render fallback được hoàn tất trên thread pool riêng (Playwright
+    không chạy trong process con). Kết quả giống hệt harvest_site kiểu cũ.
+    """
+    results = []
+    render_futs = []
+    pending = {}
+    q = queue.Queue(maxsize=PARSE_QUEUE_SIZE)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as io_ex, \
+            ThreadPoolExecutor(max_workers=RENDER_POOL_SIZE) as render_ex, \
+            ProcessPoolExecutor(max_workers=PARSE_PROCESSES) as parse_ex:
+
+        def collect(done):
+            for fut in done:
+                url, rendered = pending.pop(fut)
+                try:
+                    state = fut.result()
+                except Exception as e:
+                    logging.warning(f"Parse error: {e}")
+                    continue
+                if wants_render(url, state, rendered):
+                    render_futs.append((url, render_ex.submit(finish_product, url, site_key, state, rendered)))
+                    continue
+                _emit(results, url, finish_product(url, site_key, state, rendered), on_item, on_done)
+
+        for u in urls:
+            io_ex.submit(_fetch_stage, u, site_key, q)
+        for _ in tqdm(range(len(urls)), desc=f"Crawling {site_key}"):
+            url, html, rendered = q.get()
+            if html is None:
+                note_failed_fetch(site_key, url, on_failed)
+                continue
+            # giới hạn số job parse đang chờ để HTML không dồn trong bộ nhớ
+            if len(pending) >= PARSE_PROCESSES * 2:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            pending[parse_ex.submit(parse_static, url, html)] = (url, rendered)
+        collect(wait(pending).done)
+
+        for url, fut in render_futs:
             try:
-                item = fut.result()
-                if item: results.append(item)
+                _emit(results, url, fut.result(), on_item, on_done)
             except Exception as e:
                 logging.warning(f"Parse error: {e}")
 
@@ -1,8 +1,16 @@
 # extract_service.py
 import os, logging, smtplib
-import pandas as pd
 from datetime import datetime
-from extract.crawler import harvest_site, SITES
+from extract.crawler import harvest_site, harvest_urls, skip_done_urls, SITES
+from extract.extract_utils import close_session, backoff_delay
+from extract.http_archive import close_archive
+from extract.http_cache import close_cache
+from extract.page_parser import log_stream_stats
+from extract.raw_writer import (
+    RawWriter, find_in_progress, find_dead_letters, load_dead_letters, new_raw_path, reopen_raw, DEAD_SUFFIX,
+)
+from extract.render_crawler import shutdown_render_pool
+from extract import frontier, html_store, render_memo, work_queue
 # Try to load local hardcoded config (optional)
 from email.mime.text import MIMEText
 try:
@@ -64,15 +72,94 @@ def send_error_email(subject, body, to_email, smtp_server, smtp_port, smtp_user,
     except Exception as e:
         logging.error(f"Lỗi gửi email: {e}")
 
-def run_extract(max_retries=3, email_notify=False, email_config=None):
+def _finish_run():
+    """Giải phóng tài nguyên dùng chung của lần chạy (HTTP session, cache, archive, HTML store, browser pool)."""
+    try:
+        close_session()
+    except Exception as e:
+        logging.warning(f"Lỗi khi đóng HTTP session: {e}")
+    try:
+        close_cache()
+    except Exception as e:
+        logging.warning(f"Lỗi khi đóng HTTP cache: {e}")
+    try:
+        html_store.end_run()
+    except Exception as e:
+        logging.warning(f"Lỗi khi đóng HTML store: {e}")
+    try:
+        close_archive()
+    except Exception as e:
+        logging.warning(f"Lỗi khi đóng HTTP archive: {e}")
+    try:
+        render_memo.log_stats()
+        log_stream_stats()
+        frontier.log_stats()
+    except Exception:
+        pass
+    try:
+        shutdown_render_pool()
+    except Exception as e:
+        logging.warning(f"Lỗi khi đóng browser pool: {e}")
+
+def run_extract(max_retries=3, email_notify=False, email_config=None, engine=None, resume=None, retry_dead=None,
+                role=None):
     """Run extract. Only retry when an error occurs. On success returns csv path.
 
     Behavior changed: do one extraction attempt; if it fails, retry up to max_retries-1 more times.
+    engine: "thread" (mặc định, harvest_site từng site) hoặc "async" (crawl mọi site song song);
+    nếu không truyền thì đọc biến môi trường EXTRACT_ENGINE.
+
+    Item được ghi dần vào raw_laptop_<ts>.csv.part (RawWriter); lần thử lại chỉ crawl
+    các URL chưa có trong checkpoint. resume=True (hoặc EXTRACT_RESUME=1 / --resume)
+    tiếp tục file .part dở dang mới nhất thay vì bắt đầu file mới.
+
+    Mỗi request tự retry (backoff mũ + jitter, xem extract_utils); URL hết lượt retry
+    được ghi vào raw_laptop_<ts>.csv.dead. retry_dead=True (EXTRACT_RETRY_DEAD=1 /
+    --retry-dead) chỉ crawl lại các URL trong file dead letter mới nhất.
+
+    role (EXTRACT_ROLE / --role): "local" (mặc định, crawl trong process này),
+    "coordinator" (discovery + enqueue vào crawl_queue rồi gom kết quả workers),
+    "worker" (chỉ lease URL từ hàng đợi, trả về số URL đã xử lý) hoặc "both".
+    Xem extract/work_queue.py.
     """
     attempts_done = 0
     last_err = None
     # Support a test mode to force failure (useful to validate retry logic)
     force_fail = os.environ.get('EXTRACT_FORCE_FAIL', '').lower() in ('1', 'true', 'yes')
+    engine = (engine or os.environ.get('EXTRACT_ENGINE') or 'thread').lower()
+    if resume is None:
+        resume = os.environ.get('EXTRACT_RESUME', '').lower() in ('1', 'true', 'yes')
+    if retry_dead is None:
+        retry_dead = os.environ.get('EXTRACT_RETRY_DEAD', '').lower() in ('1', 'true', 'yes')
+    role = (role or os.environ.get('EXTRACT_ROLE') or 'local').lower()
+    if role == 'worker':
+        # Worker không ghi file raw: item được trả về coordinator qua hàng đợi
+        try:
+            return work_queue.run_worker()
+        finally:
+            _finish_run()
+
+    dead_path, dead_urls = None, None
+    if retry_dead:
+        dead_path = find_dead_letters(OUT_DIR)
+        if not dead_path:
+            logging.info("Không có file dead letter nào để chạy lại")
+            return None
+        dead_urls = load_dead_letters(dead_path)
+        logging.info(f"Chạy lại {sum(len(v) for v in dead_urls.values())} URL dead letter từ {dead_path}")
+
+    if dead_path:
+        # URL lấy lại được append vào file raw gốc của dead letter, không tạo file raw mới
+        writer = reopen_raw(dead_path[: -len(DEAD_SUFFIX)])
+    else:
+        csv_path = find_in_progress(OUT_DIR) if resume else None
+        if resume and not csv_path:
+            logging.info("Không có file extract dở dang để resume → bắt đầu file mới")
+        writer = RawWriter(csv_path or new_raw_path(OUT_DIR))
+    # reopen_raw đã nạp sẵn các dòng của lần chạy gốc → chỉ dòng thêm sau mốc này là dữ liệu mới
+    baseline = writer.count if dead_path else 0
+    # HTML của lần chạy được lưu theo tên file raw → python -m extract.reparse dựng lại được CSV
+    html_store.begin_run(os.path.splitext(os.path.basename(writer.csv_path))[0])
 
     # If email_notify requested but no explicit config provided, fall back to local config
     if email_notify and (email_config is None) and LOCAL_DEFAULT_SMTP:
@@ -96,55 +183,102 @@ def run_extract(max_retries=3, email_notify=False, email_config=None):
         except Exception:
             pass
         logging.info(f"=== BẮT ĐẦU QUÁ TRÌNH EXTRACT (thử lần {attempts_done}) ===")
-        all_data = []
         # Honor optional environment variable to restrict crawling to a single site
         only_site = os.environ.get('EXTRACT_ONLY_SITE')
         sites_to_iterate = [only_site] if (only_site and only_site in SITES) else list(SITES.keys())
         if only_site and only_site not in SITES:
             logging.warning(f"EXTRACT_ONLY_SITE={only_site} but site not configured; ignoring restriction")
 
-        for site in sites_to_iterate:
-            logging.info(f"Đang crawl nguồn: {site}")
+        if dead_urls is not None:
+            for site, urls in dead_urls.items():
+                before = writer.count
+                try:
+                    harvest_urls(site, skip_done_urls(site, urls, writer.done), on_item=writer.add,
+                                 on_done=writer.mark_done, on_failed=writer.mark_failed)
+                    logging.info(f"Chạy lại dead letter {site}: lấy được {writer.count - before} sản phẩm")
+                except Exception as e:
+                    logging.error(f"Lỗi crawl lại {site} (thử lần {attempts_done}): {e}")
+                    last_err = f"Lỗi crawl lại {site}: {e}"
+        elif role in ('coordinator', 'both') and not force_fail:
+            from time import perf_counter
+            run_key = os.path.splitext(os.path.basename(writer.csv_path))[0]
+            logging.info(f"Crawl qua hàng đợi ({role}): {', '.join(sites_to_iterate)}")
+            t0 = perf_counter()
             try:
-                if force_fail:
-                    logging.info("EXTRACT_FORCE_FAIL is set -> forcing no data for this attempt (test mode)")
-                    items = []
-                else:
-                    from time import perf_counter
-                    t0 = perf_counter()
-                    items = harvest_site(site)
-                    t1 = perf_counter()
-                    duration = t1 - t0
-                    logging.info(f"Hoàn tất crawl {site}: tìm được {len(items)} URLs, thời gian {duration:.1f}s")
-                all_data.extend(items)
+                work_queue.coordinate(run_key, sites_to_iterate, on_item=writer.add, on_done=writer.mark_done,
+                                      skip_urls=writer.done, on_failed=writer.mark_failed,
+                                      local_worker=(role == 'both'))
+            except Exception as e:
+                logging.error(f"Lỗi hàng đợi crawl (thử lần {attempts_done}): {e}")
+                last_err = f"Lỗi hàng đợi crawl: {e}"
+            logging.info(f"Hàng đợi hoàn tất: {writer.count} sản phẩm trong {perf_counter() - t0:.1f}s")
+        elif engine == 'async' and not force_fail:
+            from time import perf_counter
+            from extract.async_crawler import run_harvest_async
+            logging.info(f"Đang crawl song song (async): {', '.join(sites_to_iterate)}")
+            t0 = perf_counter()
+            try:
+                by_site = run_harvest_async(
+                    sites_to_iterate, on_item=writer.add, on_done=writer.mark_done,
+                    skip_urls=writer.done, on_failed=writer.mark_failed,
+                )
             except Exception as e:
-                logging.error(f"Lỗi crawl {site} (thử lần {attempts_done}): {e}")
-                last_err = f"Lỗi crawl {site}: {e}"
+                logging.error(f"Lỗi engine async (thử lần {attempts_done}): {e}")
+                last_err = f"Lỗi engine async: {e}"
+                by_site = {}
+            duration = perf_counter() - t0
+            for site, items in by_site.items():
+                if isinstance(items, Exception):
+                    logging.error(f"Lỗi crawl {site} (thử lần {attempts_done}): {items}")
+                    last_err = f"Lỗi crawl {site}: {items}"
+                    continue
+                logging.info(f"Hoàn tất crawl {site}: tổng {writer.by_source.get(site, 0)} sản phẩm trong file")
+            logging.info(f"Engine async hoàn tất {len(by_site)} nguồn trong {duration:.1f}s")
+        else:
+            for site in sites_to_iterate:
+                logging.info(f"Đang crawl nguồn: {site}")
+                try:
+                    if force_fail:
+                        logging.info("EXTRACT_FORCE_FAIL is set -> forcing no data for this attempt (test mode)")
+                    else:
+                        from time import perf_counter
+                        t0 = perf_counter()
+                        before = writer.count
+                        harvest_site(site, on_item=writer.add, on_done=writer.mark_done,
+                                     skip_urls=writer.done, on_failed=writer.mark_failed)
+                        t1 = perf_counter()
+                        duration = t1 - t0
+                        logging.info(f"Hoàn tất crawl {site}: tìm được {writer.count - before} URLs, thời gian {duration:.1f}s")
+                except Exception as e:
+                    logging.error(f"Lỗi crawl {site} (thử lần {attempts_done}): {e}")
+                    last_err = f"Lỗi crawl {site}: {e}"
 
         # If no data collected, consider this attempt a failure and possibly retry
-        if not all_data:
+        # (chạy lại dead letter: không lấy lại được dòng nào cũng là không có dữ liệu mới)
+        if writer.count - baseline == 0:
             logging.error(f"KHÔNG lấy được dữ liệu (thử lần {attempts_done})!!!")
             last_err = last_err or "KHÔNG lấy được dữ liệu!!!"
             if attempts_done >= max_retries:
                 logging.error(f"Đạt giới hạn {max_retries} lần thử, dừng và báo lỗi.")
                 break
             else:
-                logging.info(f"Sẽ thử lại (lần tiếp theo {attempts_done+1}/{max_retries}) sau 3s...")
-                import time; time.sleep(3)
+                # Lần thử sau chỉ crawl URL chưa có trong checkpoint; chờ tăng dần giữa các lần
+                delay = backoff_delay(attempts_done - 1, base=3)
+                logging.info(f"Sẽ thử lại (lần tiếp theo {attempts_done+1}/{max_retries}) sau {delay:.1f}s...")
+                import time; time.sleep(delay)
                 continue
 
         # Try to write CSV; treat failures here as attempt failure and retry
         try:
-            df = pd.DataFrame(all_data).drop_duplicates(subset=["url"]).reset_index(drop=True)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            csv_path = os.path.join(OUT_DIR, f"raw_laptop_{timestamp}.csv")
-            df.to_csv(csv_path, index=False, encoding="utf-8-sig")
-            logging.info(f"Hoàn tất EXTRACT, tổng {len(df)} sản phẩm → {csv_path}")
+            # Item đã nằm trong file .part (trùng URL đã bị bỏ khi ghi) → chỉ cần đổi tên
+            row_count = writer.finalize()
+            csv_path = writer.csv_path
+            logging.info(f"Hoàn tất EXTRACT, tổng {row_count} sản phẩm → {csv_path}")
             # If requested, send a success notification email using the existing helper
             if email_notify and email_config:
                 try:
                     subject = "[Extract Pipeline] Hoàn tất extract"
-                    body = f"Pipeline extract hoàn tất thành công. Tổng {len(df)} sản phẩm. File: {csv_path}"
+                    body = f"Pipeline extract hoàn tất thành công. Tổng {row_count} sản phẩm. File: {csv_path}"
                     send_error_email(subject, body,
                                      email_config['to_email'],
                                      email_config['smtp_server'],
@@ -157,21 +291,22 @@ def run_extract(max_retries=3, email_notify=False, email_config=None):
             # update DB as success
             try:
                 if run_id:
-                    update_run(run_id, status='success', message='Extract completed', csv_path=csv_path, row_count=len(df))
+                    update_run(run_id, status='success', message='Extract completed', csv_path=csv_path, row_count=row_count)
                 else:
                     # fallback insert
                     try:
                         from .log_store import insert_final
-                        insert_final(status='success', attempts=attempts_done, message='Extract completed', csv_path=csv_path, row_count=len(df))
+                        insert_final(status='success', attempts=attempts_done, message='Extract completed', csv_path=csv_path, row_count=row_count)
                     except Exception:
                         pass
             except Exception:
                 pass
             try:
                 if control_log_id:
-                    control_log_success(control_log_id, f"Extract success: {len(df)} rows")
+                    control_log_success(control_log_id, f"Extract success: {row_count} rows")
             except Exception:
                 pass
+            _finish_run()
             return csv_path
         except Exception as e:
             logging.error(f"Lỗi ghi file CSV (thử lần {attempts_done}): {e}")
@@ -182,6 +317,15 @@ def run_extract(max_retries=3, email_notify=False, email_config=None):
             logging.info(f"Sẽ thử lại (lần tiếp theo {attempts_done+1}/{max_retries}) sau 3s...")
             import time; time.sleep(3)
             continue
+    # Giữ file .part + checkpoint để lần sau chạy với --resume
+    writer.close()
+    if dead_path and writer.count == baseline:
+        # .part chỉ là bản chép file gốc: bỏ đi, file raw gốc + .dead giữ nguyên
+        writer.discard()
+    elif writer.count or writer.done:
+        logging.info(f"Dữ liệu dở dang giữ tại {writer.part_path} ({writer.count} dòng), chạy lại với --resume")
+    else:
+        writer.discard()
     # Nếu quá số lần retry, gửi email nếu cấu hình
     try:
         if control_log_id:
@@ -197,4 +341,20 @@ def run_extract(max_retries=3, email_notify=False, email_config=None):
                         email_config['smtp_port'],
                         email_config['smtp_user'],
                         email_config['smtp_pass'])
+    _finish_run()
     return None
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Chạy bước Extract")
+    parser.add_argument("--resume", action="store_true", help="tiếp tục file raw_laptop_*.csv.part dở dang mới nhất")
+    parser.add_argument("--retry-dead", action="store_true", help="chỉ crawl lại URL trong file dead letter mới nhất")
+    parser.add_argument("--engine", choices=["thread", "async"], default=None)
+    parser.add_argument("--role", choices=["local", "coordinator", "worker", "both"], default=None,
+                        help="crawl phân tán qua crawl_queue (xem extract/work_queue.py)")
+    parser.add_argument("--max-retries", type=int, default=3)
+    args = parser.parse_args()
+    result = run_extract(max_retries=args.max_retries, engine=args.engine, resume=args.resume or None,
+                         retry_dead=args.retry_dead or None, role=args.role)
+    raise SystemExit(0 if result is not None else 1)
@@ -1,9 +1,42 @@
 # extract_utils.py
-import random, time, requests, logging, re
+import os, random, time, requests, logging, re, threading, codecs
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from requests.adapters import HTTPAdapter
+from extract.rate_limiter import acquire as rate_limit_acquire
+from extract.concurrency import slot as concurrency_slot
+from extract.http_cache import get_cache
+from extract.http_archive import get_archive, is_replaying
+try:
+    # "gzip,deflate" + ",br" khi có brotli/brotlicffi (urllib3 tự giải nén)
+    from urllib3.util.request import ACCEPT_ENCODING
+except Exception:
+    ACCEPT_ENCODING = "gzip, deflate"
 
 REQUEST_TIMEOUT = 15
-DELAY_BETWEEN_REQUESTS = 1.5
+
+# Shared keep-alive session: một pool kết nối cho mỗi host, đủ cho tất cả worker của crawler
+HTTP_POOL_SIZE = int(os.environ.get("EXTRACT_HTTP_POOL_SIZE", "12"))
+HTTP_MAX_HOSTS = int(os.environ.get("EXTRACT_HTTP_MAX_HOSTS", "10"))
+# Retry theo từng request: backoff mũ + jitter, retry 429/5xx/timeout, tôn trọng Retry-After
+HTTP_RETRIES = int(os.environ.get("EXTRACT_HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.environ.get("EXTRACT_HTTP_BACKOFF", "0.5"))
+HTTP_BACKOFF_MAX = float(os.environ.get("EXTRACT_HTTP_BACKOFF_MAX", "30"))
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# Lỗi khi đọc body (stream) cũng được thử lại như lỗi kết nối
+RETRY_READ_ERRORS = (
+    requests.ConnectionError, requests.Timeout,
+    requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError,
+)
+
+# URL đã hết lượt retry → lý do lỗi (crawler lấy ra bằng pop_failure để ghi dead letter)
+_failures = {}
+_failures_lock = threading.Lock()
+
+_session = None
+_session_lock = threading.Lock()
 
 def random_headers():
     uas = [
@@ -11,19 +44,269 @@ def random_headers():
         "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_4) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.4 Safari/605.1.15",
         "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119 Safari/537.36"
     ]
-    return {"User-Agent": random.choice(uas), "Accept-Language": "vi-VN,vi;q=0.9,en;q=0.8"}
+    return {
+        "User-Agent": random.choice(uas),
+        "Accept-Language": "vi-VN,vi;q=0.9,en;q=0.8",
+        "Accept-Encoding": ACCEPT_ENCODING,
+        "Connection": "keep-alive",
+    }
+
+def get_session():
+    """Trả về requests.Session dùng chung (thread-safe khi khởi tạo).
+
+    HTTPAdapter giữ tối đa HTTP_POOL_SIZE kết nối keep-alive cho mỗi host nên
+    các worker của ThreadPoolExecutor tái sử dụng kết nối TCP+TLS thay vì bắt tay lại.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # Retry do _get_with_retry đảm nhiệm (để còn lấy token rate limit trước mỗi lần thử)
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_MAX_HOSTS,
+                    pool_maxsize=HTTP_POOL_SIZE,
+                    max_retries=0,
+                    pool_block=True,
+                )
+                s = requests.Session()
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
 
-def http_get(url):
+def configure_session(pool_size=None, retries=None):
+    """Đổi kích thước pool / số lần retry.
+
+    Chỉ khi pool_size đổi thì session mới được đóng để tạo lại ở lần gọi kế tiếp →
+    gọi lại với cùng giá trị (mỗi site) vẫn giữ các kết nối keep-alive.
+    """
+    global HTTP_POOL_SIZE, HTTP_RETRIES
+    if retries is not None:
+        HTTP_RETRIES = int(retries)
+    if pool_size and int(pool_size) != HTTP_POOL_SIZE:
+        HTTP_POOL_SIZE = int(pool_size)
+        close_session()
+
+def close_session():
+    """Đóng session dùng chung (gọi khi kết thúc run_extract)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+def retry_after_seconds(value):
+    """Giá trị header Retry-After (số giây hoặc HTTP-date) → số giây, None nếu không đọc được."""
+    if not value:
+        return None
     try:
-        r = requests.get(url, headers=random_headers(), timeout=REQUEST_TIMEOUT)
-        if r.status_code == 200:
-            time.sleep(DELAY_BETWEEN_REQUESTS + random.random() * 0.5)
-            r.encoding = r.apparent_encoding
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(value)
+        return max(0.0, dt.timestamp() - time.time())
+    except Exception:
+        return None
+
+def backoff_delay(attempt, retry_after=None, base=None):
+    """Thời gian chờ trước lần thử thứ attempt+1: Retry-After nếu server gửi,
+    ngược lại full jitter trong [0, base * 2^attempt], tối đa HTTP_BACKOFF_MAX."""
+    if retry_after is not None:
+        return min(retry_after, HTTP_BACKOFF_MAX)
+    base = HTTP_BACKOFF if base is None else base
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, base * (2 ** attempt)))
+
+def record_failure(url, reason):
+    with _failures_lock:
+        _failures[url] = reason
+
+def pop_failure(url):
+    """Lý do lỗi nếu URL đã hết lượt retry (và xoá khỏi danh sách), ngược lại None."""
+    with _failures_lock:
+        return _failures.pop(url, None)
+
+def _get_with_retry(url, headers, stream=False, read=None):
+    """GET với retry theo từng request; trả về Response cuối cùng hoặc None.
+
+    Lỗi kết nối / timeout / status trong RETRY_STATUSES được thử lại tối đa
+    HTTP_RETRIES lần; hết lượt thì URL được ghi vào danh sách lỗi (pop_failure).
+    Status khác (200, 304, 404...) được trả về ngay cho caller xử lý.
+    read: hàm đọc body của response 200 (stream=True), chạy trong vòng retry → lỗi
+    giữa body (ChunkedEncodingError, ReadTimeout...) được thử lại, charset lạ
+    (LookupError) hay RequestException khác thì ghi lỗi luôn. Response trả về đã đóng.
+    """
+    reason = None
+    for attempt in range(HTTP_RETRIES + 1):
+        if attempt:
+            time.sleep(delay)
+        # Chờ token của host trước khi gửi (thay cho sleep sau response)
+        rate_limit_acquire(url)
+        try:
+            # Slot AIMD của host: latency / lỗi của request này quyết định số request đồng thời
+            with concurrency_slot(url) as s:
+                r = get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT, stream=stream)
+                s["error"] = r.status_code in RETRY_STATUSES
+                if read is not None and r.status_code == 200:
+                    try:
+                        read(r)
+                    finally:
+                        r.close()
+        except RETRY_READ_ERRORS as e:
+            reason = f"{type(e).__name__}: {e}"
+            delay = backoff_delay(attempt)
+        except (requests.RequestException, LookupError) as e:
+            # Lỗi không tạm thời (InvalidURL, TooManyRedirects, charset lạ...): không retry,
+            # nhưng vẫn ghi lỗi để URL vào dead letter thay vì bị checkpoint như đã xong
+            logging.warning(f"Bỏ {url}: {type(e).__name__}: {e}")
+            record_failure(url, f"{type(e).__name__}: {e}")
+            return None
+        else:
+            if r.status_code not in RETRY_STATUSES:
+                return r
+            reason = f"HTTP {r.status_code}"
+            delay = backoff_delay(attempt, retry_after_seconds(r.headers.get("Retry-After")))
+            r.close()
+        if attempt < HTTP_RETRIES:
+            logging.debug(f"Thử lại {url} sau {delay:.1f}s ({reason})")
+    logging.warning(f"Bỏ {url} sau {HTTP_RETRIES + 1} lần thử: {reason}")
+    record_failure(url, reason)
+    return None
+
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([A-Za-z0-9_\-]+)', re.I)
+
+def declared_encoding(headers, head=b""):
+    """Charset khai báo trong Content-Type hoặc <meta charset> ở đầu body; None nếu không có.
+
+    Dùng trước apparent_encoding (dò charset trên toàn bộ body, chậm với trang lớn).
+    """
+    ctype = (headers or {}).get("Content-Type") or ""
+    m = re.search(r"charset=[\"']?([A-Za-z0-9_\-]+)", ctype, re.I)
+    if m:
+        return _known_codec(m.group(1))
+    m = _META_CHARSET_RE.search(head[:4096]) if head else None
+    return _known_codec(m.group(1).decode("ascii")) if m else None
+
+def _known_codec(name):
+    """Charset khai báo mà Python không biết (vd "utf8mb4") → None để dò thay vì LookupError."""
+    try:
+        codecs.lookup(name)
+        return name
+    except LookupError:
+        return None
+
+def cached_response(url, body, encoding=None):
+    """Dựng requests.Response 200 từ body đã lưu (cache 304, replay...)."""
+    r = requests.models.Response()
+    r.status_code = 200
+    r.url = url
+    r._content = body
+    # body đã có sẵn → iter_content() đọc từ _content thay vì raw (http_stream khi replay)
+    r._content_consumed = True
+    r.encoding = encoding or "utf-8"
+    return r
+
+def _replay(archive, url):
+    hit = archive.lookup("http", url)
+    if not hit or hit[0] != 200:
+        return None
+    r = cached_response(url, hit[2], hit[3])
+    r.headers.update(hit[1])
+    return r
+
+def http_get(url, use_cache=False):
+    """GET qua session dùng chung; trả về Response 200 hoặc None.
+
+    use_cache=True: gửi conditional GET theo validator đã lưu, 304 được trả lại
+    như một Response 200 với body lấy từ cache.
+    EXTRACT_HTTP_MODE=record lưu mọi response vào http_archive, =replay chỉ đọc
+    từ archive (không ra mạng).
+    """
+    archive = get_archive()
+    if archive and is_replaying():
+        return _replay(archive, url)
+    try:
+        cache = get_cache() if use_cache else None
+        headers = random_headers()
+        if cache:
+            headers.update(cache.conditional_headers(url))
+        r = _get_with_retry(url, headers)
+        if r is not None and r.status_code == 304 and cache:
+            hit = cache.load(url)
+            if hit:
+                r = cached_response(url, hit[0], hit[1])
+                if archive:
+                    archive.record("http", url, 200, None, r.content, r.encoding)
+                return r
+            # cache mất body → tải lại đầy đủ
+            r = _get_with_retry(url, random_headers())
+        if r is not None and r.status_code == 200:
+            r.encoding = declared_encoding(r.headers, r.content) or r.apparent_encoding
+            if cache:
+                cache.store(url, r.headers, r.content, r.encoding)
+            if archive:
+                archive.record("http", url, 200, r.headers, r.content, r.encoding)
             return r
+        if r is not None and archive:
+            archive.record("http", url, r.status_code, r.headers)
     except Exception as e:
         logging.warning(f"Lỗi GET {url}: {e}")
+        record_failure(url, f"{type(e).__name__}: {e}")
     return None
 
+def http_stream(url):
+    """GET dạng stream: trả về Response 200 chưa đọc body (caller phải close()) hoặc None."""
+    if get_archive():
+        # record cần cả body để lưu, replay đọc từ archive → dùng http_get (body trong RAM)
+        return http_get(url)
+    try:
+        r = _get_with_retry(url, random_headers(), stream=True)
+        if r is None:
+            return None
+        if r.status_code == 200:
+            return r
+        r.close()
+    except Exception as e:
+        logging.warning(f"Lỗi GET (stream) {url}: {e}")
+    return None
+
+def http_stream_read(url, read):
+    """GET dạng stream, read(response) đọc body bên trong vòng retry của _get_with_retry.
+
+    True nếu đã đọc một response 200; False nếu lỗi (hết lượt retry thì có trong pop_failure)
+    hoặc status khác 200. Khi có http_archive, body lấy qua http_get rồi đưa cho read.
+    """
+    if get_archive():
+        r = http_get(url)
+        if r is None:
+            return False
+        read(r)
+        return True
+    try:
+        r = _get_with_retry(url, random_headers(), stream=True, read=read)
+        if r is None:
+            return False
+        r.close()
+        return r.status_code == 200
+    except Exception as e:
+        logging.warning(f"Lỗi GET (stream) {url}: {e}")
+        record_failure(url, f"{type(e).__name__}: {e}")
+    return False
+
+def canonical_url(url):
+    """Chuẩn hoá URL để so trùng: bỏ fragment (không gửi lên server), host chữ thường,
+    bỏ port mặc định, sắp xếp query và bỏ "/" cuối path."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
 def parse_price(text):
     if not text: return None
     text = text.split('-')[0]
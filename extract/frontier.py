@@ -0,0 +1,149 @@
+"""URL frontier lưu qua nhiều lần chạy: nhớ mọi URL sản phẩm và tần suất dữ liệu thay đổi.
+
+Với mỗi URL: lần thấy gần nhất (sitemap / danh mục), lần tải gần nhất, hash nội dung
+item (giá, tên, số đã bán...) và giá lần trước, số lần tải / số lần dữ liệu đổi.
+
+schedule() chọn tối đa `budget` URL cho lần chạy:
+- URL chưa từng tải đứng đầu (giữ thứ tự discovery);
+- còn lại xếp theo độ "quá hạn" = thời gian từ lần tải trước / chu kỳ kỳ vọng, với
+  chu kỳ = EXTRACT_FRONTIER_BASE_HOURS / tỉ lệ thay đổi (ước lượng Laplace) → sản phẩm
+  hay đổi giá được làm mới trước, sản phẩm ổn định dồn về sau.
+EXTRACT_FRONTIER_SKIP_FRESH=1: bỏ hẳn URL chưa tới hạn (độ quá hạn < 1) kể cả khi còn
+budget. URL không còn xuất hiện quá EXTRACT_FRONTIER_FORGET_DAYS ngày thì không lên lịch.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+DB_DIR = os.path.join(os.path.dirname(__file__), '..', 'logs')
+DB_PATH = os.path.join(DB_DIR, 'url_frontier.db')
+
+FRONTIER_ENABLED = os.environ.get("EXTRACT_FRONTIER", "1").lower() not in ("0", "false", "no")
+BASE_HOURS = float(os.environ.get("EXTRACT_FRONTIER_BASE_HOURS", "24"))
+FORGET_DAYS = float(os.environ.get("EXTRACT_FRONTIER_FORGET_DAYS", "30"))
+SKIP_FRESH = os.environ.get("EXTRACT_FRONTIER_SKIP_FRESH", "").lower() in ("1", "true", "yes")
+
+CREATE_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS frontier (
+    url TEXT PRIMARY KEY,
+    site TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    last_fetched REAL,
+    last_hash TEXT,
+    last_price REAL,
+    fetches INTEGER DEFAULT 0,
+    changes INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_frontier_site ON frontier (site, last_seen);
+'''
+
+# Trường của item dùng để phát hiện thay đổi (bỏ timestamp)
+HASH_FIELDS = ("brand", "product_name", "price", "currency", "sold_count")
+
+_lock = threading.Lock()
+_conn = None
+stats = {"scheduled": 0, "new": 0, "fetched": 0, "changed": 0}
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        os.makedirs(DB_DIR, exist_ok=True)
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _conn.executescript(CREATE_TABLE_SQL)
+        _conn.commit()
+    return _conn
+
+
+def item_hash(item):
+    if not item:
+        return "dropped"
+    raw = "\x1f".join(str(item.get(k)) for k in HASH_FIELDS)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def overdue(row, now):
+    """Độ quá hạn của URL đã từng tải: >= 1 nghĩa là tới hạn làm mới."""
+    last_fetched, fetches, changes = row
+    change_rate = (changes + 1) / (fetches + 2)
+    interval = BASE_HOURS * 3600 / change_rate
+    return (now - last_fetched) / interval
+
+
+def schedule(site, discovered, budget, done=None):
+    """Ghi nhận URL vừa discovery và trả về danh sách URL cần tải lần này (<= budget).
+
+    done: URL đã xong trong checkpoint của lần chạy này (--resume / queue). URL của site có
+    trong done được tính vào budget và không chọn lại, để tổng số URL không vượt budget.
+    """
+    now = time.time()
+    with _lock:
+        db = _db()
+        db.executemany(
+            "INSERT INTO frontier (url, site, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET last_seen = excluded.last_seen",
+            [(u, site, now, now) for u in discovered],
+        )
+        db.commit()
+        rows = db.execute(
+            "SELECT url, last_fetched, fetches, changes FROM frontier WHERE site = ? AND last_seen >= ?",
+            (site, now - FORGET_DAYS * 86400),
+        ).fetchall()
+
+    order = {u: i for i, u in enumerate(discovered)}
+    new, known = [], []
+    already = 0
+    for url, last_fetched, fetches, changes in rows:
+        if done and url in done:
+            already += 1
+        elif last_fetched is None:
+            new.append(url)
+        else:
+            known.append((overdue((last_fetched, fetches, changes), now), url))
+    new.sort(key=lambda u: order.get(u, len(order)))
+    known.sort(key=lambda x: -x[0])
+    if SKIP_FRESH:
+        known = [k for k in known if k[0] >= 1]
+    budget = max(0, budget - already)
+    picked = (new + [u for _, u in known])[:budget]
+    stats["scheduled"] += len(picked)
+    stats["new"] += min(len(new), len(picked))
+    logging.info(
+        f"[FRONTIER] {site}: {len(rows)} URL đã biết, {len(new)} mới, chọn {len(picked)}/{budget} "
+        f"(tới hạn {sum(1 for s, _ in known if s >= 1)}, đã xong {already})"
+    )
+    return picked
+
+
+def record_fetch(url, item):
+    """Cập nhật frontier sau khi đã tải + parse xong URL (item None = bị lọc)."""
+    h = item_hash(item)
+    price = item.get("price") if item else None
+    now = time.time()
+    try:
+        with _lock:
+            db = _db()
+            row = db.execute("SELECT last_hash FROM frontier WHERE url = ?", (url,)).fetchone()
+            changed = int(bool(row and row[0] is not None and row[0] != h))
+            db.execute(
+                "UPDATE frontier SET last_fetched = ?, last_hash = ?, last_price = ?, "
+                "fetches = fetches + 1, changes = changes + ? WHERE url = ?",
+                (now, h, price, changed, url),
+            )
+            db.commit()
+            stats["fetched"] += 1
+            stats["changed"] += changed
+    except Exception as e:
+        logging.debug(f"[FRONTIER] lỗi ghi {url}: {e}")
+
+
+def log_stats():
+    if stats["scheduled"] or stats["fetched"]:
+        logging.info(
+            f"[FRONTIER] lên lịch {stats['scheduled']} (mới {stats['new']}), tải {stats['fetched']}, "
+            f"dữ liệu đổi {stats['changed']}"
+        )
@@ -0,0 +1,214 @@
+"""Kho HTML thô của các lần crawl: nén gzip, định danh theo nội dung (sha256).
+
+- objects/<sha[:2]>/<sha>.html.gz: mỗi body HTML chỉ lưu một lần dù xuất hiện ở
+  nhiều lần chạy (trang không đổi giữa các ngày không tốn thêm dung lượng).
+- manifests/<run_id>.jsonl: mỗi dòng {url, source, sha, rendered, fetched_at} của một lần chạy
+  (run_id = tên file raw_laptop_<ts>, không đuôi .csv).
+
+run_extract gọi begin_run()/end_run(); page_parser gọi save() cho mỗi trang đã tải.
+end_run() áp dụng retention: giữ EXTRACT_HTML_STORE_KEEP_RUNS lần chạy gần nhất và
+tổng dung lượng <= EXTRACT_HTML_STORE_MAX_MB (xoá lần chạy cũ nhất trước), object
+không còn manifest nào tham chiếu bị xoá. EXTRACT_HTML_STORE=0 để tắt.
+Dùng extract/reparse.py để dựng lại CSV raw (reparse_<run_id>.csv) từ kho mà không crawl lại.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+HTML_STORE_ENABLED = os.environ.get("EXTRACT_HTML_STORE", "1").lower() not in ("0", "false", "no")
+HTML_STORE_DIR = os.environ.get("EXTRACT_HTML_STORE_DIR", os.path.join("data_output", "html_store"))
+HTML_STORE_KEEP_RUNS = int(os.environ.get("EXTRACT_HTML_STORE_KEEP_RUNS", "5"))
+HTML_STORE_MAX_BYTES = int(float(os.environ.get("EXTRACT_HTML_STORE_MAX_MB", "2000")) * 1024 * 1024)
+
+
+class HtmlStore:
+    def __init__(self, root=HTML_STORE_DIR):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.manifests_dir = os.path.join(root, "manifests")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.run_id = None
+        self._manifest = None
+        self.stats = {"pages": 0, "new_objects": 0, "new_bytes": 0}
+
+    def _object_path(self, sha):
+        return os.path.join(self.objects_dir, sha[:2], f"{sha}.html.gz")
+
+    def _manifest_path(self, run_id):
+        return os.path.join(self.manifests_dir, f"{run_id}.jsonl")
+
+    def put_object(self, html):
+        """Lưu body (nếu chưa có) và trả về sha256 của nó."""
+        data = html.encode("utf-8", errors="replace") if isinstance(html, str) else html
+        sha = hashlib.sha256(data).hexdigest()
+        path = self._object_path(sha)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp, "wb", compresslevel=6) as f:
+                f.write(data)
+            os.replace(tmp, path)
+            with self.lock:
+                self.stats["new_objects"] += 1
+                self.stats["new_bytes"] += os.path.getsize(path)
+        return sha
+
+    def read_object(self, sha):
+        with gzip.open(self._object_path(sha), "rb") as f:
+            return f.read().decode("utf-8", errors="replace")
+
+    def begin_run(self, run_id):
+        """Bắt đầu ghi manifest cho run_id (append nếu đã có, vd khi resume)."""
+        with self.lock:
+            if self._manifest is not None:
+                self._manifest.close()
+            self.run_id = run_id
+            self.stats = {"pages": 0, "new_objects": 0, "new_bytes": 0}
+            self._manifest = open(self._manifest_path(run_id), "a", encoding="utf-8", buffering=1)
+
+    def save(self, url, source, html, rendered=False):
+        if self._manifest is None or not html:
+            return
+        sha = self.put_object(html)
+        line = json.dumps({
+            "url": url, "source": source, "sha": sha, "rendered": bool(rendered),
+            "fetched_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }, ensure_ascii=False)
+        with self.lock:
+            if self._manifest is not None:
+                self._manifest.write(line + "\n")
+                self.stats["pages"] += 1
+
+    def end_run(self):
+        with self.lock:
+            if self._manifest is None:
+                return
+            self._manifest.close()
+            self._manifest = None
+            s = self.stats
+            logging.info(
+                f"[HTML STORE] {self.run_id}: {s['pages']} trang, {s['new_objects']} body mới "
+                f"({s['new_bytes'] / 1024 / 1024:.1f}MB)"
+            )
+        self.apply_retention()
+
+    def runs(self):
+        """run_id của các lần chạy còn trong kho, cũ nhất trước."""
+        names = [n[:-len(".jsonl")] for n in os.listdir(self.manifests_dir) if n.endswith(".jsonl")]
+        return sorted(names)
+
+    def read_manifest(self, run_id):
+        entries = []
+        with open(self._manifest_path(run_id), encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    pass  # dòng cuối dở do crash
+        return entries
+
+    def _objects(self):
+        for dirpath, _, files in os.walk(self.objects_dir):
+            for name in files:
+                if name.endswith(".html.gz"):
+                    path = os.path.join(dirpath, name)
+                    yield name[:-len(".html.gz")], path, os.path.getsize(path)
+
+    def apply_retention(self, keep_runs=HTML_STORE_KEEP_RUNS, max_bytes=HTML_STORE_MAX_BYTES):
+        """Xoá lần chạy cũ theo số lượng rồi theo dung lượng, sau đó dọn object mồ côi."""
+        runs = self.runs()
+        if self.run_id in runs:
+            runs.remove(self.run_id)
+            runs.append(self.run_id)  # không bao giờ xoá lần chạy hiện tại
+        dropped = []
+        while len(runs) > max(1, keep_runs):
+            dropped.append(runs.pop(0))
+
+        def referenced(run_ids):
+            refs = set()
+            for r in run_ids:
+                refs.update(e["sha"] for e in self.read_manifest(r))
+            return refs
+
+        refs = referenced(runs)
+        sizes = {sha: size for sha, _, size in self._objects()}
+        # Theo dung lượng: bỏ tiếp lần chạy cũ nhất tới khi vừa giới hạn (giữ ít nhất 1)
+        while len(runs) > 1 and sum(sizes[s] for s in refs if s in sizes) > max_bytes:
+            dropped.append(runs.pop(0))
+            refs = referenced(runs)
+
+        for r in dropped:
+            try:
+                os.remove(self._manifest_path(r))
+            except OSError:
+                pass
+        removed = 0
+        for sha, path, _ in list(self._objects()):
+            if sha not in refs:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        if dropped or removed:
+            logging.info(f"[HTML STORE] Retention: xoá {len(dropped)} lần chạy, {removed} body không còn dùng")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Kho dùng chung; None nếu bị tắt hoặc không mở được."""
+    global _store, HTML_STORE_ENABLED
+    if not HTML_STORE_ENABLED:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                try:
+                    _store = HtmlStore()
+                except Exception as e:
+                    logging.warning(f"[HTML STORE] Không mở được {HTML_STORE_DIR}: {e}")
+                    HTML_STORE_ENABLED = False
+                    return None
+    return _store
+
+
+def begin_run(run_id):
+    store = get_store()
+    if store:
+        store.begin_run(run_id)
+
+
+def recording():
+    """True nếu đang ghi manifest cho một lần chạy (save() có tác dụng)."""
+    return _store is not None and _store._manifest is not None
+
+
+def end_run():
+    """Đóng manifest của lần chạy hiện tại và áp dụng retention (gọi ở cuối run_extract)."""
+    if _store is not None:
+        try:
+            _store.end_run()
+        except Exception as e:
+            logging.warning(f"[HTML STORE] Lỗi khi kết thúc lần chạy: {e}")
+
+
+def save(url, source, html, rendered=False):
+    """Lưu HTML của một trang vào lần chạy hiện tại (no-op nếu chưa begin_run)."""
+    if _store is None:
+        return
+    try:
+        _store.save(url, source, html, rendered)
+    except Exception as e:
+        logging.debug(f"[HTML STORE] Không lưu được {url}: {e}")
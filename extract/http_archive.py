@@ -0,0 +1,116 @@
+"""Ghi / phát lại response HTTP và HTML render để chạy crawl offline, lặp lại được.
+
+Chọn chế độ bằng EXTRACT_HTTP_MODE:
+- live (mặc định): không đụng tới archive.
+- record: mọi response của http_get / http_stream / render_html được lưu vào archive
+  (URL, status, header, body nén zlib), bản mới ghi đè bản cũ cùng URL.
+- replay: chỉ đọc từ archive, không gửi request nào ra mạng; URL không có trong
+  archive coi như tải lỗi.
+
+Archive là một file SQLite (EXTRACT_HTTP_ARCHIVE, mặc định data_output/http_archive.db)
+nên dễ copy / giữ lại làm workload cố định cho việc đo hiệu năng parser.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+HTTP_MODE = os.environ.get("EXTRACT_HTTP_MODE", "live").lower()
+ARCHIVE_PATH = os.environ.get("EXTRACT_HTTP_ARCHIVE", os.path.join("data_output", "http_archive.db"))
+
+CREATE_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS responses (
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT,
+    encoding TEXT,
+    body BLOB,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (kind, url)
+);
+'''
+
+
+def is_recording():
+    return HTTP_MODE == "record"
+
+
+def is_replaying():
+    return HTTP_MODE == "replay"
+
+
+class HttpArchive:
+    def __init__(self, path=ARCHIVE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stats = {"recorded": 0, "replayed": 0, "missing": 0}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(CREATE_TABLE_SQL)
+        self.conn.commit()
+
+    def record(self, kind, url, status, headers=None, body=b"", encoding=None):
+        """Lưu một response; kind = "http" (http_get / http_stream) hoặc "render"."""
+        blob = zlib.compress(body or b"", 6)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (kind, url, status, headers, encoding, body, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, url, int(status), json.dumps(dict(headers or {})), encoding, blob, time.time()),
+            )
+            self.conn.commit()
+            self.stats["recorded"] += 1
+
+    def lookup(self, kind, url):
+        """(status, headers dict, body bytes, encoding) hoặc None nếu URL chưa được ghi."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, headers, body, encoding FROM responses WHERE kind = ? AND url = ?", (kind, url)
+            ).fetchone()
+            if not row:
+                self.stats["missing"] += 1
+                return None
+            self.stats["replayed"] += 1
+        return row[0], json.loads(row[1] or "{}"), zlib.decompress(row[2]) if row[2] else b"", row[3]
+
+    def log_stats(self):
+        s = self.stats
+        logging.info(
+            f"[HTTP ARCHIVE] {HTTP_MODE}: ghi {s['recorded']}, phát lại {s['replayed']}, "
+            f"thiếu {s['missing']} ({self.path})"
+        )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """Archive dùng chung khi đang record / replay; None ở chế độ live."""
+    global _archive
+    if HTTP_MODE not in ("record", "replay"):
+        return None
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = HttpArchive()
+    return _archive
+
+
+def close_archive():
+    """Ghi log thống kê rồi đóng archive (gọi ở cuối run_extract)."""
+    global _archive
+    with _archive_lock:
+        if _archive is not None:
+            _archive.log_stats()
+            _archive.close()
+            _archive = None
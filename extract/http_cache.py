@@ -0,0 +1,173 @@
+"""On-disk HTTP cache với conditional GET (ETag / Last-Modified).
+
+Lưu body + validator theo URL dưới `data_output/http_cache` (đổi bằng
+EXTRACT_HTTP_CACHE_DIR). Lần chạy sau http_get gửi If-None-Match /
+If-Modified-Since; nếu server trả 304 thì body lấy từ cache.
+Tổng dung lượng bị giới hạn (EXTRACT_HTTP_CACHE_MAX_MB), vượt thì xoá URL ít
+dùng nhất (LRU theo last_access). Đặt EXTRACT_HTTP_CACHE=0 để tắt.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_ENABLED = os.environ.get("EXTRACT_HTTP_CACHE", "1").lower() not in ("0", "false", "no")
+CACHE_DIR = os.environ.get("EXTRACT_HTTP_CACHE_DIR", os.path.join("data_output", "http_cache"))
+CACHE_MAX_BYTES = int(float(os.environ.get("EXTRACT_HTTP_CACHE_MAX_MB", "500")) * 1024 * 1024)
+
+CREATE_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS http_cache (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    encoding TEXT,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+'''
+
+
+class HttpCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.db_path = os.path.join(cache_dir, "index.db")
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute(CREATE_TABLE_SQL)
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM http_cache").fetchone()[0]
+
+    def _body_path(self, url):
+        h = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, h[:2], h)
+
+    def conditional_headers(self, url):
+        """Header If-None-Match / If-Modified-Since cho URL đã có trong cache."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified FROM http_cache WHERE url = ?", (url,)
+            ).fetchone()
+        if not row:
+            return {}
+        headers = {}
+        if row[0]:
+            headers["If-None-Match"] = row[0]
+        if row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def load(self, url):
+        """Trả về (body bytes, encoding) cho response 304, hoặc None nếu cache thiếu."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT path, encoding FROM http_cache WHERE url = ?", (url,)
+            ).fetchone()
+            if not row:
+                return None
+            try:
+                with open(row[0], "rb") as f:
+                    body = f.read()
+            except OSError:
+                self._delete(url)
+                return None
+            self.conn.execute("UPDATE http_cache SET last_access = ? WHERE url = ?", (time.time(), url))
+            self.conn.commit()
+            self.stats["hits"] += 1
+        return body, row[1]
+
+    def store(self, url, headers, body, encoding=None):
+        """Lưu body của response 200 (chỉ khi server có trả validator)."""
+        with self.lock:
+            self.stats["misses"] += 1
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        path = self._body_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM http_cache WHERE url = ?", (url,)).fetchone()
+            with open(path, "wb") as f:
+                f.write(body)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO http_cache (url, etag, last_modified, encoding, path, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, encoding, path, len(body), time.time()),
+            )
+            self.conn.commit()
+            self.total_bytes += len(body) - (old[0] if old else 0)
+            self.stats["stored"] += 1
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _delete(self, url):
+        row = self.conn.execute("SELECT path, size FROM http_cache WHERE url = ?", (url,)).fetchone()
+        if not row:
+            return
+        try:
+            os.remove(row[0])
+        except OSError:
+            pass
+        self.conn.execute("DELETE FROM http_cache WHERE url = ?", (url,))
+        self.total_bytes -= row[1]
+
+    def _evict(self):
+        # Xoá theo LRU tới khi còn ~90% giới hạn để không phải evict sau mỗi lần store
+        target = int(self.max_bytes * 0.9)
+        rows = self.conn.execute("SELECT url FROM http_cache ORDER BY last_access ASC").fetchall()
+        for (url,) in rows:
+            if self.total_bytes <= target:
+                break
+            self._delete(url)
+            self.stats["evicted"] += 1
+        self.conn.commit()
+
+    def log_stats(self):
+        s = self.stats
+        total = s["hits"] + s["misses"]
+        ratio = (s["hits"] / total * 100) if total else 0.0
+        logging.info(
+            f"[HTTP CACHE] hit {s['hits']} / miss {s['misses']} ({ratio:.1f}% hit), "
+            f"lưu {s['stored']}, evict {s['evicted']}, dung lượng {self.total_bytes / 1024 / 1024:.1f}MB"
+        )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Cache dùng chung; None nếu bị tắt hoặc không mở được."""
+    global _cache, CACHE_ENABLED
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = HttpCache()
+                except Exception as e:
+                    logging.warning(f"[HTTP CACHE] Không mở được cache {CACHE_DIR}: {e}")
+                    CACHE_ENABLED = False
+                    return None
+    return _cache
+
+
+def close_cache():
+    """Ghi log hit/miss rồi đóng cache (gọi ở cuối run_extract)."""
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.log_stats()
+            _cache.close()
+            _cache = None
@@ -70,3 +70,18 @@ def insert_final(status, attempts=0, message=None, csv_path=None, row_count=None
     )
     conn.commit()
     conn.close()
+
+
+def get_last_success_time():
+    """Thời điểm bắt đầu của lần extract thành công gần nhất (datetime) hoặc None."""
+    _ensure_db()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        row = conn.execute(
+            "SELECT started_at FROM extract_runs WHERE status = 'success' ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+    finally:
+        conn.close()
+    if not row or not row[0]:
+        return None
+    return datetime.fromisoformat(row[0])
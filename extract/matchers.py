@@ -0,0 +1,47 @@
+"""Bộ so khớp nhiều từ khoá, biên dịch một lần thành một regex alternation.
+
+Thay cho các vòng `any(k in text.lower() for k in [...])` trong vòng lặp nóng
+(anchor trang danh mục, loc sitemap, tên sản phẩm). Text được lower() một lần rồi
+so khớp regex phân biệt hoa thường (re.IGNORECASE chậm hơn vài lần trên CPython);
+vẫn là so khớp chuỗi con như code cũ.
+
+first() trả về từ khoá xuất hiện sớm nhất trong chuỗi; cùng vị trí thì lấy từ
+khoá dài nhất → kết quả luôn xác định (vd "Apple MacBook Air" → "apple",
+"MacBook Pro" → "macbook"), không phụ thuộc thứ tự duyệt set.
+"""
+import re
+from functools import lru_cache
+
+
+class KeywordMatcher:
+    def __init__(self, keywords):
+        # Dài trước để alternation ưu tiên match dài nhất tại cùng vị trí
+        kws = sorted({k.lower() for k in keywords if k}, key=lambda k: (-len(k), k))
+        self.keywords = tuple(kws)
+        self._re = re.compile("|".join(re.escape(k) for k in kws)) if kws else None
+
+    def search(self, text):
+        """True nếu text chứa ít nhất một từ khoá."""
+        return bool(self._re is not None and text and self._re.search(text.lower()))
+
+    def first(self, text):
+        """Từ khoá (chữ thường) xuất hiện sớm nhất, dài nhất; None nếu không có."""
+        if self._re is None or not text:
+            return None
+        m = self._re.search(text.lower())
+        return m.group(0) if m else None
+
+    def __repr__(self):
+        return f"KeywordMatcher({list(self.keywords)!r})"
+
+
+@lru_cache(maxsize=64)
+def _cached(keywords):
+    return KeywordMatcher(keywords)
+
+
+def compile_keywords(keywords):
+    """KeywordMatcher cho một danh sách từ khoá (cache theo nội dung danh sách)."""
+    if isinstance(keywords, KeywordMatcher):
+        return keywords
+    return _cached(tuple(keywords or ()))
@@ -1,10 +1,19 @@
 # page_parser.py
 import json
 import logging
+import os
+import re
+import threading
 import warnings
 from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
 from datetime import datetime
-from extract.extract_utils import http_get, parse_price, parse_sold_number
+from lxml import etree
+from extract.extract_utils import (
+    http_get, http_stream_read, cached_response, declared_encoding, parse_price, parse_sold_number,
+)
+from extract.http_cache import get_cache
+from extract import html_store, render_memo
+from extract.matchers import KeywordMatcher
 # Optional renderer for JS-rendered product pages
 try:
     from extract.render_crawler import render_html
@@ -23,11 +32,28 @@ LAP_KEYWORDS = [
     "tuf", "rog", "legion", "pavilion", "zenbook", "ideapad"
 ]
 
-def extract_jsonld(soup):
-    for s in soup.find_all("script", type="application/ld+json"):
+# Từ khoá nào xuất hiện sớm nhất trong tên thắng (cùng vị trí thì từ dài hơn)
+BRAND_MATCHER = KeywordMatcher(BRAND_WHITELIST)
+LAP_KEYWORD_MATCHER = KeywordMatcher(LAP_KEYWORDS)
+PRODUCT_URL_MATCHER = KeywordMatcher(["/laptop-", "/may-tinh-xach-tay-", "/laptop/"])
+
+PRICE_SELECTOR = ".price, .product-price, .price-value, .gia, .box-price-present"
+PRICE_CLASSES = {"price", "product-price", "price-value", "gia", "box-price-present"}
+GEARVN_SOLD_CLASSES = {"product-quantity-sold", "productView-soldCount"}
+
+# EXTRACT_STREAM_PRODUCT=1: tải trang sản phẩm dạng stream và dừng đọc khi đã thấy đủ JSON-LD
+# Product + giá + số đã bán. Tắt mặc định, và tự tắt khi html_store hoặc HTTP cache đang bật:
+# trang dừng sớm không có body đầy đủ để lưu (reparse, validator cho 304)
+STREAM_PRODUCT_PAGES = os.environ.get("EXTRACT_STREAM_PRODUCT", "0").lower() in ("1", "true", "yes")
+STREAM_CHUNK_SIZE = 16 * 1024
+stream_stats = {"pages": 0, "early_stops": 0, "bytes_read": 0, "bytes_saved": 0}
+_stream_lock = threading.Lock()
+_stream_off_logged = False
+
+def _jsonld_product(texts):
+    for txt in texts:
         try:
-            txt = s.string or ""
-            data = json.loads(txt.strip())
+            data = json.loads((txt or "").strip())
             if isinstance(data, dict) and data.get("@type") == "Product":
                 return data
             if isinstance(data, list):
@@ -38,22 +64,276 @@ def extract_jsonld(soup):
             pass
     return None
 
-def parse_product_page(url, source):
-    r = http_get(url)
-    if not r:
+def extract_jsonld(soup):
+    return _jsonld_product(s.string for s in soup.find_all("script", type="application/ld+json"))
+
+def _jsonld_price(jd):
+    offers = jd.get("offers") or {}
+    if isinstance(offers, dict):
+        return parse_price(str(offers.get("price") or offers.get("priceSpecification", {}).get("price")))
+    return None
+
+def _new_facts():
+    return {
+        "jsonld": [], "scripts": [], "h1": None, "title": None, "price_text": None,
+        "meta_property": None, "meta_itemprop": None, "data_price": None,
+        "sold_tgdd": None, "sold_gearvn": None,
+    }
+
+def _lxml_text(el):
+    # tương đương get_text(strip=True) của BeautifulSoup
+    return "".join(t.strip() for t in el.itertext())
+
+def facts_fast(html):
+    """Fast path: một lượt duyệt cây lxml, gom mọi node mà parse_product_html cần.
+
+    Trả về dict facts (JSON-LD, script, h1/title, giá theo selector/meta/data-price,
+    số đã bán) hoặc None nếu lxml không dựng được cây.
+    """
+    data = html.encode("utf-8", errors="replace") if isinstance(html, str) else html
+    root = etree.fromstring(data, etree.HTMLParser(encoding="utf-8", recover=True))
+    if root is None:
         return None
+    f = _new_facts()
+    for el in root.iter():
+        tag = el.tag
+        if not isinstance(tag, str):
+            continue  # comment / processing instruction
+        if tag == "script":
+            txt = el.text or ""
+            f["scripts"].append(txt)
+            if el.get("type") == "application/ld+json":
+                f["jsonld"].append(txt)
+            continue
+        if tag == "h1":
+            if f["h1"] is None:
+                f["h1"] = _lxml_text(el)
+        elif tag == "title":
+            if f["title"] is None:
+                f["title"] = _lxml_text(el)
+        elif tag == "meta":
+            if f["meta_property"] is None and el.get("property") == "product:price:amount":
+                f["meta_property"] = el.get("content")
+            if f["meta_itemprop"] is None and el.get("itemprop") == "price":
+                f["meta_itemprop"] = el.get("content")
+        if f["data_price"] is None and el.get("data-price") is not None:
+            f["data_price"] = el.get("data-price")
+        cls = el.get("class")
+        if cls:
+            classes = set(cls.split())
+            if f["price_text"] is None and classes & PRICE_CLASSES:
+                f["price_text"] = _lxml_text(el)
+            if f["sold_tgdd"] is None and tag == "span" and "quantity-sale" in classes:
+                f["sold_tgdd"] = _lxml_text(el)
+            if f["sold_gearvn"] is None and classes & GEARVN_SOLD_CLASSES:
+                f["sold_gearvn"] = _lxml_text(el)
+    return f
 
+def facts_soup(html):
+    """Đường chậm: cây BeautifulSoup đầy đủ, trả về cùng dạng facts với facts_fast."""
     # Prefer lxml parser (more robust for mixed/XML-like pages); fall back to html.parser.
     # Also silence the XMLParsedAsHTMLWarning which can be noisy for some responses.
     warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
     try:
-        soup = BeautifulSoup(r.text, "lxml")
+        soup = BeautifulSoup(html, "lxml")
     except Exception:
-        soup = BeautifulSoup(r.text, "html.parser")
-    jd = extract_jsonld(soup)
+        soup = BeautifulSoup(html, "html.parser")
+    f = _new_facts()
+    f["jsonld"] = [s.string for s in soup.find_all("script", type="application/ld+json")]
+    f["scripts"] = [s.string or "" for s in soup.find_all("script")]
+    h1, title = soup.find("h1"), soup.find("title")
+    f["h1"] = h1.get_text(strip=True) if h1 else None
+    f["title"] = title.get_text(strip=True) if title else None
+    el = soup.select_one(PRICE_SELECTOR)
+    f["price_text"] = el.get_text(strip=True) if el else None
+    m = soup.find('meta', property='product:price:amount')
+    f["meta_property"] = m.get('content') if m else None
+    m = soup.find('meta', attrs={'itemprop': 'price'})
+    f["meta_itemprop"] = m.get('content') if m else None
+    el = soup.find(attrs={"data-price": True})
+    f["data_price"] = el.get('data-price') if el else None
+    el = soup.find("span", class_="quantity-sale")
+    f["sold_tgdd"] = el.get_text(strip=True) if el else None
+    el = soup.select_one(".product-quantity-sold, .productView-soldCount")
+    f["sold_gearvn"] = el.get_text(strip=True) if el else None
+    return f
+
+def _has_price_candidate(f):
+    return bool(
+        _jsonld_product(f["jsonld"]) or f["price_text"] or f["meta_property"]
+        or f["meta_itemprop"] or f["data_price"]
+    )
+
+def collect_facts(html):
+    """Thử fast path trước; chỉ dựng BeautifulSoup khi fast path lỗi hoặc không thấy giá."""
+    try:
+        f = facts_fast(html)
+        if f and _has_price_candidate(f):
+            return f
+    except Exception as e:
+        logging.debug(f"Fast path parser lỗi, dùng BeautifulSoup: {e}")
+    return facts_soup(html)
+
+class _EarlyStop:
+    """Theo dõi sự kiện của HTMLPullParser, biết khi nào phần còn lại của trang là thừa."""
+
+    def __init__(self, url):
+        if "thegioididong" in url:
+            self.sold_tag, self.sold_classes = "span", {"quantity-sale"}
+        elif "gearvn" in url:
+            self.sold_tag, self.sold_classes = None, GEARVN_SOLD_CLASSES
+        else:
+            self.sold_classes = None  # site không có số đã bán
+        self.jd = None
+        self.h1 = False
+        self.sold = self.sold_classes is None
+
+    def feed(self, events):
+        for _, el in events:
+            tag = el.tag
+            if not isinstance(tag, str):
+                continue
+            if tag == "script":
+                if self.jd is None and el.get("type") == "application/ld+json":
+                    self.jd = _jsonld_product([el.text])
+            elif tag == "h1":
+                self.h1 = True
+            if not self.sold and (self.sold_tag is None or tag == self.sold_tag):
+                cls = el.get("class")
+                if cls and self.sold_classes & set(cls.split()):
+                    self.sold = True
+
+    def satisfied(self):
+        return bool(
+            self.jd and _jsonld_price(self.jd) and (self.jd.get("name") or self.h1) and self.sold
+        )
+
+
+def stream_product_html(url, cache=None):
+    """Tải trang sản phẩm theo từng chunk qua lxml HTMLPullParser, dừng khi _EarlyStop đủ.
+
+    Trả về (html, complete) hoặc (None, False). complete=False: HTML bị cắt sau các
+    node cần thiết (collect_facts parse với recover) → không lưu vào html_store.
+    Body đọc trong vòng retry của http_stream_read: lỗi giữa chừng được thử lại / ghi
+    dead letter như http_get. Charset lấy từ Content-Type / <meta charset> nếu có,
+    chỉ dò apparent_encoding khi thiếu.
+    Chỉ body đọc hết mới vào HTTP cache; trang dừng sớm không lưu validator (không có
+    body để trả cho 304). fetch_product_html chỉ gọi khi không bật cache / html_store.
+    """
+    state = {}
+
+    def read(r):
+        # Đọc lại từ đầu ở mỗi lần retry
+        watcher = _EarlyStop(url)
+        parser = None
+        chunks = []
+        state.update(stopped=False, encoding=None, headers=r.headers)
+        for chunk in r.iter_content(STREAM_CHUNK_SIZE):
+            if not chunk:
+                continue
+            chunks.append(chunk)
+            if parser is None:
+                state["encoding"] = declared_encoding(r.headers, chunk)
+                parser = etree.HTMLPullParser(events=("end",), encoding=state["encoding"] or "utf-8", recover=True)
+            parser.feed(chunk)
+            watcher.feed(parser.read_events())
+            if watcher.satisfied():
+                state["stopped"] = True
+                break
+        state["wire"] = r.raw.tell() if r.raw is not None and hasattr(r.raw, "tell") else sum(map(len, chunks))
+        state["body"] = b"".join(chunks)
+
+    if not http_stream_read(url, read) or "body" not in state:
+        return None, False
+    body, stopped, headers = state["body"], state["stopped"], state["headers"]
+    encoding = state["encoding"] or cached_response(url, body).apparent_encoding or "utf-8"
+    length = headers.get("Content-Length")
+    # Dừng ở chunk cuối (đã đọc đủ Content-Length) thì body vẫn đầy đủ
+    if stopped and length and length.isdigit() and state["wire"] >= int(length):
+        stopped = False
+    if cache and not stopped:
+        cache.store(url, headers, body, encoding)
+    with _stream_lock:
+        stream_stats["pages"] += 1
+        stream_stats["bytes_read"] += state["wire"]
+        if stopped:
+            stream_stats["early_stops"] += 1
+            if length and length.isdigit():
+                stream_stats["bytes_saved"] += max(0, int(length) - state["wire"])
+    return body.decode(encoding, errors="replace"), not stopped
+
+
+def log_stream_stats():
+    s = stream_stats
+    if s["pages"]:
+        logging.info(
+            f"[STREAM] {s['pages']} trang, dừng sớm {s['early_stops']}, đọc {s['bytes_read'] / 1024 / 1024:.1f}MB, "
+            f"tiết kiệm {s['bytes_saved'] / 1024 / 1024:.1f}MB"
+        )
+
+
+def _early_stop_allowed(cache):
+    """Stream + dừng sớm chỉ khi được bật và không có kho nào cần body đầy đủ."""
+    global _stream_off_logged
+    if not STREAM_PRODUCT_PAGES:
+        return False
+    if cache is None and not html_store.recording():
+        return True
+    if not _stream_off_logged:
+        _stream_off_logged = True
+        logging.info("[STREAM] Bỏ dừng sớm: html_store / HTTP cache đang bật và cần trang đầy đủ")
+    return False
+
+def _needs_renderer(url):
+    return PAGE_USE_RENDERER and "thegioididong" in url
+
+def fetch_product_html(url, source):
+    """Stage I/O: tải HTML trang sản phẩm, trả về (html, rendered) hoặc (None, False)."""
+    # Trang đã biết chỉ có dữ liệu sau khi render → render thẳng, bỏ GET tĩnh
+    if _needs_renderer(url) and render_memo.should_skip_static(url):
+        html = render_html(url, site=source, kind="product")
+        if html:
+            html_store.save(url, source, html, rendered=True)
+            return html, True
+    cache = get_cache()
+    complete = True
+    if _early_stop_allowed(cache):
+        html, complete = stream_product_html(url)
+    else:
+        r = http_get(url, use_cache=True)
+        html = r.text if r else None
+    if html is None:
+        return None, False
+    if complete:
+        # HTML bị cắt (dừng sớm) không lưu: reparse cần trang đầy đủ
+        html_store.save(url, source, html)
+    return html, False
+
+def parse_product_page(url, source):
+    html, rendered = fetch_product_html(url, source)
+    if html is None:
+        return None
+    return parse_product_html(url, source, html, rendered=rendered)
 
-    brand, name, price, currency = "", "", None, "VND"
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def parse_product_html(url, source, html, rendered=False):
+    """Parse HTML đã tải sẵn của trang sản phẩm thành item dict (None nếu bị loại).
+
+    Tách riêng khỏi việc fetch để engine khác (asyncio...) tự tải HTML rồi gọi lại.
+    rendered=True: html đã là bản render, không render lại.
+    """
+    return finish_product(url, source, parse_static(url, html), rendered=rendered)
+
+def parse_static(url, html, fetched_at=None):
+    """Phần CPU của parse: chỉ đọc HTML, không I/O → chạy được trong ProcessPoolExecutor.
+
+    Trả về dict trạng thái (picklable) để finish_product hoàn tất. fetched_at: thời
+    điểm tải trang ("%Y-%m-%d %H:%M:%S", vd khi reparse từ html_store), mặc định bây giờ.
+    """
+    facts = collect_facts(html)
+    jd = _jsonld_product(facts["jsonld"])
+
+    brand, name, price = "", "", None
+    timestamp = fetched_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     sold_count = None
 
     if jd:
@@ -61,44 +341,29 @@ def parse_product_page(url, source):
         b = jd.get("brand")
         if isinstance(b, dict): brand = b.get("name", "")
         elif isinstance(b, str): brand = b
-        
-        offers = jd.get("offers") or {}
-        if isinstance(offers, dict):
-            price = parse_price(str(offers.get("price") or offers.get("priceSpecification", {}).get("price")))
+
+        price = _jsonld_price(jd)
 
     if not name:
-        title = soup.find("h1") or soup.find("title")
-        name = title.get_text(strip=True) if title else ""
+        name = facts["h1"] if facts["h1"] is not None else (facts["title"] or "")
 
-    if not price:
-        price_el = soup.select_one(".price, .product-price, .price-value, .gia, .box-price-present")
-        if price_el:
-            price = parse_price(price_el.get_text(strip=True))
+    if not price and facts["price_text"] is not None:
+        price = parse_price(facts["price_text"])
 
     # Fallback: try to extract price from meta tags, data-* attributes or inline JSON/script text
     if not price:
         # meta tags
-        try:
-            m = soup.find('meta', property='product:price:amount') or soup.find('meta', attrs={'itemprop': 'price'})
-            if m and m.get('content'):
-                price = parse_price(m['content'])
-        except Exception:
-            pass
+        meta = facts["meta_property"] or facts["meta_itemprop"]
+        if meta:
+            price = parse_price(meta)
 
-    if not price:
-        try:
-            el = soup.find(attrs={"data-price": True})
-            if el:
-                price = parse_price(el.get('data-price'))
-        except Exception:
-            pass
+    if not price and facts["data_price"] is not None:
+        price = parse_price(facts["data_price"])
 
     if not price:
         # search in all script tags for a price pattern (e.g. "price":12345000 or "price":"12.345.000")
         try:
-            import re
-            scripts = soup.find_all('script')
-            txt = "\n".join([s.string or "" for s in scripts])
+            txt = "\n".join(facts["scripts"])
             m = re.search(r'"price"\s*:\s*\"?([\d\.,]+)\"?', txt)
             if m:
                 price = parse_price(m.group(1))
@@ -110,51 +375,90 @@ def parse_product_page(url, source):
         except Exception:
             pass
 
+    # parse sold number
+    if "thegioididong" in url:
+        if facts["sold_tgdd"] is not None: sold_count = parse_sold_number(facts["sold_tgdd"])
+    elif "gearvn" in url:
+        if facts["sold_gearvn"] is not None: sold_count = parse_sold_number(facts["sold_gearvn"])
+
+    return {
+        "brand": brand,
+        "name": name,
+        "price": price,
+        "has_jsonld": bool(jd),
+        "sold_count": sold_count,
+        "timestamp": timestamp,
+    }
+
+def wants_render(url, state, rendered=False):
+    """True nếu finish_product có thể sẽ gọi Playwright cho trạng thái này."""
+    return not rendered and not (state["price"] and state["has_jsonld"]) and _needs_renderer(url)
+
+def _apply_render(html2, price, has_jd):
+    """Bổ sung price / JSON-LD còn thiếu từ HTML đã render."""
+    facts2 = collect_facts(html2)
+    if not has_jd:
+        jd = _jsonld_product(facts2["jsonld"])
+        has_jd = bool(jd)
+        if jd and not price:
+            price = _jsonld_price(jd)
+    if not price and facts2["price_text"] is not None:
+        price = parse_price(facts2["price_text"])
+    return price, has_jd
+
+def finish_product(url, source, state, rendered=False, offline=False, fallback_html=None):
+    """Render fallback (nếu cần) + lọc, trả về item dict hoặc None.
+
+    offline=True (reparse từ html_store): không gọi Playwright, không ghi render_memo;
+    fallback_html là bản render đã lưu của lần crawl gốc (nếu có).
+    """
+    brand, name, price = state["brand"], state["name"], state["price"]
+    has_jd = state["has_jsonld"]
+    currency = "VND"
+
     # If price/JSON-LD missing and Playwright renderer is available, try rendering the product page
-    if (not price or not jd) and PAGE_USE_RENDERER and "thegioididong" in url:
+    # (trừ khi render_memo biết render không giúp gì cho URL / pattern này)
+    static_ok = bool(price and has_jd)
+    if offline:
+        if fallback_html and not rendered and not static_ok:
+            price, has_jd = _apply_render(fallback_html, price, has_jd)
+    elif rendered:
+        render_memo.record(url, render_helped=bool(price))
+    elif static_ok or not _needs_renderer(url):
+        render_memo.record(url, static_ok=static_ok)
+    elif not render_memo.should_skip_render(url):
+        before = (bool(price), has_jd)
+        html2 = None
         try:
-            html2 = render_html(url)
-            if html2:
-                soup2 = BeautifulSoup(html2, "html.parser")
-                if not jd:
-                    jd = extract_jsonld(soup2)
-                    if jd and not price:
-                        offers = jd.get("offers") or {}
-                        if isinstance(offers, dict):
-                            price = parse_price(str(offers.get("price") or offers.get("priceSpecification", {}).get("price")))
-                if not price:
-                    price_el2 = soup2.select_one(".price, .product-price, .price-value, .gia, .box-price-present")
-                    if price_el2:
-                        price = parse_price(price_el2.get_text(strip=True))
-        except Exception:
-            pass
+            html2 = render_html(url, site=source, kind="product")
+        except Exception as e:
+            logging.warning(f"Render lỗi {url}: {e}")
+        if html2:
+            html_store.save(url, source, html2, rendered=True)
+            price, has_jd = _apply_render(html2, price, has_jd)
+            render_memo.record(url, static_ok=False, render_helped=(bool(price), has_jd) != before)
+        else:
+            # Render không chạy được (timeout, pool chết...) không phải "render vô ích":
+            # chỉ ghi phần tĩnh để lỗi tạm thời không làm tắt render cả pattern
+            render_memo.record(url, static_ok=False)
 
     if not brand:
-        for b in BRAND_WHITELIST:
-            if b.lower() in name.lower():
-                brand = b.upper()
-                break
-
-    # parse sold number
-    if "thegioididong" in url:
-        el = soup.find("span", class_="quantity-sale")
-        if el: sold_count = parse_sold_number(el.get_text(strip=True))
-    elif "gearvn" in url:
-        el = soup.select_one(".product-quantity-sold, .productView-soldCount")
-        if el: sold_count = parse_sold_number(el.get_text(strip=True))
+        b = BRAND_MATCHER.first(name)
+        if b:
+            brand = b.upper()
 
     if not price or price <= 0:
         logging.info(f"DROP no_price: {url}")
         return None
 
     # If we have JSON-LD Product data, accept it even if name lacks keyword
-    if jd:
+    if has_jd:
         # jd exists and earlier we extracted name/brand/price from it, so accept
         pass
     else:
         # allow if URL pattern clearly indicates a laptop product (TGDD)
-        has_kw = any(k in name.lower() for k in LAP_KEYWORDS)
-        sure_product = ("/laptop-" in url) or ("/may-tinh-xach-tay-" in url) or ("/laptop/" in url)
+        has_kw = LAP_KEYWORD_MATCHER.search(name)
+        sure_product = PRODUCT_URL_MATCHER.search(url)
         if not has_kw and not sure_product:
             logging.info(f"DROP not_laptop_like: {name} ({url})")
             return None
@@ -166,6 +470,6 @@ def parse_product_page(url, source):
         "currency": currency,
         "source": source,
         "url": url.strip(),
-        "timestamp": timestamp,
-        "sold_count": sold_count
+        "timestamp": state["timestamp"],
+        "sold_count": state["sold_count"]
     }
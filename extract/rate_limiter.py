@@ -0,0 +1,81 @@
+"""Per-host token-bucket rate limiter.
+
+Worker gọi `acquire(url)` TRƯỚC khi gửi request; bucket của host cấp token theo
+đúng `rate` request/giây (cho phép dồn tối đa `burst`). Không còn sleep sau khi
+đã nhận response, nên thread không đứng chờ vô ích sau mỗi trang.
+"""
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+# Mặc định cho host chưa khai báo trong SITES (~ nhịp cũ: 1 request / 1.5s)
+DEFAULT_RATE = 1 / 1.5
+DEFAULT_BURST = 1
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Giữ chỗ 1 token và trả về số giây phải chờ trước khi được gửi request.
+
+        Token có thể âm: mỗi worker xếp hàng một "slot" riêng nên các request được
+        giãn đều đúng `rate`, kể cả khi nhiều thread cùng gọi một lúc.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+_buckets = {}
+_config = {}
+_lock = threading.Lock()
+
+
+def host_of(url):
+    return (urlparse(url).hostname or "").lower()
+
+
+def configure_host(host, rate, burst=1):
+    """Khai báo rate (request/giây) và burst cho một host, ví dụ từ SITES."""
+    host = host.lower()
+    with _lock:
+        _config[host] = (float(rate), int(burst))
+        _buckets.pop(host, None)
+    logging.info(f"[RATE] {host}: {rate} req/s, burst {burst}")
+
+
+def get_bucket(url):
+    host = host_of(url)
+    bucket = _buckets.get(host)
+    if bucket is None:
+        with _lock:
+            bucket = _buckets.get(host)
+            if bucket is None:
+                rate, burst = _config.get(host, (DEFAULT_RATE, DEFAULT_BURST))
+                bucket = _buckets[host] = TokenBucket(rate, burst)
+    return bucket
+
+
+def acquire(url):
+    """Chặn cho tới khi host của `url` còn token; trả về số giây đã chờ."""
+    return get_bucket(url).acquire()
@@ -0,0 +1,214 @@
+"""Ghi item extract ra CSV ngay khi crawl xong từng trang (không gom trong RAM).
+
+- Item được append vào `raw_laptop_<ts>.csv.part` (line-buffered, fsync định kỳ
+  theo EXTRACT_RAW_FSYNC_EVERY item / EXTRACT_RAW_FSYNC_SECONDS giây).
+- `raw_laptop_<ts>.csv.done` là checkpoint: mỗi dòng một URL đã xử lý xong
+  (có item hoặc bị loại bởi bộ lọc). URL tải lỗi không được ghi → sẽ crawl lại.
+- finalize() đổi `.part` thành `raw_laptop_<ts>.csv` và xoá checkpoint. URL đã hết
+  lượt retry (dead letter) được ghi vào `raw_laptop_<ts>.csv.dead` (url, source, reason)
+  để chạy lại riêng bằng run_extract(retry_dead=True).
+
+Khi resume, mở lại file `.part` mới nhất: URL trong checkpoint hoặc đã có trong
+CSV được bỏ qua, item mới tiếp tục được append vào cùng file.
+Chạy lại dead letter (reopen_raw) append vào chính file raw của lần chạy gốc, không
+tạo raw_laptop_<ts>.csv mới chỉ chứa vài dòng.
+"""
+import csv
+import glob
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+RAW_FIELDS = ["brand", "product_name", "price", "currency", "source", "url", "timestamp", "sold_count"]
+
+FSYNC_EVERY = int(os.environ.get("EXTRACT_RAW_FSYNC_EVERY", "50"))
+FSYNC_SECONDS = float(os.environ.get("EXTRACT_RAW_FSYNC_SECONDS", "5"))
+
+PART_SUFFIX = ".part"
+DONE_SUFFIX = ".done"
+DEAD_SUFFIX = ".dead"
+DEAD_FIELDS = ["url", "source", "reason"]
+
+
+def find_in_progress(out_dir):
+    """Đường dẫn CSV (chưa có đuôi .part) của lần chạy dở dang mới nhất, hoặc None."""
+    parts = glob.glob(os.path.join(out_dir, f"raw_laptop_*.csv{PART_SUFFIX}"))
+    if not parts:
+        return None
+    return max(parts)[: -len(PART_SUFFIX)]
+
+
+def find_dead_letters(out_dir):
+    """File dead letter mới nhất trong out_dir, hoặc None."""
+    files = glob.glob(os.path.join(out_dir, f"raw_laptop_*.csv{DEAD_SUFFIX}"))
+    return max(files) if files else None
+
+
+def load_dead_letters(path):
+    """Đọc file dead letter → {source: [url, ...]}."""
+    by_source = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            by_source.setdefault(row["source"], []).append(row["url"])
+    return by_source
+
+
+def new_raw_path(out_dir):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(out_dir, f"raw_laptop_{timestamp}.csv")
+
+
+def reopen_raw(csv_path):
+    """RawWriter append tiếp vào CSV đã finalize (vd khi chạy lại dead letter của nó).
+
+    CSV được chép thành `.part` (nếu chưa có `.part` dở dang) để các URL đã có được
+    bỏ qua; finalize() thay file cũ và giữ nguyên mtime của nó, nên bước "raw mới
+    nhất" (theo mtime) không nhận nhầm lần chạy cũ là snapshot mới.
+    """
+    mtime = os.path.getmtime(csv_path) if os.path.exists(csv_path) else None
+    if mtime is not None and not os.path.exists(csv_path + PART_SUFFIX):
+        shutil.copyfile(csv_path, csv_path + PART_SUFFIX)
+    writer = RawWriter(csv_path)
+    writer.keep_mtime = mtime
+    return writer
+
+
+def _truncate_partial_line(path):
+    # Crash giữa chừng có thể để lại dòng cuối dở → cắt về newline cuối cùng
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(max(0, size - 65536))
+        tail = f.read()
+        if tail.endswith(b"\n"):
+            return
+        cut = tail.rfind(b"\n")
+        f.truncate(size - len(tail) + cut + 1 if cut >= 0 else 0)
+
+
+class RawWriter:
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+        self.part_path = csv_path + PART_SUFFIX
+        self.done_path = csv_path + DONE_SUFFIX
+        self.lock = threading.Lock()
+        self.seen = set()      # URL đã có dòng trong CSV (thay cho drop_duplicates)
+        self.done = set()      # URL đã xử lý xong (checkpoint)
+        self.failed = {}       # url -> (source, reason): hết lượt retry, chưa lấy lại được
+        self.by_source = {}
+        self.count = 0
+        self.keep_mtime = None  # finalize() đặt lại mtime này cho CSV (reopen_raw)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        resumed = os.path.exists(self.part_path) and os.path.getsize(self.part_path) > 0
+        if resumed:
+            _truncate_partial_line(self.part_path)
+            with open(self.part_path, newline="", encoding="utf-8-sig") as f:
+                for row in csv.DictReader(f):
+                    self._remember(row)
+        if os.path.exists(self.done_path):
+            _truncate_partial_line(self.done_path)
+            with open(self.done_path, encoding="utf-8") as f:
+                self.done.update(line.strip() for line in f if line.strip())
+        self.done |= self.seen
+
+        new_file = not os.path.exists(self.part_path) or os.path.getsize(self.part_path) == 0
+        # buffering=1: flush mỗi dòng; utf-8-sig chỉ ghi BOM khi file còn trống
+        self._f = open(self.part_path, "a", newline="", encoding="utf-8-sig", buffering=1)
+        self._done_f = open(self.done_path, "a", encoding="utf-8", buffering=1)
+        self._writer = csv.DictWriter(self._f, fieldnames=RAW_FIELDS, extrasaction="ignore")
+        if new_file:
+            self._writer.writeheader()
+        if resumed:
+            logging.info(f"[RAW] Resume {self.part_path}: đã có {self.count} dòng, {len(self.done)} URL xong")
+
+    def _remember(self, row):
+        self.seen.add(row["url"])
+        self.count += 1
+        self.by_source[row.get("source")] = self.by_source.get(row.get("source"), 0) + 1
+
+    def add(self, item):
+        """Append một item (bỏ qua nếu URL đã có trong file)."""
+        with self.lock:
+            if item["url"] in self.seen:
+                return
+            self._writer.writerow(item)
+            self._remember(item)
+            self._tick()
+
+    def mark_done(self, url):
+        """Ghi URL vào checkpoint sau khi đã xử lý xong."""
+        with self.lock:
+            self.failed.pop(url, None)
+            if url in self.done:
+                return
+            self.done.add(url)
+            self._done_f.write(url + "\n")
+            self._tick()
+
+    def mark_failed(self, url, source, reason):
+        """URL hết lượt retry: ghi vào dead letter khi finalize (trừ khi lần thử sau lấy được)."""
+        with self.lock:
+            if url not in self.done:
+                self.failed[url] = (source, reason)
+
+    def _tick(self):
+        self._unsynced += 1
+        if self._unsynced >= FSYNC_EVERY or time.monotonic() - self._last_sync >= FSYNC_SECONDS:
+            self._sync()
+
+    def _sync(self):
+        for f in (self._f, self._done_f):
+            f.flush()
+            os.fsync(f.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        """Đóng file nhưng giữ `.part` + checkpoint để resume lần sau."""
+        with self.lock:
+            if self._f.closed:
+                return
+            self._sync()
+            self._f.close()
+            self._done_f.close()
+
+    def discard(self):
+        """Đóng và xoá `.part` + checkpoint (lần chạy không lấy được gì)."""
+        self.close()
+        for path in (self.part_path, self.done_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _write_dead_letters(self):
+        with open(self.csv_path + DEAD_SUFFIX, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(DEAD_FIELDS)
+            for url, (source, reason) in sorted(self.failed.items()):
+                w.writerow([url, source, reason])
+        logging.warning(f"[RAW] {len(self.failed)} URL hết lượt retry → {self.csv_path}{DEAD_SUFFIX}")
+
+    def finalize(self):
+        """Đóng file, đổi `.part` → CSV chính thức, xoá checkpoint, ghi dead letter. Trả về số dòng."""
+        self.close()
+        os.replace(self.part_path, self.csv_path)
+        if self.keep_mtime is not None:
+            os.utime(self.csv_path, (time.time(), self.keep_mtime))
+        if self.failed:
+            self._write_dead_letters()
+        elif os.path.exists(self.csv_path + DEAD_SUFFIX):
+            # dead letter cũ của file này đã được lấy lại hết
+            os.remove(self.csv_path + DEAD_SUFFIX)
+        try:
+            os.remove(self.done_path)
+        except OSError:
+            pass
+        return self.count
@@ -2,43 +2,290 @@
 
 Provides `render_html(url, ...)` which returns the page HTML after JS rendering.
 Requires `playwright` package and browser binaries installed (see PLAYWRIGHT_README.md).
+
+Browser được giữ sống trong một pool cố định (EXTRACT_RENDER_POOL_SIZE worker),
+mỗi worker là một thread sở hữu playwright + browser + context/page riêng (sync API
+của Playwright chỉ dùng được trên thread đã tạo ra nó). render_html đẩy job vào
+hàng đợi chung nên gọi được từ bất kỳ thread nào. Page được kiểm tra sức khoẻ
+trước mỗi lần dùng và context được tạo lại sau EXTRACT_RENDER_RECYCLE_AFTER trang.
+Gọi `shutdown_render_pool()` khi kết thúc run_extract.
+
+Render profile theo site (khai báo trong SITES, đăng ký bằng configure_render_profile):
+chặn image/media/font/analytics qua route interception, chờ `domcontentloaded` +
+selector cần thiết thay cho `networkidle` + sleep. EXTRACT_RENDER_LEAN=0 để quay lại
+cách cũ (so sánh trung vị latency qua log_render_stats()).
 """
+import atexit
 import logging
+import os
+import queue
+import statistics
+import threading
 import time
+from concurrent.futures import Future
 from random import random
 
+from extract.http_archive import get_archive, is_replaying
+
 try:
     from playwright.sync_api import sync_playwright
 except Exception as e:
     sync_playwright = None
 
+RENDER_POOL_SIZE = int(os.environ.get("EXTRACT_RENDER_POOL_SIZE", "2"))
+RENDER_RECYCLE_AFTER = int(os.environ.get("EXTRACT_RENDER_RECYCLE_AFTER", "50"))
+# Thời gian tối đa chờ một job (gồm cả thời gian xếp hàng)
+RENDER_JOB_TIMEOUT = float(os.environ.get("EXTRACT_RENDER_JOB_TIMEOUT", "300"))
+
+RENDER_LEAN = os.environ.get("EXTRACT_RENDER_LEAN", "1").lower() not in ("0", "false", "no")
+
+DEFAULT_BLOCK_RESOURCES = ["image", "media", "font"]
+DEFAULT_BLOCK_HOSTS = [
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net",
+    "facebook.net", "facebook.com/tr", "clarity.ms", "hotjar.com", "tiktok.com",
+]
+
+# site_key -> profile dict (block_resources, block_hosts, listing_selector, product_selector, selector_timeout)
+RENDER_PROFILES = {}
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120 Safari/537.36"
+)
+
+
+class _RenderWorker(threading.Thread):
+    """Thread giữ một browser sống lâu và xử lý lần lượt các job render."""
+
+    def __init__(self, pool, idx):
+        super().__init__(name=f"render-{idx}", daemon=True)
+        self.pool = pool
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.pages_done = 0
+        self.profile = None
+
+    def run(self):
+        try:
+            with sync_playwright() as p:
+                self.playwright = p
+                self._loop()
+                self._close_browser()
+        except Exception as e:
+            logging.warning(f"[{self.name}] Playwright worker dừng: {e}")
+            self.pool._worker_failed()
+
+    def _loop(self):
+        while True:
+            job = self.pool.jobs.get()
+            if job is None:
+                break
+            url, kwargs, fut = job
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                fut.set_result(self._render(url, **kwargs))
+            except Exception as e:
+                # page/context hỏng → bỏ để lần sau tạo lại
+                self._close_context()
+                fut.set_exception(e)
+
+    def _launch(self):
+        self._close_browser()
+        self.browser = self.playwright.chromium.launch(headless=self.pool.headless)
+        logging.info(f"[{self.name}] Đã khởi động Chromium")
+
+    def _new_context(self):
+        self._close_context()
+        self.context = self.browser.new_context(
+            user_agent=USER_AGENT,
+            viewport={"width": 1200, "height": 900},
+        )
+        # Route handler chạy trên chính thread này, đọc profile của job hiện tại
+        self.context.route("**/*", self._route)
+        self.page = self.context.new_page()
+        self.pages_done = 0
+
+    def _route(self, route):
+        profile = self.profile
+        if profile:
+            req = route.request
+            if req.resource_type in profile.get("block_resources", ()):
+                return route.abort()
+            url = req.url
+            if any(h in url for h in profile.get("block_hosts", ())):
+                return route.abort()
+        return route.continue_()
+
+    def _ensure_healthy(self):
+        if self.browser is None or not self.browser.is_connected():
+            self._launch()
+            self._new_context()
+        elif self.page is None or self.page.is_closed() or self.pages_done >= RENDER_RECYCLE_AFTER:
+            self._new_context()
+
+    def _render(self, url, wait_until, timeout, profile=None, selector=None):
+        self._ensure_healthy()
+        self.profile = profile
+        t0 = time.perf_counter()
+        if profile:
+            self.page.goto(url, wait_until="domcontentloaded", timeout=timeout)
+            if selector:
+                try:
+                    self.page.wait_for_selector(
+                        selector, state="attached", timeout=profile.get("selector_timeout", 8000)
+                    )
+                except Exception:
+                    logging.debug(f"Selector {selector} không xuất hiện trên {url}, lấy DOM hiện có")
+        else:
+            self.page.goto(url, wait_until=wait_until, timeout=timeout)
+            # small jitter to let client scripts settle
+            time.sleep(0.5 + random() * 0.5)
+        html = self.page.content()
+        self.pages_done += 1
+        self.pool._record_latency("lean" if profile else "full", time.perf_counter() - t0)
+        return html
+
+    def _close_context(self):
+        if self.context is not None:
+            try:
+                self.context.close()
+            except Exception:
+                pass
+        self.context = None
+        self.page = None
+
+    def _close_browser(self):
+        self._close_context()
+        if self.browser is not None:
+            try:
+                self.browser.close()
+            except Exception:
+                pass
+        self.browser = None
+
+
+class BrowserPool:
+    def __init__(self, size=RENDER_POOL_SIZE, headless=True):
+        self.headless = headless
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.alive = size
+        self.latencies = {"lean": [], "full": []}
+        self.workers = [_RenderWorker(self, i) for i in range(size)]
+        for w in self.workers:
+            w.start()
 
-def render_html(url, wait_until='networkidle', timeout=15000, headless=True):
+    def submit(self, url, **kwargs):
+        if self.alive <= 0:
+            raise RuntimeError("Render pool không có worker")
+        fut = Future()
+        self.jobs.put((url, kwargs, fut))
+        return fut
+
+    def _record_latency(self, mode, seconds):
+        with self.lock:
+            self.latencies[mode].append(seconds)
+
+    def _worker_failed(self):
+        # Nếu không còn worker nào sống, huỷ các job đang chờ để caller không bị treo
+        with self.lock:
+            self.alive -= 1
+            if self.alive > 0:
+                return
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None and job[2].set_running_or_notify_cancel():
+                job[2].set_exception(RuntimeError("Render pool không có worker"))
+
+    def shutdown(self):
+        for _ in self.workers:
+            self.jobs.put(None)
+        for w in self.workers:
+            w.join(timeout=30)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool(headless=True):
+    global _pool
+    if _pool is None or _pool.alive <= 0:
+        with _pool_lock:
+            if _pool is None or _pool.alive <= 0:
+                _pool = BrowserPool(headless=headless)
+    return _pool
+
+
+def shutdown_render_pool():
+    """Đóng toàn bộ browser của pool (an toàn khi pool chưa từng được tạo)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            log_render_stats()
+            _pool.shutdown()
+            _pool = None
+
+
+def log_render_stats():
+    """Ghi số lần render và trung vị latency theo chế độ (lean / full)."""
+    if _pool is None:
+        return
+    with _pool.lock:
+        snapshot = {k: list(v) for k, v in _pool.latencies.items()}
+    for mode, values in snapshot.items():
+        if values:
+            logging.info(
+                f"[RENDER] {mode}: {len(values)} trang, median {statistics.median(values):.2f}s, "
+                f"max {max(values):.2f}s"
+            )
+
+
+def configure_render_profile(site_key, profile):
+    """Đăng ký render profile cho một site (gọi từ crawler theo SITES)."""
+    merged = {
+        "block_resources": DEFAULT_BLOCK_RESOURCES,
+        "block_hosts": DEFAULT_BLOCK_HOSTS,
+    }
+    merged.update(profile or {})
+    RENDER_PROFILES[site_key] = merged
+
+
+atexit.register(shutdown_render_pool)
+
+
+def render_html(url, wait_until='networkidle', timeout=15000, headless=True, site=None, kind="product"):
     """Render the page and return HTML string.
 
+    site/kind chọn render profile (kind = "listing" hoặc "product" → listing_selector /
+    product_selector). Không có profile hoặc EXTRACT_RENDER_LEAN=0 thì render đầy đủ như cũ.
     Returns None on failure.
+    EXTRACT_HTTP_MODE=record/replay: lưu / lấy HTML đã render từ http_archive.
     """
+    archive = get_archive()
+    if archive and is_replaying():
+        hit = archive.lookup("render", url)
+        return hit[2].decode(hit[3] or "utf-8", errors="replace") if hit and hit[0] == 200 else None
+
     if sync_playwright is None:
         logging.warning("Playwright not installed; render_html unavailable.")
         return None
 
+    profile = RENDER_PROFILES.get(site) if RENDER_LEAN else None
+    selector = profile.get(f"{kind}_selector") if profile else None
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=headless)
-            context = browser.new_context(
-                user_agent=(
-                    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                    "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120 Safari/537.36"
-                ),
-                viewport={"width": 1200, "height": 900},
-            )
-            page = context.new_page()
-            page.goto(url, wait_until=wait_until, timeout=timeout)
-            # small jitter to let client scripts settle
-            time.sleep(0.5 + random() * 0.5)
-            html = page.content()
-            browser.close()
-            return html
+        fut = get_render_pool(headless).submit(
+            url, wait_until=wait_until, timeout=timeout, profile=profile, selector=selector
+        )
+        html = fut.result(timeout=RENDER_JOB_TIMEOUT)
+        if archive and html:
+            archive.record("render", url, 200, None, html.encode("utf-8"), "utf-8")
+        return html
     except Exception as e:
         logging.warning(f"Playwright render failed for {url}: {e}")
         return None
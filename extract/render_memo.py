@@ -0,0 +1,151 @@
+"""Ghi nhớ (qua nhiều lần chạy) trang nào thật sự cần render bằng Playwright.
+
+Với mỗi URL lưu: HTML tĩnh có đủ price + JSON-LD không, render có giúp lấy thêm
+dữ liệu không, và lần kiểm tra gần nhất. Thêm thống kê theo pattern URL
+(host + segment đầu của path, vd `www.thegioididong.com/laptop`).
+
+- should_skip_render: URL (hoặc cả pattern) đã render mà không được gì → bỏ render.
+- should_skip_static: URL tĩnh luôn thiếu còn render thì có → render thẳng, bỏ GET tĩnh.
+Quyết định hết hạn sau EXTRACT_RENDER_MEMO_TTL_DAYS ngày để được kiểm tra lại.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+DB_DIR = os.path.join(os.path.dirname(__file__), '..', 'logs')
+DB_PATH = os.path.join(DB_DIR, 'render_memo.db')
+
+MEMO_TTL_DAYS = float(os.environ.get("EXTRACT_RENDER_MEMO_TTL_DAYS", "7"))
+# Số lần render tối thiểu của một pattern trước khi được phép bỏ render cả pattern
+PATTERN_MIN_SAMPLES = int(os.environ.get("EXTRACT_RENDER_MEMO_MIN_SAMPLES", "20"))
+
+CREATE_TABLES_SQL = '''
+CREATE TABLE IF NOT EXISTS render_urls (
+    url TEXT PRIMARY KEY,
+    pattern TEXT NOT NULL,
+    static_ok INTEGER,
+    static_checked_at TEXT,
+    render_helped INTEGER,
+    render_checked_at TEXT
+);
+CREATE TABLE IF NOT EXISTS render_patterns (
+    pattern TEXT PRIMARY KEY,
+    renders INTEGER DEFAULT 0,
+    helped INTEGER DEFAULT 0,
+    checked_at TEXT NOT NULL
+);
+'''
+
+_lock = threading.Lock()
+_conn = None
+stats = {"renders": 0, "renders_avoided": 0, "static_skipped": 0}
+
+
+def url_pattern(url):
+    p = urlparse(url)
+    first = p.path.strip("/").split("/")[0] if p.path.strip("/") else ""
+    return f"{(p.hostname or '').lower()}/{first}"
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        os.makedirs(DB_DIR, exist_ok=True)
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _conn.executescript(CREATE_TABLES_SQL)
+        _conn.commit()
+    return _conn
+
+
+def _fresh(checked_at):
+    try:
+        return datetime.now() - datetime.fromisoformat(checked_at) < timedelta(days=MEMO_TTL_DAYS)
+    except (TypeError, ValueError):
+        return False
+
+
+def should_skip_render(url):
+    """True nếu render cho URL này (hoặc pattern của nó) được biết là vô ích."""
+    try:
+        with _lock:
+            db = _db()
+            row = db.execute(
+                "SELECT render_helped, render_checked_at FROM render_urls WHERE url = ?", (url,)
+            ).fetchone()
+            prow = db.execute(
+                "SELECT renders, helped, checked_at FROM render_patterns WHERE pattern = ?", (url_pattern(url),)
+            ).fetchone()
+            skip = False
+            if row and row[0] == 0 and _fresh(row[1]):
+                skip = True
+            elif prow and prow[0] >= PATTERN_MIN_SAMPLES and prow[1] == 0 and _fresh(prow[2]):
+                skip = True
+            if skip:
+                stats["renders_avoided"] += 1
+            return skip
+    except Exception as e:
+        logging.debug(f"[RENDER MEMO] lỗi đọc {url}: {e}")
+        return False
+
+
+def should_skip_static(url):
+    """True nếu HTML tĩnh của URL luôn thiếu dữ liệu còn bản render thì đủ."""
+    try:
+        with _lock:
+            row = _db().execute(
+                "SELECT static_ok, render_helped, static_checked_at FROM render_urls WHERE url = ?", (url,)
+            ).fetchone()
+            skip = bool(row and row[0] == 0 and row[1] == 1 and _fresh(row[2]))
+            if skip:
+                stats["static_skipped"] += 1
+            return skip
+    except Exception as e:
+        logging.debug(f"[RENDER MEMO] lỗi đọc {url}: {e}")
+        return False
+
+
+def record(url, static_ok=None, render_helped=None):
+    """Lưu kết quả của một lần parse.
+
+    static_ok=None: không parse HTML tĩnh; render_helped=None: không render.
+    Phần không được kiểm tra giữ nguyên giá trị và thời điểm cũ.
+    """
+    now = datetime.now().isoformat(sep=' ', timespec='seconds')
+    pattern = url_pattern(url)
+    static_val = None if static_ok is None else int(bool(static_ok))
+    render_val = None if render_helped is None else int(bool(render_helped))
+    try:
+        with _lock:
+            db = _db()
+            db.execute(
+                "INSERT INTO render_urls (url, pattern, static_ok, static_checked_at, render_helped, render_checked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET "
+                "static_ok = COALESCE(excluded.static_ok, static_ok), "
+                "static_checked_at = COALESCE(excluded.static_checked_at, static_checked_at), "
+                "render_helped = COALESCE(excluded.render_helped, render_helped), "
+                "render_checked_at = COALESCE(excluded.render_checked_at, render_checked_at)",
+                (url, pattern, static_val, now if static_val is not None else None,
+                 render_val, now if render_val is not None else None),
+            )
+            if render_helped is not None:
+                stats["renders"] += 1
+                db.execute(
+                    "INSERT INTO render_patterns (pattern, renders, helped, checked_at) VALUES (?, 1, ?, ?) "
+                    "ON CONFLICT(pattern) DO UPDATE SET renders = renders + 1, "
+                    "helped = helped + excluded.helped, checked_at = excluded.checked_at",
+                    (pattern, int(bool(render_helped)), now),
+                )
+            db.commit()
+    except Exception as e:
+        logging.debug(f"[RENDER MEMO] lỗi ghi {url}: {e}")
+
+
+def log_stats():
+    logging.info(
+        f"[RENDER MEMO] render {stats['renders']}, tránh render {stats['renders_avoided']}, "
+        f"bỏ GET tĩnh {stats['static_skipped']}"
+    )
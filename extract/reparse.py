@@ -0,0 +1,160 @@
+"""Dựng lại CSV raw của một lần chạy từ HTML đã lưu trong html_store, không crawl lại.
+
+Dùng sau khi sửa parser: mỗi URL trong manifest của một lần chạy được parse lại
+(parse_static + finish_product offline) trên ProcessPoolExecutor, kết quả ghi ra
+data_output/reparse_<run_id>.csv qua RawWriter. Timestamp của dòng là lúc trang được
+tải trong lần chạy gốc (fetched_at trong manifest), không phải lúc reparse; tên file
+không khớp raw_laptop_*.csv nên bước "raw mới nhất" không nhận nhầm nó.
+
+Chạy: python -m extract.reparse [run_id] [--processes N]
+run_id mặc định là lần chạy mới nhất trong kho (xem --list).
+"""
+import argparse
+import csv
+import logging
+import os
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from extract.html_store import HtmlStore, HTML_STORE_DIR
+from extract.page_parser import parse_static, finish_product
+from extract.raw_writer import RawWriter, PART_SUFFIX
+
+OUT_DIR = "data_output"
+# Giống crawler.PARSE_PROCESSES: pool process chỉ bật khi đặt rõ (--processes / env)
+REPARSE_PROCESSES = int(os.environ.get("EXTRACT_PARSE_PROCESSES", "1"))
+REPARSE_CHUNKSIZE = 16
+
+
+def run_started_at(run_id):
+    """raw_laptop_20250101_093000 → "2025-01-01 09:30:00" (manifest cũ chưa có fetched_at)."""
+    try:
+        return datetime.strptime(run_id[-15:], "%Y%m%d_%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def reparse_path(run_id, out_dir=OUT_DIR):
+    return os.path.join(out_dir, f"reparse_{run_id}.csv")
+
+
+def _group_pages(entries, default_fetched_at=None):
+    """Gom manifest theo URL → (url, source, sha HTML chính, rendered, sha bản render fallback, fetched_at)."""
+    pages = {}
+    for e in entries:
+        p = pages.setdefault(e["url"], {"source": e["source"], "static": None, "render": None, "at": {}})
+        kind = "render" if e.get("rendered") else "static"
+        p[kind] = e["sha"]
+        p["at"][kind] = e.get("fetched_at") or default_fetched_at
+    out = []
+    for url, p in pages.items():
+        if p["static"]:
+            out.append((url, p["source"], p["static"], False, p["render"], p["at"]["static"]))
+        else:
+            # trang được render thẳng (render_memo bỏ GET tĩnh)
+            out.append((url, p["source"], p["render"], True, None, p["at"]["render"]))
+    return out
+
+
+def _raw_urls(run_id, out_dir=OUT_DIR):
+    """URL trong CSV raw gốc của lần chạy (hoặc .part nếu chưa xong); rỗng nếu không còn file."""
+    path = os.path.join(out_dir, f"{run_id}.csv")
+    if not os.path.exists(path) and os.path.exists(path + PART_SUFFIX):
+        path += PART_SUFFIX
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return {row["url"] for row in csv.DictReader(f) if row.get("url")}
+
+
+_worker_store = None
+
+
+def _reparse_page(root, page):
+    global _worker_store
+    if _worker_store is None or _worker_store.root != root:
+        _worker_store = HtmlStore(root)
+    url, source, sha, rendered, render_sha, fetched_at = page
+    try:
+        html = _worker_store.read_object(sha)
+    except OSError:
+        # object đã bị dọn khỏi kho (giữ N lần chạy gần nhất)
+        return url, None, False
+    state = parse_static(url, html, fetched_at)
+    try:
+        fallback = _worker_store.read_object(render_sha) if render_sha else None
+    except OSError:
+        fallback = None
+    return url, finish_product(url, source, state, rendered, offline=True, fallback_html=fallback), True
+
+
+def reparse_run(run_id=None, processes=REPARSE_PROCESSES, store_root=HTML_STORE_DIR, out_dir=OUT_DIR):
+    """Parse lại một lần chạy đã lưu, trả về đường dẫn reparse_<run_id>.csv (None nếu không có gì)."""
+    store = HtmlStore(store_root)
+    runs = store.runs()
+    if not runs:
+        logging.error(f"[REPARSE] Kho {store_root} chưa có lần chạy nào")
+        return None
+    run_id = run_id or runs[-1]
+    if run_id not in runs:
+        logging.error(f"[REPARSE] Không có lần chạy {run_id} trong {store_root}")
+        return None
+    pages = _group_pages(store.read_manifest(run_id), run_started_at(run_id))
+    logging.info(f"[REPARSE] {run_id}: {len(pages)} URL, {processes} process")
+    # URL có trong CSV raw gốc nhưng không có HTML trong manifest (vd. trang tải lỗi giữa chừng)
+    unstored = _raw_urls(run_id, out_dir) - {p[0] for p in pages}
+
+    writer = RawWriter(reparse_path(run_id, out_dir))
+    if writer.count or writer.done:
+        # .part của lần reparse trước bị ngắt: parse lại từ đầu cho chắc
+        writer.discard()
+        writer = RawWriter(reparse_path(run_id, out_dir))
+    if processes > 1:
+        pool = ProcessPoolExecutor(max_workers=processes)
+    else:
+        pool = ThreadPoolExecutor(max_workers=1)
+    with pool:
+        results = pool.map(_reparse_page, [store_root] * len(pages), pages, chunksize=REPARSE_CHUNKSIZE)
+        missing = 0
+        for url, item, stored in tqdm(results, total=len(pages), desc=f"Reparse {run_id}"):
+            if not stored:
+                missing += 1
+                continue
+            if item:
+                writer.add(item)
+            writer.mark_done(url)
+    if unstored or missing:
+        logging.warning(
+            f"[REPARSE] {run_id}: bỏ qua {len(unstored) + missing} URL không có HTML đã lưu "
+            f"({len(unstored)} không có trong manifest, {missing} object đã bị dọn)"
+        )
+    if writer.count == 0:
+        writer.discard()
+        logging.error(f"[REPARSE] {run_id}: không parse được sản phẩm nào")
+        return None
+    rows = writer.finalize()
+    logging.info(f"[REPARSE] {run_id}: {rows} sản phẩm → {writer.csv_path}")
+    return writer.csv_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse lại HTML đã lưu thành reparse_<run_id>.csv")
+    parser.add_argument("run_id", nargs="?", help="lần chạy cần parse lại (mặc định: mới nhất)")
+    parser.add_argument("--processes", type=int, default=REPARSE_PROCESSES)
+    parser.add_argument("--list", action="store_true", help="liệt kê các lần chạy còn trong kho")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.list:
+        for r in HtmlStore().runs():
+            print(r)
+        return
+    path = reparse_run(args.run_id, processes=args.processes)
+    if path:
+        print(path)
+    raise SystemExit(0 if path else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,132 @@
+import gzip
 import logging
-from bs4 import BeautifulSoup
-from extract.extract_utils import http_get
+import zlib
+import xml.etree.ElementTree as ET
+from datetime import datetime
+import requests
+from extract.extract_utils import http_stream
+from extract.matchers import compile_keywords
 
-def fetch_sitemap_urls(sitemap_url: str, limit: int = 1000) -> list:
-    """
-    Đọc sitemap → trả về danh sách URL sản phẩm hợp lệ.
+MAX_SITEMAP_DEPTH = 3
+# Lỗi giữa chừng khi đọc một sitemap: XML hỏng, mất kết nối giữa body (ChunkedEncodingError...),
+# .gz hỏng/cụt (BadGzipFile là OSError, zlib.error, EOFError) → bỏ phần còn lại của sitemap đó
+SITEMAP_READ_ERRORS = (ET.ParseError, requests.RequestException, OSError, EOFError, zlib.error)
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _parse_lastmod(text):
+    """W3C datetime (2024-05-01, 2024-05-01T10:00:00+07:00...) → datetime naive giờ local."""
+    if not text:
+        return None
+    try:
+        dt = datetime.fromisoformat(text.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt
+
+
+class _ChunkReader:
+    """File-like tối giản trên iter_content để iterparse/GzipFile đọc dần từng chunk."""
+
+    def __init__(self, chunks, head=b""):
+        self.chunks = chunks
+        self.buf = head
+
+    def read(self, n=-1):
+        while n < 0 or len(self.buf) < n:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buf += chunk
+        if n < 0:
+            n = len(self.buf)
+        out, self.buf = self.buf[:n], self.buf[n:]
+        return out
+
+
+def _open_stream(r):
+    """Bọc body response thành file-like; tự giải nén nếu là .xml.gz."""
+    chunks = r.iter_content(chunk_size=64 * 1024)
+    head = next(chunks, b"")
+    reader = _ChunkReader(chunks, head)
+    if head[:2] == b"\x1f\x8b":
+        return gzip.GzipFile(fileobj=reader)
+    return reader
+
+
+def iter_sitemap(sitemap_url, exclude_tokens=(), since=None, _depth=0):
+    """Đọc sitemap theo kiểu streaming, yield (loc, lastmod) từng URL.
+
+    - Parse tăng dần (iterparse) và xoá node đã xử lý → bộ nhớ không tăng theo kích thước sitemap.
+    - Theo sitemap index (<sitemapindex>) đệ quy tới MAX_SITEMAP_DEPTH, hỗ trợ .xml.gz.
+    - Bỏ URL chứa exclude_tokens (list hoặc KeywordMatcher) và URL/sitemap con có lastmod cũ hơn `since`.
+    - Một sitemap lỗi giữa chừng (SITEMAP_READ_ERRORS) chỉ được log: URL đã yield vẫn giữ,
+      các sitemap con đã thấy vẫn được đọc.
     """
-    urls = []
-    r = http_get(sitemap_url)
+    excluded = compile_keywords(exclude_tokens)
+    r = http_stream(sitemap_url)
     if not r:
         logging.error(f"[SITEMAP] Không tải được sitemap: {sitemap_url}")
-        return urls
+        return
 
+    children = []
     try:
-        soup = BeautifulSoup(r.text, "xml")
-        locs = [loc.get_text().strip() for loc in soup.find_all("loc")]
-        logging.info(f"[SITEMAP] Sitemap có {len(locs)} mục")
-
-        exclude_tokens = ["tin-tuc", "news", "khuyen-mai", "search", "tag"]
-
-        for u in locs:
-            lu = u.lower()
-            if any(ex in lu for ex in exclude_tokens):
+        root = None
+        for event, elem in ET.iterparse(_open_stream(r), events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
                 continue
-            urls.append(u.split("?")[0])
-            if len(urls) >= limit:
-                break
+            tag = _local(elem.tag)
+            if tag not in ("url", "sitemap"):
+                continue
+            loc, lastmod = None, None
+            for child in elem:
+                ctag = _local(child.tag)
+                if ctag == "loc":
+                    loc = (child.text or "").strip()
+                elif ctag == "lastmod":
+                    lastmod = _parse_lastmod(child.text)
+            root.clear()
+            if not loc:
+                continue
+            if since and lastmod and lastmod < since:
+                continue
+            if tag == "sitemap":
+                # sitemap con: đọc sau khi đóng stream hiện tại để không giữ nhiều kết nối
+                children.append(loc)
+                continue
+            if excluded.search(loc):
+                continue
+            yield loc, lastmod
+    except SITEMAP_READ_ERRORS as e:
+        logging.error(f"[SITEMAP] Đọc lỗi {sitemap_url}: {type(e).__name__}: {e}")
+    finally:
+        r.close()
 
-    except Exception as e:
-        logging.error(f"[SITEMAP] Parse lỗi: {e}")
+    if children:
+        if _depth >= MAX_SITEMAP_DEPTH:
+            logging.warning(f"[SITEMAP] Bỏ {len(children)} sitemap con (quá độ sâu {MAX_SITEMAP_DEPTH})")
+            return
+        logging.info(f"[SITEMAP] {sitemap_url} là sitemap index: {len(children)} sitemap con")
+        for child_url in children:
+            yield from iter_sitemap(child_url, excluded, since, _depth + 1)
 
+
+def fetch_sitemap_urls(sitemap_url: str, limit: int = 1000, since=None) -> list:
+    """
+    Đọc sitemap → trả về danh sách URL sản phẩm hợp lệ.
+    """
+    exclude_tokens = ["tin-tuc", "news", "khuyen-mai", "search", "tag"]
+    urls = []
+    for loc, _ in iter_sitemap(sitemap_url, exclude_tokens, since):
+        urls.append(loc.split("?")[0])
+        if len(urls) >= limit:
+            break
+    logging.info(f"[SITEMAP] Lấy {len(urls)} URL từ {sitemap_url}")
     return urls
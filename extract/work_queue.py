@@ -0,0 +1,477 @@
+"""Hàng đợi URL dùng chung để crawl bằng nhiều process / nhiều máy (lease + heartbeat).
+
+Bảng crawl_queue nằm trong DB control (MySQL, xem control/control_schema.sql); đặt
+EXTRACT_QUEUE_BACKEND=sqlite để dùng file SQLite EXTRACT_QUEUE_PATH thay thế khi
+test trên một máy.
+
+- Coordinator (run_extract role coordinator/both): discovery như harvest_site rồi
+  enqueue URL theo run_key (= tên file raw), sau đó gom item workers trả về vào
+  RawWriter cho tới khi hết URL.
+- Worker (role worker/both): lease từng lô EXTRACT_QUEUE_BATCH URL trong
+  EXTRACT_QUEUE_LEASE_SECONDS giây, tải + parse bằng parse_product_page, ghi kết quả
+  (item JSON) vào hàng đợi; thread heartbeat gia hạn lease trong lúc xử lý.
+- Lease hết hạn (worker chết) được đưa lại về pending, quá EXTRACT_QUEUE_MAX_ATTEMPTS
+  lần thì thành failed (dead letter phía coordinator).
+- Coordinator giữ một dòng trong crawl_queue_runs (heartbeat) suốt lần chạy, kể cả lúc
+  đang discovery; worker chỉ tính thời gian rảnh khi không còn run nào mở và không còn
+  URL pending/leased.
+- Lỗi DB tạm thời (deadlock 1213, mất kết nối, SQLite locked) → kết nối lại và thử lại
+  với backoff mũ thay vì làm chết worker/coordinator.
+Thời gian lease tính bằng epoch của máy ghi → các máy cần đồng bộ giờ (NTP).
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pymysql
+    # deadlock (1213), mất kết nối (2006/2013) → OperationalError; kết nối đã đóng → InterfaceError
+    DB_ERRORS = (sqlite3.OperationalError, pymysql.err.OperationalError, pymysql.err.InterfaceError)
+except ImportError:
+    DB_ERRORS = (sqlite3.OperationalError,)
+
+QUEUE_BACKEND = os.environ.get("EXTRACT_QUEUE_BACKEND", "mysql").lower()
+QUEUE_PATH = os.environ.get("EXTRACT_QUEUE_PATH", os.path.join(os.path.dirname(__file__), '..', 'logs', 'work_queue.db'))
+QUEUE_BATCH = int(os.environ.get("EXTRACT_QUEUE_BATCH", "50"))
+LEASE_SECONDS = float(os.environ.get("EXTRACT_QUEUE_LEASE_SECONDS", "300"))
+MAX_ATTEMPTS = int(os.environ.get("EXTRACT_QUEUE_MAX_ATTEMPTS", "3"))
+POLL_SECONDS = float(os.environ.get("EXTRACT_QUEUE_POLL_SECONDS", "2"))
+# Worker thoát sau ngần này giây rảnh khi không còn run nào mở / URL nào chưa xong (0 = chạy mãi)
+WORKER_IDLE_EXIT = float(os.environ.get("EXTRACT_WORKER_IDLE_EXIT", "60"))
+# Lỗi DB: số lần thử lại (coordinator, ghi kết quả) và backoff tối đa giữa hai lần
+DB_RETRIES = int(os.environ.get("EXTRACT_QUEUE_DB_RETRIES", "8"))
+DB_BACKOFF_MAX = float(os.environ.get("EXTRACT_QUEUE_DB_BACKOFF_MAX", "60"))
+# Coordinator bỏ cuộc nếu không có URL nào xong trong ngần này giây
+STALL_SECONDS = float(os.environ.get("EXTRACT_QUEUE_STALL_SECONDS", "900"))
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS crawl_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_key TEXT NOT NULL,
+    site TEXT NOT NULL,
+    url TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    item_json TEXT,
+    error TEXT,
+    collected INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL,
+    UNIQUE (run_key, url)
+);
+CREATE INDEX IF NOT EXISTS idx_crawl_queue_status ON crawl_queue (status, lease_expires);
+CREATE TABLE IF NOT EXISTS crawl_queue_runs (
+    run_key TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+'''
+
+
+class WorkQueue:
+    """crawl_queue trên MySQL (control) hoặc SQLite; an toàn khi dùng từ nhiều thread."""
+
+    def __init__(self, backend=QUEUE_BACKEND, path=QUEUE_PATH):
+        self.backend = backend
+        self.path = path
+        self.lock = threading.Lock()
+        if backend == "sqlite":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # isolation_level=None: tự quản lý transaction (BEGIN IMMEDIATE khi lease)
+            self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SQLITE_SCHEMA)
+        else:
+            from control.log_store import connect
+            self.conn = connect()
+
+    def reconnect(self):
+        """Sau lỗi DB: ping + kết nối lại MySQL (SQLite chỉ cần thử lại câu lệnh)."""
+        if self.backend == "sqlite":
+            return
+        with self.lock:
+            try:
+                self.conn.ping(reconnect=True)
+            except DB_ERRORS:
+                from control.log_store import connect
+                self.close()
+                self.conn = connect()
+
+    def _sql(self, sql):
+        return sql.replace("%s", "?") if self.backend == "sqlite" else sql
+
+    def _execute(self, sql, params=()):
+        if self.backend == "sqlite":
+            return self.conn.execute(self._sql(sql), params).rowcount
+        with self.conn.cursor() as cur:
+            return cur.execute(sql, params)
+
+    def _query(self, sql, params=()):
+        if self.backend == "sqlite":
+            return [dict(r) for r in self.conn.execute(self._sql(sql), params).fetchall()]
+        with self.conn.cursor() as cur:
+            cur.execute(sql, params)
+            return list(cur.fetchall())
+
+    def enqueue(self, run_key, site, urls):
+        """Thêm URL vào run_key (URL đã có thì bỏ qua); trả về số URL mới."""
+        now = time.time()
+        rows = [(run_key, site, u, now) for u in urls]
+        if not rows:
+            return 0
+        verb = "INSERT OR IGNORE" if self.backend == "sqlite" else "INSERT IGNORE"
+        sql = f"{verb} INTO crawl_queue (run_key, site, url, updated_at) VALUES (%s, %s, %s, %s)"
+        with self.lock:
+            if self.backend == "sqlite":
+                before = self.conn.total_changes
+                self.conn.executemany(self._sql(sql), rows)
+                return self.conn.total_changes - before
+            with self.conn.cursor() as cur:
+                return cur.executemany(sql, rows) or 0
+
+    def lease(self, owner, batch=QUEUE_BATCH, lease_seconds=LEASE_SECONDS):
+        """Giữ tối đa `batch` URL pending cho owner; trả về list dict (id, site, url)."""
+        now = time.time()
+        with self.lock:
+            if self.backend == "sqlite":
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self.conn.execute(
+                        "UPDATE crawl_queue SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                        "attempts = attempts + 1, updated_at = ? WHERE id IN "
+                        "(SELECT id FROM crawl_queue WHERE status = 'pending' ORDER BY id LIMIT ?)",
+                        (owner, now + lease_seconds, now, batch),
+                    )
+                    self.conn.execute("COMMIT")
+                except Exception:
+                    self.conn.execute("ROLLBACK")
+                    raise
+            else:
+                # UPDATE ... LIMIT một câu lệnh → hai worker không lease trùng URL
+                self._execute(
+                    "UPDATE crawl_queue SET status = 'leased', lease_owner = %s, lease_expires = %s, "
+                    "attempts = attempts + 1, updated_at = %s WHERE status = 'pending' ORDER BY id LIMIT %s",
+                    (owner, now + lease_seconds, now, batch),
+                )
+            return self._query(
+                "SELECT id, site, url FROM crawl_queue WHERE status = 'leased' AND lease_owner = %s "
+                "AND updated_at = %s ORDER BY id",
+                (owner, now),
+            )
+
+    def heartbeat(self, owner, lease_seconds=LEASE_SECONDS):
+        """Gia hạn mọi lease đang giữ của owner."""
+        with self.lock:
+            return self._execute(
+                "UPDATE crawl_queue SET lease_expires = %s WHERE status = 'leased' AND lease_owner = %s",
+                (time.time() + lease_seconds, owner),
+            )
+
+    def complete(self, owner, row_id, item):
+        with self.lock:
+            self._execute(
+                "UPDATE crawl_queue SET status = 'done', item_json = %s, lease_owner = NULL, updated_at = %s "
+                "WHERE id = %s AND lease_owner = %s",
+                (json.dumps(item, ensure_ascii=False) if item else None, time.time(), row_id, owner),
+            )
+
+    def fail(self, owner, row_id, reason):
+        with self.lock:
+            self._execute(
+                "UPDATE crawl_queue SET status = 'failed', error = %s, lease_owner = NULL, updated_at = %s "
+                "WHERE id = %s AND lease_owner = %s",
+                (reason, time.time(), row_id, owner),
+            )
+
+    def requeue_expired(self, max_attempts=MAX_ATTEMPTS):
+        """Trả lease quá hạn về pending (hoặc failed khi đã hết lượt); trả về số URL được trả lại."""
+        now = time.time()
+        with self.lock:
+            self._execute(
+                "UPDATE crawl_queue SET status = 'failed', error = 'lease expired', lease_owner = NULL, "
+                "updated_at = %s WHERE status = 'leased' AND lease_expires < %s AND attempts >= %s",
+                (now, now, max_attempts),
+            )
+            return self._execute(
+                "UPDATE crawl_queue SET status = 'pending', lease_owner = NULL, updated_at = %s "
+                "WHERE status = 'leased' AND lease_expires < %s",
+                (now, now),
+            )
+
+    def collect(self, run_key, limit=500):
+        """Lấy các URL đã xong (done/failed) chưa được coordinator gom và đánh dấu đã gom."""
+        with self.lock:
+            rows = self._query(
+                "SELECT id, site, url, status, item_json, error FROM crawl_queue "
+                "WHERE run_key = %s AND collected = 0 AND status IN ('done', 'failed') ORDER BY id LIMIT %s",
+                (run_key, limit),
+            )
+            if rows:
+                marks = ", ".join(["%s"] * len(rows))
+                self._execute(f"UPDATE crawl_queue SET collected = 1 WHERE id IN ({marks})",
+                              [r["id"] for r in rows])
+        return rows
+
+    def remaining(self, run_key):
+        """Số URL của run_key chưa xong (pending + leased)."""
+        with self.lock:
+            rows = self._query(
+                "SELECT COUNT(*) AS n FROM crawl_queue WHERE run_key = %s AND status IN ('pending', 'leased')",
+                (run_key,),
+            )
+        return int(rows[0]["n"]) if rows else 0
+
+    def busy(self, lease_seconds=LEASE_SECONDS):
+        """Còn việc có thể tới: URL pending/leased hoặc coordinator đang mở run (heartbeat còn mới)."""
+        with self.lock:
+            rows = self._query(
+                "SELECT (SELECT COUNT(*) FROM crawl_queue WHERE status IN ('pending', 'leased')) "
+                "+ (SELECT COUNT(*) FROM crawl_queue_runs WHERE heartbeat > %s) AS n",
+                (time.time() - lease_seconds,),
+            )
+        return bool(rows and int(rows[0]["n"]))
+
+    def touch_run(self, run_key):
+        """Coordinator báo run_key còn đang chạy (worker chờ thay vì thoát vì rảnh)."""
+        with self.lock:
+            self._execute("REPLACE INTO crawl_queue_runs (run_key, heartbeat) VALUES (%s, %s)",
+                          (run_key, time.time()))
+
+    def abandon(self, run_key):
+        """Các URL chưa xong của run_key (coordinator bỏ cuộc) → list dict (site, url)."""
+        with self.lock:
+            return self._query(
+                "SELECT site, url FROM crawl_queue WHERE run_key = %s AND status IN ('pending', 'leased')",
+                (run_key,),
+            )
+
+    def purge(self, run_key):
+        with self.lock:
+            self._execute("DELETE FROM crawl_queue_runs WHERE run_key = %s", (run_key,))
+            return self._execute("DELETE FROM crawl_queue WHERE run_key = %s", (run_key,))
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def _retry_db(queue, fn, *args, attempts=DB_RETRIES, stop=None):
+    """Gọi fn(*args); lỗi DB tạm thời → reconnect, chờ backoff mũ rồi thử lại.
+
+    attempts=0: thử mãi. Hết lượt thì raise lỗi cuối; `stop` được set trong lúc chờ → None.
+    """
+    delay, tries = 1.0, 0
+    while True:
+        try:
+            return fn(*args)
+        except DB_ERRORS as e:
+            tries += 1
+            if attempts and tries >= attempts:
+                raise
+            logging.warning(f"[QUEUE] Lỗi DB ở {fn.__name__} ({e}), thử lại sau {delay:.0f}s")
+        if stop is not None and stop.wait(delay):
+            return None
+        if stop is None:
+            time.sleep(delay)
+        delay = min(delay * 2, DB_BACKOFF_MAX)
+        try:
+            queue.reconnect()
+        except DB_ERRORS as e:
+            logging.warning(f"[QUEUE] Kết nối lại DB lỗi: {e}")
+
+
+class _Heartbeat:
+    """Thread gọi beat() mỗi LEASE_SECONDS / 3 giây trong khối with (gia hạn lease / giữ run mở)."""
+
+    def __init__(self, queue, beat):
+        self.queue = queue
+        self.beat = beat
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="queue-heartbeat", daemon=True)
+
+    def _run(self):
+        while not self.stop.wait(LEASE_SECONDS / 3):
+            try:
+                self.beat()
+            except DB_ERRORS as e:
+                logging.warning(f"[QUEUE] Heartbeat lỗi: {e}")
+                try:
+                    self.queue.reconnect()
+                except DB_ERRORS:
+                    pass
+            except Exception as e:
+                logging.warning(f"[QUEUE] Heartbeat lỗi: {e}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+
+
+def run_worker(queue=None, stop=None, idle_exit=WORKER_IDLE_EXIT):
+    """Lease → tải + parse → ghi kết quả, lặp tới khi `stop` được set hoặc rảnh quá idle_exit giây.
+
+    Chỉ tính là rảnh khi queue.busy() = False (không run nào mở, không URL nào chưa xong).
+    Lỗi DB được thử lại mãi (backoff tới DB_BACKOFF_MAX). Trả về số URL đã xử lý.
+    """
+    from extract.crawler import MAX_WORKERS, configure_rate_limits, _fetch_and_parse
+    from extract.extract_utils import configure_session, pop_failure
+
+    own_queue = queue is None
+    queue = queue or WorkQueue()
+    stop = stop or threading.Event()
+    owner = worker_id()
+    configure_rate_limits()
+    configure_session(pool_size=MAX_WORKERS)
+    processed, idle_since = 0, time.monotonic()
+    logging.info(f"[QUEUE] Worker {owner} bắt đầu ({queue.backend})")
+
+    def report(fn, *args):
+        try:
+            _retry_db(queue, fn, owner, *args, stop=stop)
+        except DB_ERRORS as e:
+            # lease sẽ hết hạn → URL về lại pending và được crawl lại
+            logging.error(f"[QUEUE] Không ghi được kết quả URL #{args[0]}: {e}")
+
+    def one(row):
+        try:
+            fetched, item = _fetch_and_parse(row["url"], row["site"])
+        except Exception as e:
+            report(queue.fail, row["id"], f"parse error: {e}")
+            return
+        if not fetched:
+            # không tải được HTML (hết retry, 403/404...) → failed, coordinator không checkpoint
+            report(queue.fail, row["id"], pop_failure(row["url"]) or "fetch failed")
+        else:
+            report(queue.complete, row["id"], item)
+
+    try:
+        with _Heartbeat(queue, lambda: queue.heartbeat(owner)), \
+                ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+            while not stop.is_set():
+                _retry_db(queue, queue.requeue_expired, attempts=0, stop=stop)
+                rows = _retry_db(queue, queue.lease, owner, attempts=0, stop=stop)
+                if not rows:
+                    if _retry_db(queue, queue.busy, attempts=0, stop=stop):
+                        # coordinator còn discovery / URL đang ở worker khác: chưa tính là rảnh
+                        idle_since = time.monotonic()
+                    elif idle_exit and time.monotonic() - idle_since > idle_exit:
+                        break
+                    stop.wait(POLL_SECONDS)
+                    continue
+                list(ex.map(one, rows))
+                processed += len(rows)
+                idle_since = time.monotonic()
+                logging.info(f"[QUEUE] Worker {owner}: xong {processed} URL")
+    finally:
+        if own_queue:
+            queue.close()
+    logging.info(f"[QUEUE] Worker {owner} dừng sau {processed} URL")
+    return processed
+
+
+def coordinate(run_key, site_keys, on_item=None, on_done=None, skip_urls=None, on_failed=None,
+               local_worker=False, queue=None):
+    """Enqueue URL của các site rồi gom kết quả workers cho tới khi hết URL.
+
+    Callback giống harvest_site. local_worker=True (role both): chạy thêm một worker
+    trong process này; worker đó chết thì coordinator raise luôn thay vì chờ STALL_SECONDS.
+    Lỗi DB được thử lại DB_RETRIES lần. Trả về số URL đã gom.
+    """
+    from extract import frontier
+    from extract.crawler import plan_site_urls
+
+    own_queue = queue is None
+    queue = queue or WorkQueue()
+    stop = threading.Event()
+    worker, worker_error = None, []
+
+    def local():
+        own = None
+        try:
+            # cùng backend / file với queue của coordinator nhưng kết nối riêng
+            own = WorkQueue(queue.backend, queue.path)
+            run_worker(own, stop=stop, idle_exit=0)
+        except Exception as e:
+            logging.exception(f"[QUEUE] Worker cục bộ dừng vì lỗi: {e}")
+            worker_error.append(e)
+        finally:
+            if own is not None:
+                own.close()
+
+    # Mở run trước discovery để workers không thoát vì rảnh trong lúc chờ enqueue
+    _retry_db(queue, queue.touch_run, run_key)
+    try:
+        with _Heartbeat(queue, lambda: queue.touch_run(run_key)):
+            for site in site_keys:
+                urls = plan_site_urls(site, skip_urls)
+                added = _retry_db(queue, queue.enqueue, run_key, site, urls)
+                logging.info(f"[QUEUE] {site}: enqueue {added}/{len(urls)} URL vào {run_key}")
+
+            if local_worker:
+                # Worker riêng một kết nối: kết nối của coordinator bận polling
+                worker = threading.Thread(target=local, name="queue-worker", daemon=True)
+                worker.start()
+
+            collected, last_progress, last_log = 0, time.monotonic(), 0.0
+            while True:
+                if worker_error:
+                    raise RuntimeError(f"worker cục bộ của {run_key} đã dừng") from worker_error[0]
+                _retry_db(queue, queue.requeue_expired)
+                rows = _retry_db(queue, queue.collect, run_key)
+                for r in rows:
+                    if r["status"] == "failed":
+                        if on_failed:
+                            on_failed(r["url"], r["site"], r["error"] or "failed")
+                        continue
+                    item = json.loads(r["item_json"]) if r["item_json"] else None
+                    # done = worker đã tải được trang (lỗi tải là failed, xem run_worker)
+                    if frontier.FRONTIER_ENABLED:
+                        frontier.record_fetch(r["url"], item)
+                    if item and on_item:
+                        on_item(item)
+                    if on_done:
+                        on_done(r["url"])
+                collected += len(rows)
+                now = time.monotonic()
+                if rows:
+                    last_progress = now
+                    continue
+                left = _retry_db(queue, queue.remaining, run_key)
+                if left == 0:
+                    break
+                if STALL_SECONDS and now - last_progress > STALL_SECONDS:
+                    logging.error(f"[QUEUE] {run_key}: {STALL_SECONDS:.0f}s không có URL nào xong, bỏ {left} URL còn lại")
+                    for r in _retry_db(queue, queue.abandon, run_key):
+                        if on_failed:
+                            on_failed(r["url"], r["site"], "queue stalled")
+                    break
+                if now - last_log > 15:
+                    logging.info(f"[QUEUE] {run_key}: đã gom {collected}, còn {left} URL")
+                    last_log = now
+                time.sleep(POLL_SECONDS)
+    finally:
+        stop.set()
+        if worker is not None:
+            worker.join()
+    _retry_db(queue, queue.purge, run_key)
+    if own_queue:
+        queue.close()
+    logging.info(f"[QUEUE] {run_key}: gom xong {collected} URL")
+    return collected
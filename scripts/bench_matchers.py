@@ -0,0 +1,69 @@
+"""Micro-benchmark so khớp từ khoá: vòng any(... in ...) cũ vs KeywordMatcher.
+
+Dữ liệu: toàn bộ href trong các file tgdd_laptop*.html (so khớp link danh mục,
+loại loc sitemap) và text của thẻ <a> (dò brand trong tên sản phẩm).
+
+Chạy: python scripts/bench_matchers.py [số vòng]
+"""
+import glob
+import os
+import sys
+import time
+
+proj_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if proj_root not in sys.path:
+    sys.path.insert(0, proj_root)
+
+from lxml import etree
+
+from extract.crawler import LINK_KEYWORDS, SITEMAP_EXCLUDE
+from extract.page_parser import BRAND_WHITELIST, BRAND_MATCHER
+
+rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+files = sorted(glob.glob(os.path.join(proj_root, 'tgdd_laptop*.html')))
+if not files:
+    print('Không tìm thấy tgdd_laptop*.html')
+    raise SystemExit(1)
+
+hrefs, names = [], []
+for f in files:
+    root = etree.parse(f, etree.HTMLParser(encoding='utf-8')).getroot()
+    for a in root.iter('a'):
+        if a.get('href'):
+            hrefs.append(a.get('href'))
+        text = ''.join(a.itertext()).strip()
+        if text:
+            names.append(text)
+print(f'{len(hrefs)} href, {len(names)} tên, {rounds} vòng')
+
+link_kw = ["laptop", "macbook", "product", "collection"]
+exclude = list(SITEMAP_EXCLUDE.keywords)
+
+
+def old_brand(name):
+    for b in BRAND_WHITELIST:
+        if b.lower() in name.lower():
+            return b.upper()
+    return None
+
+
+def bench(name, fn, data):
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for x in data:
+            fn(x)
+    dt = time.perf_counter() - t0
+    n = len(data) * rounds
+    print(f'{name:<24} {n / dt / 1e6:8.2f} M/s  ({dt:.2f}s)')
+    return dt
+
+
+for label, old, new, data in [
+    ('link keywords', lambda u: any(k in u.lower() for k in link_kw), LINK_KEYWORDS.search, hrefs),
+    ('sitemap exclude', lambda u: any(ex in u.lower() for ex in exclude), SITEMAP_EXCLUDE.search, hrefs),
+    ('brand', old_brand, BRAND_MATCHER.first, names),
+]:
+    assert all(bool(old(x)) == bool(new(x)) for x in data), label
+    t_old = bench(f'{label} (cũ)', old, data)
+    t_new = bench(f'{label} (matcher)', new, data)
+    print(f'  → nhanh hơn {t_old / t_new:.1f}x')
@@ -0,0 +1,48 @@
+"""Micro-benchmark parser trang sản phẩm trên các file tgdd_laptop*.html trong repo.
+
+So sánh số trang/giây của:
+  - facts_soup     : BeautifulSoup(lxml) đầy đủ + find/select (cách cũ)
+  - facts_fast     : một lượt duyệt cây lxml (fast path)
+  - parse_product_html : toàn bộ parse (fast path + fallback), không render
+
+Chạy: python scripts/bench_page_parser.py [số vòng]
+"""
+import glob
+import os
+import sys
+import time
+
+proj_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if proj_root not in sys.path:
+    sys.path.insert(0, proj_root)
+
+import extract.page_parser as pp
+
+pp.PAGE_USE_RENDERER = False
+pp.render_memo.record = lambda *a, **k: None  # không ghi logs/render_memo.db khi benchmark
+
+rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+files = sorted(glob.glob(os.path.join(proj_root, 'tgdd_laptop*.html')))
+if not files:
+    print('Không tìm thấy tgdd_laptop*.html')
+    raise SystemExit(1)
+pages = [open(f, encoding='utf-8', errors='replace').read() for f in files]
+total_mb = sum(len(p) for p in pages) * rounds / 1024 / 1024
+print(f'{len(pages)} file x {rounds} vòng ({total_mb:.1f}MB HTML)')
+
+
+def bench(name, fn):
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for html in pages:
+            fn(html)
+    dt = time.perf_counter() - t0
+    n = len(pages) * rounds
+    print(f'{name:<20} {n / dt:8.2f} trang/s  ({dt:.2f}s)')
+    return n / dt
+
+
+slow = bench('facts_soup', pp.facts_soup)
+fast = bench('facts_fast', pp.facts_fast)
+bench('parse_product_html', lambda h: pp.parse_product_html('https://www.thegioididong.com/laptop/bench', 'thegioididong', h))
+print(f'fast path nhanh hơn {fast / slow:.1f}x')
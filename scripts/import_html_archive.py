@@ -0,0 +1,34 @@
+"""Nạp các trang HTML đã lưu (vd tgdd_laptop*.html) vào http_archive để replay.
+
+Chạy: python scripts/import_html_archive.py [--render] <url> <file.html> [<url> <file.html> ...]
+
+--render: lưu như HTML đã render bằng Playwright (render_html dùng khi replay),
+mặc định lưu như response 200 của http_get. Sau đó chạy extract với
+EXTRACT_HTTP_MODE=replay (cùng EXTRACT_HTTP_ARCHIVE nếu đổi đường dẫn).
+"""
+import os
+import sys
+
+proj_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if proj_root not in sys.path:
+    sys.path.insert(0, proj_root)
+
+from extract.http_archive import HttpArchive, ARCHIVE_PATH
+
+args = sys.argv[1:]
+kind = "http"
+if args and args[0] == "--render":
+    kind = "render"
+    args = args[1:]
+if not args or len(args) % 2:
+    print(__doc__)
+    raise SystemExit(1)
+
+archive = HttpArchive(ARCHIVE_PATH)
+for url, path in zip(args[::2], args[1::2]):
+    with open(path, 'rb') as f:
+        body = f.read()
+    archive.record(kind, url, 200, {"Content-Type": "text/html; charset=utf-8"}, body, "utf-8")
+    print(f'{kind}: {url} ← {path} ({len(body) / 1024:.0f}KB)')
+archive.close()
+print(f'Đã ghi {len(args) // 2} trang vào {ARCHIVE_PATH}')
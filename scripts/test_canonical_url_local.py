@@ -0,0 +1,40 @@
+import os
+import sys
+
+# ensure project root in path
+proj_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if proj_root not in sys.path:
+    sys.path.insert(0, proj_root)
+
+from extract.extract_utils import canonical_url
+
+
+def test_same_page_variants_collapse():
+    base = canonical_url('https://example.com/laptop?page=2&sort=price')
+    for variant in [
+        'https://EXAMPLE.com/laptop?page=2&sort=price',
+        'https://example.com:443/laptop?page=2&sort=price',
+        'https://example.com/laptop/?page=2&sort=price',
+        'https://example.com/laptop?sort=price&page=2',
+        'https://example.com/laptop?page=2&sort=price#reviews',
+        '  https://example.com/laptop?page=2&sort=price  ',
+    ]:
+        assert canonical_url(variant) == base, variant
+
+
+def test_different_pages_stay_distinct():
+    assert canonical_url('https://example.com/laptop?page=2') != canonical_url('https://example.com/laptop?page=3')
+    assert canonical_url('http://example.com/laptop') != canonical_url('https://example.com/laptop')
+    assert canonical_url('https://example.com:8443/laptop') == 'https://example.com:8443/laptop'
+
+
+def test_root_and_blank_query_values_kept():
+    assert canonical_url('https://example.com') == 'https://example.com/'
+    assert canonical_url('https://example.com/?a=&b=1') == 'https://example.com/?a=&b=1'
+
+
+if __name__ == '__main__':
+    for name, fn in list(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print(f'{name}: OK')
@@ -0,0 +1,76 @@
+import os
+import sys
+import threading
+import time
+
+# ensure project root in path
+proj_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if proj_root not in sys.path:
+    sys.path.insert(0, proj_root)
+
+from extract import concurrency
+from extract.concurrency import AimdLimiter
+
+
+def _fill_window(limiter, latency, error=False):
+    for _ in range(concurrency.WINDOW):
+        limiter.acquire()
+        limiter.release(latency, error)
+
+
+def test_additive_increase_when_fast_and_clean():
+    lim = AimdLimiter('example.com', initial=4, max_limit=6)
+    _fill_window(lim, 0.1)
+    assert lim.limit == 5
+    _fill_window(lim, 0.1)
+    _fill_window(lim, 0.1)
+    assert lim.limit == 6  # không vượt max_limit
+
+
+def test_slow_window_backs_off_gently():
+    lim = AimdLimiter('example.com', initial=10)
+    _fill_window(lim, concurrency.TARGET_P95 * 2)
+    assert lim.limit == 9
+
+
+def test_error_halves_once_per_cooldown():
+    lim = AimdLimiter('example.com', initial=16)
+    lim.acquire()
+    lim.release(0.1, error=True)
+    assert lim.limit == 8
+    # loạt lỗi ngay sau đó không đẩy limit xuống đáy
+    for _ in range(5):
+        lim.acquire()
+        lim.release(0.1, error=True)
+    assert lim.limit == 8
+    lim.last_decrease = time.monotonic() - concurrency.DECREASE_COOLDOWN
+    lim.acquire()
+    lim.release(0.1, error=True)
+    assert lim.limit == 4
+    assert lim.snapshot()['errors'] == 7
+
+
+def test_limit_never_below_min():
+    lim = AimdLimiter('example.com', initial=1, min_limit=1)
+    lim.acquire()
+    lim.release(0.1, error=True)
+    assert lim.limit == 1
+
+
+def test_acquire_blocks_at_limit():
+    lim = AimdLimiter('example.com', initial=1)
+    lim.acquire()
+    got = threading.Event()
+    t = threading.Thread(target=lambda: (lim.acquire(), got.set()), daemon=True)
+    t.start()
+    assert not got.wait(0.2)
+    lim.release(0.1)
+    assert got.wait(2)
+    assert lim.inflight == 1
+
+
+if __name__ == '__main__':
+    for name, fn in list(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print(f'{name}: OK')
@@ -10,10 +10,12 @@ if proj_root not in sys.path:
 # monkeypatch harvest_site to avoid real crawling
 from extract import crawler
 
-def fake_harvest_site(site):
+def fake_harvest_site(site, on_item=None, on_done=None, skip_urls=None, on_failed=None):
+    """Cùng chữ ký với crawler.harvest_site: item đi qua on_item (RawWriter.add) và
+    on_done (checkpoint), URL trong skip_urls (resume) bị bỏ qua."""
     print(f"fake_harvest_site called for site={site}")
     now = time.strftime('%Y-%m-%d %H:%M:%S')
-    return [
+    items = [
         {
             'url': f'https://example.com/{site}/1',
             'brand': 'TestBrand',
@@ -35,6 +37,14 @@ def fake_harvest_site(site):
             'sold_count': '5'
         },
     ]
+    items = [it for it in items if not (skip_urls and it['url'] in skip_urls)]
+    if on_item is None:
+        return items
+    for it in items:
+        on_item(it)
+        if on_done:
+            on_done(it['url'])
+    return []
 
 # Apply monkeypatch
 import extract.extract_service as es
@@ -54,6 +64,17 @@ if not csv_raw:
     print('extract failed')
     sys.exit(1)
 
+# CSV raw được ghi dần qua RawWriter: đủ 2 dòng mỗi site, không còn file .part / .done
+import pandas as pd
+from extract.raw_writer import PART_SUFFIX, DONE_SUFFIX
+from extract.crawler import SITES
+df_raw = pd.read_csv(csv_raw)
+only_site = os.environ.get('EXTRACT_ONLY_SITE')
+sites = [only_site] if only_site in SITES else list(SITES)
+assert sorted(df_raw['url']) == sorted(f'https://example.com/{s}/{n}' for s in sites for n in (1, 2)), df_raw['url'].tolist()
+assert not os.path.exists(csv_raw + PART_SUFFIX) and not os.path.exists(csv_raw + DONE_SUFFIX)
+print('raw rows:', len(df_raw))
+
 df_clean = run_transform(csv_raw)
 print('clean rows:', len(df_clean) if df_clean is not None else None)
 rows = run_load(df_clean)
@@ -0,0 +1,48 @@
+import os
+import sys
+
+# ensure project root in path
+proj_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if proj_root not in sys.path:
+    sys.path.insert(0, proj_root)
+
+from extract.matchers import KeywordMatcher, compile_keywords
+
+
+def test_search_is_case_insensitive_substring():
+    m = KeywordMatcher(['Laptop', 'macbook'])
+    assert m.search('Dell LAPTOP Inspiron')
+    assert m.search('apple-MacBook-air-m2')
+    assert not m.search('Điện thoại iPhone')
+    assert not m.search('')
+    assert not m.search(None)
+
+
+def test_first_prefers_earliest_then_longest():
+    m = KeywordMatcher(['apple', 'macbook', 'macbook pro'])
+    assert m.first('Apple MacBook Air') == 'apple'
+    assert m.first('MacBook Pro 14') == 'macbook pro'
+    assert m.first('Laptop Dell') is None
+    # không phụ thuộc thứ tự khai báo
+    assert KeywordMatcher(['macbook pro', 'macbook', 'apple']).first('MacBook Pro 14') == 'macbook pro'
+
+
+def test_regex_characters_are_literal():
+    m = KeywordMatcher(['c++', 'a.b'])
+    assert m.search('sách C++ cơ bản')
+    assert not m.search('axb')
+
+
+def test_empty_matcher_and_compile_cache():
+    assert not KeywordMatcher([]).search('anything')
+    assert KeywordMatcher(['', None]).first('anything') is None
+    m = compile_keywords(['news', 'tag'])
+    assert compile_keywords(['news', 'tag']) is m
+    assert compile_keywords(m) is m
+
+
+if __name__ == '__main__':
+    for name, fn in list(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print(f'{name}: OK')
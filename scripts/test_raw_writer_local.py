@@ -0,0 +1,109 @@
+import csv
+import os
+import sys
+import tempfile
+import time
+
+# ensure project root in path
+proj_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if proj_root not in sys.path:
+    sys.path.insert(0, proj_root)
+
+from extract.raw_writer import (RawWriter, find_in_progress, find_dead_letters, load_dead_letters,
+                                reopen_raw, PART_SUFFIX, DONE_SUFFIX, DEAD_SUFFIX)
+
+
+def _item(n, source='tgdd'):
+    return {
+        'url': f'https://example.com/p{n}',
+        'brand': 'TestBrand',
+        'product_name': f'Test Product {n}',
+        'price': 100 * n,
+        'currency': 'VND',
+        'source': source,
+        'timestamp': '2025-01-01 09:30:00',
+        'sold_count': n,
+    }
+
+
+def _rows(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def test_resume_skips_done_and_truncates_partial_line():
+    with tempfile.TemporaryDirectory() as out_dir:
+        path = os.path.join(out_dir, 'raw_laptop_20250101_093000.csv')
+        w = RawWriter(path)
+        for n in (1, 2):
+            w.add(_item(n))
+            w.mark_done(_item(n)['url'])
+        w.mark_done('https://example.com/filtered')  # bị lọc: không có dòng nhưng đã xong
+        w.close()
+        # crash giữa lúc ghi: dòng cuối dở dang
+        with open(path + PART_SUFFIX, 'a', encoding='utf-8') as f:
+            f.write('Brand,half a row')
+
+        assert find_in_progress(out_dir) == path
+        w = RawWriter(path)
+        assert w.count == 2
+        assert w.done >= {_item(1)['url'], _item(2)['url'], 'https://example.com/filtered'}
+        w.add(_item(1))  # trùng URL → bỏ qua
+        w.add(_item(3))
+        w.mark_done(_item(3)['url'])
+        assert w.finalize() == 3
+
+        assert [r['url'] for r in _rows(path)] == [_item(n)['url'] for n in (1, 2, 3)]
+        assert not os.path.exists(path + PART_SUFFIX)
+        assert not os.path.exists(path + DONE_SUFFIX)
+        assert find_in_progress(out_dir) is None
+
+
+def test_dead_letters_written_unless_recovered():
+    with tempfile.TemporaryDirectory() as out_dir:
+        path = os.path.join(out_dir, 'raw_laptop_20250101_093000.csv')
+        w = RawWriter(path)
+        w.add(_item(1))
+        w.mark_done(_item(1)['url'])
+        w.mark_failed('https://example.com/dead1', 'tgdd', 'HTTP 500')
+        w.mark_failed('https://example.com/dead2', 'fpt', 'ReadTimeout')
+        w.mark_failed('https://example.com/later', 'tgdd', 'HTTP 503')
+        w.mark_done('https://example.com/later')  # lần thử sau lấy được
+        w.mark_failed(_item(1)['url'], 'tgdd', 'HTTP 500')  # đã xong → không thành dead letter
+        w.finalize()
+
+        assert find_dead_letters(out_dir) == path + DEAD_SUFFIX
+        assert load_dead_letters(path + DEAD_SUFFIX) == {
+            'tgdd': ['https://example.com/dead1'],
+            'fpt': ['https://example.com/dead2'],
+        }
+
+
+def test_reopen_raw_appends_to_original_and_keeps_mtime():
+    with tempfile.TemporaryDirectory() as out_dir:
+        path = os.path.join(out_dir, 'raw_laptop_20250101_093000.csv')
+        w = RawWriter(path)
+        w.add(_item(1))
+        w.mark_failed(_item(2)['url'], 'tgdd', 'HTTP 500')
+        w.finalize()
+        old = time.time() - 3600
+        os.utime(path, (old, old))
+
+        w = reopen_raw(path)
+        assert _item(1)['url'] in w.done
+        w.add(_item(1))
+        w.add(_item(2))
+        w.mark_done(_item(2)['url'])
+        assert w.finalize() == 2
+
+        assert [r['url'] for r in _rows(path)] == [_item(1)['url'], _item(2)['url']]
+        assert abs(os.path.getmtime(path) - old) < 1
+        assert not os.path.exists(path + DEAD_SUFFIX)
+        assert os.listdir(out_dir) == [os.path.basename(path)]
+
+
+if __name__ == '__main__':
+    for name, fn in list(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print(f'{name}: OK')
@@ -0,0 +1,133 @@
+import os
+import sys
+import tempfile
+from datetime import date
+
+import pandas as pd
+
+# ensure project root in path
+proj_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if proj_root not in sys.path:
+    sys.path.insert(0, proj_root)
+
+from staging import staging_loader
+from staging.staging_loader import STAGING_COLUMNS
+
+RAW_CSV = (
+    'brand,product_name,price,currency,source,url,timestamp,sold_count\n'
+    'Dell,"Dell XPS 13, 16GB",25990000.7,VND,tgdd,https://example.com/1,2025-01-01 09:30:00,12\n'
+    ',Asus Vivobook,liên hệ,VND,fpt,https://example.com/2,2025-01-01 09:31:00,\n'
+    'HP,"HP ""Envy"" C:\\Tools",,VND,,https://example.com/3,,3.9\n'
+)
+
+
+class FakeCursor:
+    def __init__(self, results=()):
+        self.calls = []
+        self.rowcount = 0
+        self.results = list(results)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        self.calls.append((sql, params))
+
+    def executemany(self, sql, rows):
+        self.calls.append((sql, list(rows)))
+
+    def fetchall(self):
+        return self.results.pop(0) if self.results else []
+
+
+class FakeConn:
+    def __init__(self, cur):
+        self.cur = cur
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        pass
+
+
+def _frame():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'raw.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(RAW_CSV)
+        return pd.read_csv(path)
+
+
+def test_coerce_numbers_truncate_and_blanks_become_none():
+    df = staging_loader._coerce(_frame())
+    assert list(df.columns) == STAGING_COLUMNS
+    assert df['price'].tolist() == [25990000, 0, 0]  # cắt phần thập phân, chữ / rỗng → 0
+    assert df['sold_count'].tolist() == [12, 0, 3]
+    assert df.loc[1, 'brand'] is None
+    assert df.loc[2, 'source'] is None and df.loc[2, 'timestamp'] is None
+    assert df.loc[2, 'product_name'] == 'HP "Envy" C:\\Tools'
+
+
+def test_insert_batches_splits_and_tags_batch():
+    cur = FakeCursor()
+    df = staging_loader._coerce(pd.concat([_frame()] * 3, ignore_index=True))
+    batch = (42, date(2025, 1, 1))
+    assert staging_loader._insert_batches(cur, df, batch_size=4, batch=batch) == 9
+    assert [len(rows) for _, rows in cur.calls] == [4, 4, 1]
+    first = cur.calls[0][1][0]
+    assert len(first) == len(STAGING_COLUMNS) + 2 and first[-2:] == batch
+
+
+def test_infile_sql_matches_coerce_rules():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'raw.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(RAW_CSV.replace('\n', '\r\n'))
+        cur = FakeCursor()
+        staging_loader._load_infile(cur, path, batch=(42, date(2025, 1, 1)))
+    sql, params = cur.calls[0]
+    assert params == (os.path.abspath(path), 42, date(2025, 1, 1))
+    assert "LINES TERMINATED BY '\\r\\n'" in sql
+    assert "ESCAPED BY ''" in sql
+    assert 'TRUNCATE(@price, 0)' in sql and 'TRUNCATE(@sold_count, 0)' in sql
+    assert 'ROUND(' not in sql
+
+
+def test_legacy_table_loads_without_batch_columns():
+    cur = FakeCursor()
+    staging_loader._insert_batches(cur, staging_loader._coerce(_frame()), batch_size=10)
+    sql, rows = cur.calls[0]
+    assert 'batch_id' not in sql and len(rows[0]) == len(STAGING_COLUMNS)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'raw.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(RAW_CSV)
+        cur = FakeCursor()
+        staging_loader._load_infile(cur, path)
+    sql, params = cur.calls[0]
+    assert 'batch_id' not in sql and params == (os.path.abspath(path),)
+
+
+def test_ensure_table_migrates_only_in_append_mode():
+    # bảng cũ: SHOW COLUMNS ... 'batch_id' không trả về dòng nào
+    cur = FakeCursor()
+    assert staging_loader.ensure_staging_table(FakeConn(cur)) is False
+    assert len(cur.calls) == 2 and 'PARTITION BY' not in cur.calls[0][0]
+    cur = FakeCursor()
+    assert staging_loader.ensure_staging_table(FakeConn(cur), append=True) is True
+    assert 'PARTITION BY' in cur.calls[0][0]
+    assert any('ALTER TABLE' in sql for sql, _ in cur.calls)
+    cur = FakeCursor(results=[[{'Field': 'batch_id'}]])
+    assert staging_loader.ensure_staging_table(FakeConn(cur)) is True
+    assert not any('ALTER TABLE' in sql for sql, _ in cur.calls)
+
+
+if __name__ == '__main__':
+    for name, fn in list(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print(f'{name}: OK')
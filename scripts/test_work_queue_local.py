@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# ensure project root in path
+proj_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if proj_root not in sys.path:
+    sys.path.insert(0, proj_root)
+
+from extract import work_queue
+from extract.work_queue import WorkQueue
+
+RUN = 'raw_laptop_20250101_093000'
+
+
+def _queue(tmp):
+    return WorkQueue(backend='sqlite', path=os.path.join(tmp, 'work_queue.db'))
+
+
+def test_enqueue_is_idempotent_and_leases_do_not_overlap():
+    with tempfile.TemporaryDirectory() as tmp:
+        q = _queue(tmp)
+        urls = [f'https://example.com/p{n}' for n in range(5)]
+        assert q.enqueue(RUN, 'tgdd', urls) == 5
+        assert q.enqueue(RUN, 'tgdd', urls[:2] + ['https://example.com/p9']) == 1
+
+        a = q.lease('worker-a', batch=4)
+        b = q.lease('worker-b', batch=4)
+        assert len(a) == 4 and len(b) == 2
+        assert not {r['url'] for r in a} & {r['url'] for r in b}
+        assert q.lease('worker-c') == []
+        assert q.remaining(RUN) == 6
+        q.close()
+
+
+def test_complete_fail_collect_and_purge():
+    with tempfile.TemporaryDirectory() as tmp:
+        q = _queue(tmp)
+        q.enqueue(RUN, 'tgdd', ['https://example.com/ok', 'https://example.com/bad'])
+        ok, bad = q.lease('w')
+        q.complete('w', ok['id'], {'url': ok['url'], 'price': 100})
+        q.fail('w', bad['id'], 'HTTP 404')
+        q.complete('someone-else', bad['id'], {'url': bad['url']})  # không giữ lease → bỏ qua
+
+        rows = {r['url']: r for r in q.collect(RUN)}
+        assert rows[ok['url']]['status'] == 'done' and '"price": 100' in rows[ok['url']]['item_json']
+        assert rows[bad['url']]['status'] == 'failed' and rows[bad['url']]['error'] == 'HTTP 404'
+        assert q.collect(RUN) == []  # đã gom thì không trả lại
+        assert q.remaining(RUN) == 0
+        assert q.purge(RUN) == 2
+        q.close()
+
+
+def test_expired_lease_is_requeued_then_failed_after_max_attempts():
+    with tempfile.TemporaryDirectory() as tmp:
+        q = _queue(tmp)
+        q.enqueue(RUN, 'tgdd', ['https://example.com/p1'])
+        for attempt in range(1, 3):
+            assert len(q.lease('dead-worker', lease_seconds=-1)) == 1
+            assert q.requeue_expired(max_attempts=3) == 1
+        q.lease('live-worker', lease_seconds=60)
+        assert q.heartbeat('live-worker', lease_seconds=60) == 1
+        assert q.requeue_expired(max_attempts=3) == 0  # lease còn hạn
+        q.lease('dead-worker')  # không còn gì pending
+        q.conn.execute("UPDATE crawl_queue SET lease_expires = 0")
+        q.requeue_expired(max_attempts=3)
+        [row] = q.collect(RUN)
+        assert row['status'] == 'failed' and row['error'] == 'lease expired'
+        q.close()
+
+
+def test_busy_while_run_open_or_urls_pending():
+    with tempfile.TemporaryDirectory() as tmp:
+        q = _queue(tmp)
+        assert not q.busy()
+        q.touch_run(RUN)  # coordinator còn discovery, chưa enqueue gì
+        assert q.busy()
+        assert not q.busy(lease_seconds=-1)  # heartbeat của run đã cũ
+        q.enqueue(RUN, 'tgdd', ['https://example.com/p1'])
+        q.purge(RUN)
+        assert not q.busy()
+        q.close()
+
+
+def test_retry_db_reconnects_and_backs_off():
+    calls = []
+
+    def flaky():
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise sqlite3.OperationalError('database is locked')
+        return 'ok'
+
+    class Queue:
+        reconnects = 0
+
+        def reconnect(self):
+            self.reconnects += 1
+
+    saved = work_queue.DB_BACKOFF_MAX
+    work_queue.DB_BACKOFF_MAX = 0.01
+    try:
+        q = Queue()
+        assert work_queue._retry_db(q, flaky) == 'ok'
+        assert len(calls) == 3 and q.reconnects == 2
+        calls.clear()
+        try:
+            work_queue._retry_db(q, flaky, attempts=2)
+        except sqlite3.OperationalError:
+            pass
+        else:
+            raise AssertionError('hết lượt thử phải raise lỗi cuối')
+    finally:
+        work_queue.DB_BACKOFF_MAX = saved
+
+
+def test_coordinate_with_local_worker():
+    from extract import crawler, frontier
+
+    pages = {f'https://example.com/p{n}': {'url': f'https://example.com/p{n}', 'price': n} for n in range(6)}
+    pages['https://example.com/filtered'] = None
+    missing = 'https://example.com/missing'
+
+    def fake_fetch_and_parse(url, site_key):
+        if url == missing:
+            return False, None
+        return True, pages[url]
+
+    saved = (crawler.plan_site_urls, crawler._fetch_and_parse, frontier.FRONTIER_ENABLED, work_queue.POLL_SECONDS)
+    crawler.plan_site_urls = lambda site, skip=None: list(pages) + [missing]
+    crawler._fetch_and_parse = fake_fetch_and_parse
+    frontier.FRONTIER_ENABLED = False
+    work_queue.POLL_SECONDS = 0.05
+    items, done, failed = [], [], []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            q = _queue(tmp)
+            collected = work_queue.coordinate(RUN, ['tgdd'], on_item=items.append, on_done=done.append,
+                                              on_failed=lambda url, site, reason: failed.append(url),
+                                              local_worker=True, queue=q)
+            assert collected == len(pages) + 1
+            assert sorted(i['url'] for i in items) == sorted(u for u, item in pages.items() if item)
+            assert sorted(done) == sorted(pages)  # trang bị lọc vẫn checkpoint
+            assert failed == [missing]  # tải lỗi → dead letter, không checkpoint
+            assert q.remaining(RUN) == 0 and not q.busy()
+            q.close()
+    finally:
+        crawler.plan_site_urls, crawler._fetch_and_parse, frontier.FRONTIER_ENABLED, work_queue.POLL_SECONDS = saved
+
+
+if __name__ == '__main__':
+    for name, fn in list(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print(f'{name}: OK')
@@ -1,9 +1,12 @@
 # staging_loader.py
 import os
+import time
+from datetime import date, timedelta
 import pandas as pd
 import pymysql
 from dotenv import load_dotenv
 from pathlib import Path
+from control.log_store import start_process, log_success, log_fail
 
 # Load .env
 BASE_DIR = Path(__file__).resolve().parents[1]
@@ -17,10 +20,33 @@ DB_STAGING_NAME = os.getenv("DB_STAGING_NAME", "staging")
 DB_STAGING_PORT = int(os.getenv("DB_STAGING_PORT", "3306"))
 
 STAGING_TABLE = "staging_laptop_raw"
+STAGING_COLUMNS = ["brand", "product_name", "price", "currency", "source", "url", "timestamp", "sold_count"]
 
+# Cách nạp staging: "batch" = executemany từng lô STAGING_BATCH_SIZE dòng (mặc định),
+# "infile" = LOAD DATA LOCAL INFILE đọc thẳng file CSV (server cần bật local_infile)
+STAGING_LOAD_MODE = os.getenv("STAGING_LOAD_MODE", "batch").lower()
+STAGING_BATCH_SIZE = int(os.getenv("STAGING_BATCH_SIZE", "1000"))
+# Mode batch đọc CSV theo chunk STAGING_CHUNK_ROWS dòng → RAM không phụ thuộc kích thước
+# file (0 = đọc cả file một lần như trước)
+STAGING_CHUNK_ROWS = int(os.getenv("STAGING_CHUNK_ROWS", "50000"))
+# STAGING_SWAP=1: nạp vào bảng shadow rồi RENAME TABLE đổi chỗ (không có lúc staging rỗng),
+# bản trước giữ ở STAGING_FALLBACK_TABLE tới lần nạp sau
+STAGING_SWAP = os.getenv("STAGING_SWAP", "").lower() in ("1", "true", "yes")
+STAGING_SHADOW_TABLE = f"{STAGING_TABLE}_new"
+STAGING_FALLBACK_TABLE = f"{STAGING_TABLE}_old"
+# STAGING_APPEND=1: không xoá staging, mỗi lần nạp là một batch (batch_id = id process_logs
+# của bước staging) nằm trong partition theo ngày; partition cũ hơn STAGING_RETENTION_DAYS
+# ngày bị DROP PARTITION
+STAGING_APPEND = os.getenv("STAGING_APPEND", "").lower() in ("1", "true", "yes")
+STAGING_RETENTION_DAYS = int(os.getenv("STAGING_RETENTION_DAYS", "30"))
 
-def staging_connect():
-    """Kết nối tới DB STAGING."""
+
+def staging_connect(local_infile=False):
+    """Kết nối tới DB STAGING.
+
+    local_infile=True chỉ khi nạp bằng LOAD DATA LOCAL INFILE (mode infile): bật cờ
+    này cho phép server đọc file bất kỳ trên máy client, nên mặc định tắt.
+    """
     conn = pymysql.connect(
         host=DB_STAGING_HOST,
         user=DB_STAGING_USER,
@@ -29,16 +55,27 @@ def staging_connect():
         port=DB_STAGING_PORT,
         charset="utf8mb4",
         cursorclass=pymysql.cursors.DictCursor,
-        autocommit=False
+        autocommit=False,
+        local_infile=local_infile
     )
     return conn
 
 
-def ensure_staging_table(conn):
-    """Tạo bảng staging_laptop_raw nếu chưa có (đúng schema đã dùng)."""
+def ensure_staging_table(conn, append=False):
+    """Tạo bảng staging_laptop_raw nếu chưa có; trả về True nếu bảng có cột batch_id / batch_date.
+
+    Chỉ mode append mới đụng tới schema: bảng mới được tạo có partition (đúng
+    staging_schema.sql), bảng cũ (chưa có batch_id / batch_date) được thêm cột với
+    batch_date của các dòng cũ lấy theo ngày crawl (DATE(timestamp)). Mode truncate / swap
+    tạo bảng mới không partition và giữ nguyên bảng cũ (nạp không kèm cột batch).
+    """
+    partition = """
+    PARTITION BY RANGE COLUMNS (batch_date) (
+        PARTITION pmax VALUES LESS THAN (MAXVALUE)
+    )""" if append else ""
     ddl = f"""
     CREATE TABLE IF NOT EXISTS {STAGING_TABLE} (
-        id INT AUTO_INCREMENT PRIMARY KEY,
+        id INT AUTO_INCREMENT,
         brand VARCHAR(100),
         product_name VARCHAR(255),
         price INT,
@@ -46,53 +83,327 @@ def ensure_staging_table(conn):
         source VARCHAR(50),
         url TEXT,
         timestamp DATETIME,
-        sold_count INT
-    );
+        sold_count INT,
+        batch_id INT NOT NULL DEFAULT 0,
+        batch_date DATE NOT NULL DEFAULT '1970-01-01',
+        PRIMARY KEY (id, batch_date),
+        KEY idx_staging_batch (batch_date, batch_id)
+    ){partition};
     """
     with conn.cursor() as cur:
         cur.execute(ddl)
+        cur.execute(f"SHOW COLUMNS FROM {STAGING_TABLE} LIKE 'batch_id'")
+        if cur.fetchall():
+            return True
+        if append:
+            # Khoá chính phải chứa cột partition → đổi PK trong cùng câu ALTER
+            cur.execute(f"""
+                ALTER TABLE {STAGING_TABLE}
+                    ADD COLUMN batch_id INT NOT NULL DEFAULT 0,
+                    ADD COLUMN batch_date DATE NOT NULL DEFAULT '1970-01-01',
+                    DROP PRIMARY KEY,
+                    ADD PRIMARY KEY (id, batch_date),
+                    ADD KEY idx_staging_batch (batch_date, batch_id)
+            """)
+            # Backfill một lần: không để mọi dòng cũ dồn vào ngày 1970-01-01
+            cur.execute(f"UPDATE {STAGING_TABLE} SET batch_date = DATE(timestamp) WHERE timestamp IS NOT NULL")
+            conn.commit()
+    return append
+
 
+def _partitions(cur):
+    """{tên partition: giới hạn trên (chuỗi ngày hoặc MAXVALUE)} của bảng staging."""
+    cur.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+    """, (STAGING_TABLE,))
+    return {r["PARTITION_NAME"]: r["PARTITION_DESCRIPTION"].strip("'") for r in cur.fetchall()}
 
-def load_to_staging(csv_path: str):
-    # Đọc CSV
-    df = pd.read_csv(csv_path)
 
-    # Ép kiểu numeric an toàn
+def _ensure_partitioned(cur, day):
+    """Bật partition theo ngày cho bảng cũ và đảm bảo có partition p<YYYYMMDD> cho `day`.
+
+    Dòng trong pmax có batch_date < day (bảng cũ vừa partition, hoặc nạp bằng mode
+    không append) được tách vào partition p<day - 1> thay vì bị gom vào partition của
+    `day`; retention tính chúng theo ngày đó nên không bao giờ bị xoá sớm.
+    """
+    parts = _partitions(cur)
+    if not parts:
+        cur.execute(f"""
+            ALTER TABLE {STAGING_TABLE}
+            PARTITION BY RANGE COLUMNS (batch_date) (PARTITION pmax VALUES LESS THAN (MAXVALUE))
+        """)
+        parts = {"pmax": "MAXVALUE"}
+    name = f"p{day:%Y%m%d}"
+    if name not in parts:
+        # REORGANIZE chép lại mọi dòng đang ở pmax: tức thời khi pmax rỗng (ngày thường),
+        # lần đầu partition bảng cũ thì chép cả bảng
+        cur.execute(f"SELECT 1 FROM {STAGING_TABLE} PARTITION (pmax) WHERE batch_date < %s LIMIT 1", (day,))
+        older = ""
+        if cur.fetchall():
+            older = f"PARTITION p{day - timedelta(days=1):%Y%m%d} VALUES LESS THAN ('{day}'),"
+        cur.execute(f"""
+            ALTER TABLE {STAGING_TABLE} REORGANIZE PARTITION pmax INTO (
+                {older}
+                PARTITION {name} VALUES LESS THAN ('{day + timedelta(days=1)}'),
+                PARTITION pmax VALUES LESS THAN (MAXVALUE)
+            )
+        """)
+
+
+def purge_staging_partitions(conn, keep_days=STAGING_RETENTION_DAYS):
+    """DROP PARTITION các ngày cũ hơn keep_days ngày (O(1), không DELETE từng dòng); trả về tên partition đã xoá."""
+    cutoff = date.today() - timedelta(days=keep_days)
+    with conn.cursor() as cur:
+        old = [name for name, bound in _partitions(cur).items()
+               if bound != "MAXVALUE" and date.fromisoformat(bound) <= cutoff]
+        if old:
+            cur.execute(f"ALTER TABLE {STAGING_TABLE} DROP PARTITION {', '.join(old)}")
+    return old
+
+
+def latest_staging_batch(conn):
+    """(batch_id, batch_date) của batch mới nhất trong staging.
+
+    None nếu chưa có batch nào: bảng rỗng, bảng cũ chưa có cột batch, hoặc chỉ có dòng
+    batch_id = 0 (dòng cũ được backfill khi thêm cột, không thuộc lần nạp nào).
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"SHOW COLUMNS FROM {STAGING_TABLE} LIKE 'batch_id'")
+        if not cur.fetchall():
+            return None
+        cur.execute(f"""
+            SELECT batch_id, batch_date FROM {STAGING_TABLE} WHERE batch_id <> 0
+            ORDER BY batch_date DESC, batch_id DESC LIMIT 1
+        """)
+        row = cur.fetchone()
+    return (row["batch_id"], row["batch_date"]) if row else None
+
+
+def _coerce(df):
+    """Ép kiểu numeric an toàn, NaN / chuỗi rỗng → None để MySQL không chửi."""
     df["price"] = pd.to_numeric(df["price"], errors="coerce").fillna(0).astype(int)
     df["sold_count"] = pd.to_numeric(df["sold_count"], errors="coerce").fillna(0).astype(int)
+    df = df.replace({pd.NA: None, pd.NaT: None, "": None}).astype(object).where(pd.notnull(df), None)
+    return df[STAGING_COLUMNS]
 
-    # Xử lý NaN cho toàn bộ DF → None để MySQL không chửi
-    df = df.replace({pd.NA: None, pd.NaT: None, "": None}).where(pd.notnull(df), None)
 
-    conn = staging_connect()
-    print(f"[STAGING] Using DB: {DB_STAGING_NAME}")  # debug cho chắc
+def _iter_frames(csv_path, chunk_rows):
+    if chunk_rows and chunk_rows > 0:
+        yield from pd.read_csv(csv_path, chunksize=chunk_rows)
+    else:
+        yield pd.read_csv(csv_path)
+
+
+def _insert_batches(cur, df, batch_size, table=STAGING_TABLE, batch=None):
+    """executemany theo lô: pymysql gộp mỗi lô thành một câu INSERT nhiều VALUES.
 
-    ensure_staging_table(conn)
+    batch: (batch_id, batch_date) gắn vào mọi dòng; None = bảng cũ không có cột batch.
+    """
+    batch = batch or ()
+    columns = STAGING_COLUMNS + (["batch_id", "batch_date"] if batch else [])
+    sql = f"""
+        INSERT INTO {table}
+            ({", ".join(columns)})
+        VALUES ({",".join(["%s"] * len(columns))})
+    """
+    # itertuples không dựng Series cho từng dòng như iterrows
+    rows = [r + batch for r in df.itertuples(index=False, name=None)]
+    for start in range(0, len(rows), batch_size):
+        cur.executemany(sql, rows[start:start + batch_size])
+    return len(rows)
+
+
+def _line_terminator(csv_path):
+    with open(csv_path, "rb") as f:
+        first = f.readline()
+    return "\\r\\n" if first.endswith(b"\r\n") else "\\n"
 
+
+def _load_infile(cur, csv_path, table=STAGING_TABLE, batch=None):
+    """LOAD DATA LOCAL INFILE: server tự parse CSV, ép kiểu giống _coerce.
+
+    TRUNCATE(x, 0) cắt phần thập phân như astype(int) của _coerce (ROUND sẽ làm tròn);
+    ESCAPED BY '': pandas ghi CSV với "" chứ không escape bằng backslash, nên "\\" trong
+    dữ liệu phải giữ nguyên.
+    """
+    # Bảng cũ chưa có cột batch (mode truncate / swap không migrate) → không SET batch
+    batch_set = """,
+            batch_id = %s,
+            batch_date = %s""" if batch else ""
+    sql = f"""
+        LOAD DATA LOCAL INFILE %s
+        INTO TABLE {table}
+        CHARACTER SET utf8mb4
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+        LINES TERMINATED BY '{_line_terminator(csv_path)}'
+        IGNORE 1 LINES
+        (@brand, @product_name, @price, @currency, @source, @url, @timestamp, @sold_count)
+        SET brand = NULLIF(@brand, ''),
+            product_name = NULLIF(@product_name, ''),
+            price = IF(@price REGEXP '^-?[0-9]+(\\\\.[0-9]+)?$', TRUNCATE(@price, 0), 0),
+            currency = NULLIF(@currency, ''),
+            source = NULLIF(@source, ''),
+            url = NULLIF(@url, ''),
+            timestamp = NULLIF(@timestamp, ''),
+            sold_count = IF(@sold_count REGEXP '^-?[0-9]+(\\\\.[0-9]+)?$', TRUNCATE(@sold_count, 0), 0){batch_set}
+    """
+    cur.execute(sql, (os.path.abspath(csv_path),) + (batch or ()))
+    return cur.rowcount
+
+
+def _secondary_indexes(cur, table):
+    """{tên index: "ADD [UNIQUE] INDEX ..."} cho mọi index (trừ PRIMARY) của bảng, để dựng lại sau khi nạp."""
+    cur.execute(f"SHOW INDEX FROM {table} WHERE Key_name <> 'PRIMARY'")
+    indexes = {}
+    for r in cur.fetchall():
+        idx = indexes.setdefault(r["Key_name"], {"unique": not int(r["Non_unique"]), "cols": {}})
+        col = f"`{r['Column_name']}`" + (f"({r['Sub_part']})" if r.get("Sub_part") else "")
+        idx["cols"][int(r["Seq_in_index"])] = col
+    return {
+        name: f"ADD {'UNIQUE ' if idx['unique'] else ''}INDEX `{name}` "
+              f"({', '.join(c for _, c in sorted(idx['cols'].items()))})"
+        for name, idx in indexes.items()
+    }
+
+
+def _load_rows(cur, csv_path, mode, batch_size, chunk_rows, table, batch):
+    if mode == "infile":
+        return _load_infile(cur, csv_path, table, batch)
+    rows = 0
+    for chunk in _iter_frames(csv_path, chunk_rows):
+        rows += _insert_batches(cur, _coerce(chunk), batch_size, table, batch)
+    return rows
+
+
+def _load_swap(conn, csv_path, mode, batch_size, chunk_rows, batch):
+    """Nạp vào bảng shadow (chưa có index phụ), dựng index một lần, rồi đổi chỗ nguyên tử."""
     with conn.cursor() as cur:
-        # Xóa dữ liệu cũ
-        cur.execute(f"TRUNCATE TABLE {STAGING_TABLE}")
-
-        sql = f"""
-            INSERT INTO {STAGING_TABLE}
-                (brand, product_name, price, currency, source, url, timestamp, sold_count)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-        """
-
-        rows = 0
-        for _, r in df.iterrows():
-            cur.execute(sql, (
-                r["brand"],
-                r["product_name"],
-                int(r["price"]),
-                r["currency"],
-                r["source"],
-                r["url"],
-                r["timestamp"],
-                int(r["sold_count"]) if r["sold_count"] is not None else None,
-            ))
-            rows += 1
+        cur.execute(f"DROP TABLE IF EXISTS {STAGING_SHADOW_TABLE}")
+        cur.execute(f"CREATE TABLE {STAGING_SHADOW_TABLE} LIKE {STAGING_TABLE}")
+        indexes = _secondary_indexes(cur, STAGING_SHADOW_TABLE)
+        if indexes:
+            cur.execute(f"ALTER TABLE {STAGING_SHADOW_TABLE} " + ", ".join(f"DROP INDEX `{n}`" for n in indexes))
+        rows = _load_rows(cur, csv_path, mode, batch_size, chunk_rows, STAGING_SHADOW_TABLE, batch)
+        conn.commit()
+        if indexes:
+            cur.execute(f"ALTER TABLE {STAGING_SHADOW_TABLE} " + ", ".join(indexes.values()))
+        # Bản fallback của lần trước chỉ bị xoá lúc này (lazy), ngay trước khi có bản mới
+        cur.execute(f"DROP TABLE IF EXISTS {STAGING_FALLBACK_TABLE}")
+        # Một câu RENAME cho cả hai bảng → reader luôn thấy staging đầy đủ (cũ hoặc mới)
+        cur.execute(f"RENAME TABLE {STAGING_TABLE} TO {STAGING_FALLBACK_TABLE}, "
+                    f"{STAGING_SHADOW_TABLE} TO {STAGING_TABLE}")
+    return rows
+
+
+def restore_staging_fallback():
+    """Đổi staging về bản của lần nạp trước (bản hiện tại thành fallback)."""
+    conn = staging_connect()
+    try:
+        with conn.cursor() as cur:
+            tmp = f"{STAGING_TABLE}_swap"
+            cur.execute(f"RENAME TABLE {STAGING_TABLE} TO {tmp}, {STAGING_FALLBACK_TABLE} TO {STAGING_TABLE}, "
+                        f"{tmp} TO {STAGING_FALLBACK_TABLE}")
+    finally:
+        conn.close()
+
+
+def drop_staging_fallback():
+    """Xoá bản fallback khi chắc chắn không cần quay lại."""
+    conn = staging_connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {STAGING_FALLBACK_TABLE}")
+    finally:
+        conn.close()
+
 
+def _load_append(conn, csv_path, mode, batch_size, chunk_rows, batch):
+    """Thêm batch vào partition của ngày nạp; nạp lại cùng batch_id thì thay batch cũ."""
+    batch_id, day = batch
+    with conn.cursor() as cur:
+        _ensure_partitioned(cur, day)
+        cur.execute(f"DELETE FROM {STAGING_TABLE} WHERE batch_date = %s AND batch_id = %s", (day, batch_id))
+        rows = _load_rows(cur, csv_path, mode, batch_size, chunk_rows, STAGING_TABLE, batch)
     conn.commit()
-    conn.close()
+    dropped = purge_staging_partitions(conn)
+    if dropped:
+        print(f"[STAGING] Retention {STAGING_RETENTION_DAYS} ngày: xoá partition {', '.join(dropped)}")
+    return rows
+
+
+def load_to_staging(csv_path: str, mode: str = None, batch_size: int = None, chunk_rows: int = None,
+                    swap: bool = None, append: bool = None, batch_id: int = None):
+    """Nạp raw CSV vào staging_laptop_raw (xoá dữ liệu cũ), trả về số dòng.
+
+    mode: "batch" hoặc "infile" (mặc định STAGING_LOAD_MODE); in ra tốc độ rows/s
+    để chọn cách nạp phù hợp từng môi trường. Mode batch đọc + ép kiểu + insert từng
+    chunk chunk_rows dòng (mặc định STAGING_CHUNK_ROWS), mọi chunk chung một transaction.
+    swap=True (mặc định STAGING_SWAP): nạp vào bảng shadow rồi RENAME TABLE thay vì
+    TRUNCATE + nạp lại tại chỗ; bản trước còn trong STAGING_FALLBACK_TABLE.
+    append=True (mặc định STAGING_APPEND): giữ các batch trước trong partition theo ngày.
+    Mọi mode gắn batch_id (mặc định id process_logs "staging" của lần nạp này) và
+    batch_date = hôm nay vào các dòng, trừ bảng cũ chưa có cột batch ở mode không append.
+    """
+    mode = (mode or STAGING_LOAD_MODE).lower()
+    batch_size = batch_size or STAGING_BATCH_SIZE
+    chunk_rows = STAGING_CHUNK_ROWS if chunk_rows is None else chunk_rows
+    swap = STAGING_SWAP if swap is None else swap
+    append = STAGING_APPEND if append is None else append
+    if append:
+        swap = False
+    if mode not in ("batch", "infile"):
+        raise ValueError(f"STAGING_LOAD_MODE không hợp lệ: {mode}")
+
+    conn = staging_connect(local_infile=mode == "infile")
+    print(f"[STAGING] Using DB: {DB_STAGING_NAME}")  # debug cho chắc
+
+    batched = ensure_staging_table(conn, append)
+
+    log_id = None
+    if batch_id is None:
+        try:
+            log_id = start_process("staging", f"Staging {os.path.basename(csv_path)}")
+            batch_id = log_id
+        except Exception as exc:
+            batch_id = int(time.time())
+            print(f"[STAGING] Không ghi được log control ({exc}) → batch_id={batch_id}")
+    # Mọi mode đều có batch_id thật → latest_staging_batch không nhầm giữa truncate và append
+    batch = (batch_id, date.today()) if batched else None
+
+    t0 = time.perf_counter()
+    try:
+        if append:
+            rows = _load_append(conn, csv_path, mode, batch_size, chunk_rows, batch)
+        elif swap:
+            rows = _load_swap(conn, csv_path, mode, batch_size, chunk_rows, batch)
+        else:
+            with conn.cursor() as cur:
+                # Xóa dữ liệu cũ
+                cur.execute(f"TRUNCATE TABLE {STAGING_TABLE}")
+                rows = _load_rows(cur, csv_path, mode, batch_size, chunk_rows, STAGING_TABLE, batch)
+            conn.commit()
+    except Exception as exc:
+        conn.rollback()
+        if log_id:
+            try:
+                log_fail(log_id, f"Staging failed: {exc}")
+            except Exception as log_exc:
+                # không để lỗi ghi log che mất lỗi nạp thật
+                print(f"[STAGING] Không ghi được log_fail ({log_exc})")
+        if swap:
+            # Bảng đang dùng chưa bị đụng tới; bỏ shadow dở dang
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f"DROP TABLE IF EXISTS {STAGING_SHADOW_TABLE}")
+            except Exception:
+                pass
+        raise
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - t0
+    if log_id:
+        log_success(log_id, f"Staging success: {rows} rows (batch {batch_id})")
+    print(f"[STAGING] {mode}{' + swap' if swap else ''}{f' + append batch {batch_id}' if append else ''}: {rows} rows trong {elapsed:.2f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)")
     return rows
@@ -1,5 +1,5 @@
 CREATE TABLE staging_laptop_raw (
-    id INT AUTO_INCREMENT PRIMARY KEY,
+    id INT AUTO_INCREMENT,
     brand VARCHAR(100),
     product_name VARCHAR(255),
     price INT,
@@ -7,5 +7,16 @@ CREATE TABLE staging_laptop_raw (
     source VARCHAR(50),
     url TEXT,
     timestamp DATETIME,
-    sold_count INT
+    sold_count INT,
+    -- batch_id = process_logs.id (control) của bước staging đã nạp dòng này
+    batch_id INT NOT NULL DEFAULT 0,
+    batch_date DATE NOT NULL DEFAULT '1970-01-01',
+    PRIMARY KEY (id, batch_date),
+    KEY idx_staging_batch (batch_date, batch_id)
+)
+-- Mỗi ngày một partition p<YYYYMMDD>, staging_loader tách ra từ pmax khi nạp (STAGING_APPEND=1)
+-- và DROP PARTITION các ngày cũ hơn STAGING_RETENTION_DAYS. Nạp truncate / swap tạo bảng không
+-- partition; lần nạp append đầu tiên mới bật partition
+PARTITION BY RANGE COLUMNS (batch_date) (
+    PARTITION pmax VALUES LESS THAN (MAXVALUE)
 );
@@ -2,6 +2,9 @@
 # -*- coding: utf-8 -*-
 """
 Script chạy riêng bước Transform với logging cấu trúc giống run_daily.bat.
+
+Chạy: python transform/run_transform.py [raw.csv | --staging]
+--staging: đọc thẳng staging_laptop_raw (batch mới nhất) thay vì file raw.
 """
 
 import os
@@ -30,7 +33,9 @@ def find_latest_raw_csv() -> Optional[str]:
 
 
 def main():
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 1 and sys.argv[1] == "--staging":
+        csv_path = None
+    elif len(sys.argv) > 1:
         csv_path = sys.argv[1]
     else:
         csv_path = find_latest_raw_csv()
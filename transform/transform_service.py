@@ -1,13 +1,19 @@
 import os
 import logging
+from contextlib import closing
 from datetime import datetime
 import pandas as pd
+import pymysql
 
 from transform.clean_transform import clean_dataframe
+from transform.db_connect import staging_connect
+from staging.staging_loader import STAGING_TABLE, STAGING_COLUMNS, latest_staging_batch
 from control.log_store import start_process, log_success, log_fail
 
 LOG_DIR = "logs"
 OUTPUT_DIR = "data_output"
+# Số dòng mỗi lần fetchmany khi transform đọc thẳng từ staging
+TRANSFORM_CHUNK_ROWS = int(os.getenv("TRANSFORM_CHUNK_ROWS", "50000"))
 os.makedirs(LOG_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
@@ -28,20 +34,89 @@ def _build_logger():
 
 logger = _build_logger()
 
-def run_transform(csv_path=None, *, return_output_path=False):
-    """Transform dữ liệu từ staging hoặc từ CSV."""
+def iter_staging_chunks(latest_batch=True, chunk_rows=TRANSFORM_CHUNK_ROWS):
+    """Đọc staging_laptop_raw bằng cursor server-side (SSDictCursor), mỗi lần chunk_rows dòng.
+
+    latest_batch=True: chỉ batch mới nhất (batch_date, batch_id) → MySQL chỉ quét một partition
+    (cả bảng nếu staging chưa có batch nào).
+    Không ORDER BY (clean_dataframe không phụ thuộc thứ tự) để tránh filesort cả batch.
+    Caller nên dùng contextlib.closing: bỏ dở generator thì cursor / kết nối vẫn được đóng.
+    """
+    conn = staging_connect()
+    try:
+        where, params = "", ()
+        if latest_batch:
+            batch = latest_staging_batch(conn)
+            if batch:
+                batch_id, batch_date = batch
+                where, params = " WHERE batch_date = %s AND batch_id = %s", (batch_date, batch_id)
+                logger.info("Staging batch %s (%s)", batch_id, batch_date)
+            else:
+                # Bảng rỗng / bảng cũ chưa có cột batch (chỉ nạp bằng truncate) → đọc cả bảng
+                logger.info("Staging chưa có batch, đọc cả bảng")
+        # Cursor không buffer: server gửi dần từng dòng, client chỉ giữ một chunk
+        cur = conn.cursor(pymysql.cursors.SSDictCursor)
+        try:
+            cur.execute(f"SELECT {', '.join(STAGING_COLUMNS)} FROM {STAGING_TABLE}{where}", params)
+            while True:
+                rows = cur.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=STAGING_COLUMNS)
+        finally:
+            cur.close()
+    finally:
+        conn.close()
+
+def _transform_staging(out_path, latest_batch, chunk_rows, collect):
+    """Clean từng chunk staging và ghi nối vào out_path; trả về (df_clean hoặc None, số dòng)."""
+    rows, frames = 0, []
+    # closing: clean_dataframe lỗi giữa chừng thì generator vẫn đóng SSCursor + kết nối ngay
+    with closing(iter_staging_chunks(latest_batch, chunk_rows)) as chunks:
+        for chunk in chunks:
+            part = clean_dataframe(chunk)
+            part.to_csv(out_path, mode="a" if rows else "w", header=not rows, index=False,
+                        encoding="utf-8" if rows else "utf-8-sig")
+            rows += len(part)
+            if collect:
+                frames.append(part)
+            logger.info("Staging chunk: %d dòng (tổng %d)", len(part), rows)
+    df_clean = pd.concat(frames, ignore_index=True) if frames else None
+    return df_clean, rows
+
+def run_transform(csv_path=None, *, return_output_path=False, latest_batch=True,
+                  chunk_rows=TRANSFORM_CHUNK_ROWS, collect=True):
+    """Transform dữ liệu từ staging hoặc từ CSV.
+
+    Không truyền csv_path → đọc thẳng staging_laptop_raw (batch mới nhất nếu
+    latest_batch) qua cursor server-side theo chunk chunk_rows dòng, clean và ghi
+    nối từng chunk ra clean CSV. collect=False: không gom DataFrame trong RAM, trả
+    về số dòng thay cho df_clean (dùng cho bảng lớn hơn RAM).
+    """
     
     # BẮT ĐẦU GHI LOG
     log_id = start_process("transform", "Transform started")
     logger.info("=== BẮT ĐẦU TRANSFORM ===")
 
     try:
+        if not csv_path:
+            logger.info("Đọc trực tiếp từ staging (%s)", STAGING_TABLE)
+            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+            out_path = os.path.join(OUTPUT_DIR, f"clean_laptop_{ts}.csv")
+            df_clean, rows = _transform_staging(out_path, latest_batch, chunk_rows, collect)
+            if rows == 0:
+                raise ValueError("Staging trống, không thể transform")
+            logger.info("Clean xong: %d dòng hợp lệ", rows)
+            logger.info("Lưu clean CSV → %s", out_path)
+            log_success(log_id, "Transform success (staging)")
+            result = df_clean if collect else rows
+            if return_output_path:
+                return result, out_path
+            return result
+
         # --- 1. Đọc dữ liệu ---
-        if csv_path:
-            logger.info("Đọc CSV raw: %s", csv_path)
-            df = pd.read_csv(csv_path)
-        else:
-            raise ValueError("Transform hiện yêu cầu csv_path")
+        logger.info("Đọc CSV raw: %s", csv_path)
+        df = pd.read_csv(csv_path)
 
         if df.empty:
             raise ValueError("DataFrame trống, không thể transform")